@@ -0,0 +1,798 @@
+#!/usr/bin/env python
+#
+# ******************************************************************************
+#
+# 6502 MINI-ASSEMBLER
+#
+# Written by Mark Moxon
+#
+# This module assembles 6502 source code in BeebAsm syntax, so the flicker-free
+# routines can be assembled without running BeebAsm, and so the patch
+# manifests can contain assembly language rather than hand-encoded opcodes.
+#
+# It supports the subset of BeebAsm that the flicker-free source files use:
+#
+#   * Labels (.label), symbols (NAME = expr) and the P% program counter
+#
+#   * The documented 6502 instructions (see mos6502.py), with zero page
+#     addressing chosen automatically and branch offsets worked out from the
+#     branch targets
+#
+#   * The ORG, GUARD, SAVE, EQUB, EQUW, EQUS, SKIP, ALIGN, INCBIN and PRINT
+#     directives, and MACRO/ENDMACRO
+#
+#   * Expressions containing decimal, $hex, &hex and %binary numbers,
+#     characters in single quotes, the + - * / DIV MOD << >> AND OR EOR
+#     operators, the < (low byte) and > (high byte) operators, and the LO, HI
+#     and TIME$ functions
+#
+#   * Comments starting with ; or \, and multiple statements on a line
+#     separated by colons
+#
+# Like BeebAsm, the source is assembled in more than one pass, so labels can
+# be used before they are defined. Any symbol that isn't defined yet is
+# assumed to be a 16-bit address, and we keep assembling until the symbols
+# stop changing, at which point we do one final pass that reports any errors
+# and produces the output.
+#
+# There are two ways to use it:
+#
+#   * assemble(source, origin, symbols) assembles a snippet of code at the
+#     given address and returns the bytes, for use in patches
+#
+#   * assemble_file(path, output_folder) assembles a source file and saves
+#     each file listed in a SAVE directive into the output folder
+#
+# Run this script with:
+#
+#   python asm6502.py -i <source file> [-v] [-o <output folder>]
+#
+# to assemble a source file in the same way as BeebAsm, where -v prints a
+# listing of the assembled code.
+#
+# ******************************************************************************
+
+from __future__ import print_function
+import argparse
+import os
+import re
+import sys
+import time
+import mos6502
+
+
+# The exception raised for errors in the source code
+
+class AsmError(Exception):
+    pass
+
+
+# The exception raised when an expression refers to a symbol that isn't
+# defined yet (which is only an error in the final pass)
+
+class UndefinedSymbol(AsmError):
+    pass
+
+
+# The tokens in an expression, in the order we try to match them
+
+TOKEN = re.compile(r"""
+    \s*(?:
+        (?P<hex>[$&][0-9A-Fa-f]+)
+      | (?P<binary>%[01]+)
+      | (?P<decimal>[0-9]+)
+      | (?P<char>'.')
+      | (?P<string>"[^"]*")
+      | (?P<name>[A-Za-z_][A-Za-z0-9_]*[%$]?)
+      | (?P<operator><<|>>|[-+*/()<>,~])
+    )""", re.VERBOSE)
+
+# The binary operators that are written as words, and the precedence of each
+# binary operator (higher numbers bind more tightly)
+
+WORD_OPERATORS = ("AND", "OR", "EOR", "DIV", "MOD")
+
+PRECEDENCE = {
+    "OR": 1, "EOR": 1,
+    "AND": 2,
+    "+": 3, "-": 3,
+    "*": 4, "/": 4, "DIV": 4, "MOD": 4, "<<": 4, ">>": 4,
+}
+
+# The maximum number of passes before we give up trying to resolve the
+# symbols
+
+MAX_PASSES = 10
+
+
+# Split a string at a separator, ignoring any separators inside quotes or
+# brackets
+
+def split_outside(text, separator):
+    parts = []
+    depth = 0
+    quote = None
+    start = 0
+
+    for n, char in enumerate(text):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in "\"'":
+            # A single quote is only a character literal if it is followed by
+            # a character and another single quote
+
+            if char == '"' or text[n + 2:n + 3] == "'":
+                quote = char
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == separator and depth == 0:
+            parts.append(text[start:n])
+            start = n + 1
+
+    parts.append(text[start:])
+    return parts
+
+
+# Return a line of source code with any comment removed
+
+def strip_comment(line):
+    quote = None
+
+    for n, char in enumerate(line):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char == '"' or (char == "'" and line[n + 2:n + 3] == "'"):
+            quote = char
+        elif char in ";\\":
+            return line[:n]
+
+    return line
+
+
+# Convert a string into a list of tokens, where each token is a (type, value)
+# tuple
+
+def tokenize(text):
+    tokens = []
+    position = 0
+    text = text.rstrip()
+
+    while position < len(text):
+        match = TOKEN.match(text, position)
+
+        if not match or match.end() == position:
+            raise AsmError("Bad expression: {}".format(text))
+
+        kind = match.lastgroup
+        value = match.group(kind)
+
+        if kind == "name" and value.upper() in WORD_OPERATORS:
+            kind, value = "operator", value.upper()
+
+        tokens.append((kind, value))
+        position = match.end()
+
+    return tokens
+
+
+# An expression parser, which evaluates a list of tokens using a function
+# that looks up symbols
+
+class Expression(object):
+
+    def __init__(self, tokens, lookup, now):
+        self.tokens = tokens
+        self.lookup = lookup
+        self.now = now
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None)
+
+    def take(self, value=None):
+        token = self.peek()
+
+        if token[0] is None or (value is not None and token[1] != value):
+            raise AsmError("Expected {}".format(value or "a value"))
+
+        self.position += 1
+        return token
+
+    # Parse a binary expression, only consuming operators with at least the
+    # given precedence
+
+    def binary(self, precedence=1):
+        left = self.unary()
+
+        while True:
+            kind, operator = self.peek()
+
+            if kind != "operator" or PRECEDENCE.get(operator, 0) < precedence:
+                return left
+
+            self.take()
+            right = self.binary(PRECEDENCE[operator] + 1)
+            left = self.apply(operator, left, right)
+
+    def apply(self, operator, left, right):
+        if operator == "+":
+            return left + right
+        if operator == "-":
+            return left - right
+        if operator == "*":
+            return left * right
+        if operator in ("/", "DIV"):
+            if right == 0:
+                raise AsmError("Division by zero")
+            return int(left / right)
+        if operator == "MOD":
+            if right == 0:
+                raise AsmError("Division by zero")
+            return left % right
+        if operator == "<<":
+            return left << right
+        if operator == ">>":
+            return left >> right
+        if operator == "AND":
+            return left & right
+        if operator == "OR":
+            return left | right
+        return left ^ right
+
+    def unary(self):
+        kind, value = self.peek()
+
+        if kind == "operator" and value in ("-", "+", "<", ">", "~"):
+            self.take()
+            operand = self.unary()
+
+            return {
+                "-": -operand,
+                "+": operand,
+                "<": operand & 0xFF,
+                ">": (operand >> 8) & 0xFF,
+                "~": ~operand,
+            }[value]
+
+        return self.primary()
+
+    def primary(self):
+        kind, value = self.take()
+
+        if kind == "hex":
+            return int(value[1:], 16)
+        if kind == "binary":
+            return int(value[1:], 2)
+        if kind == "decimal":
+            return int(value)
+        if kind == "char":
+            return ord(value[1])
+        if kind == "string":
+            return value[1:-1]
+
+        if kind == "operator" and value == "(":
+            result = self.binary()
+            self.take(")")
+            return result
+
+        if kind == "name":
+            function = value.upper()
+
+            if function in ("LO", "HI", "TIME$") and self.peek()[1] == "(":
+                self.take("(")
+                argument = self.binary()
+                self.take(")")
+
+                if function == "LO":
+                    return argument & 0xFF
+                if function == "HI":
+                    return (argument >> 8) & 0xFF
+                return time.strftime(argument, self.now)
+
+            return self.lookup(value)
+
+        raise AsmError("Unexpected {}".format(value))
+
+    def evaluate(self):
+        result = self.binary()
+
+        if self.position != len(self.tokens):
+            raise AsmError("Unexpected {}".format(self.peek()[1]))
+
+        return result
+
+
+# A 6502 assembler, which keeps the symbols and the assembled memory between
+# passes
+
+class Assembler(object):
+
+    def __init__(self, symbols=None, folder="."):
+        self.predefined = dict(symbols or {})
+        self.folder = folder
+        self.now = time.localtime()
+        self.previous = {}
+
+    # Look up a symbol, checking the macro scopes first, then the symbols
+    # defined so far in this pass, then the symbols from the last pass
+
+    def lookup(self, name):
+        if name == "P%":
+            return self.pc
+
+        for scope in reversed(self.scopes):
+            if name in scope:
+                return scope[name]
+
+        if name in self.symbols:
+            return self.symbols[name]
+
+        if name in self.previous:
+            return self.previous[name]
+
+        raise UndefinedSymbol("Symbol not defined: {}".format(name))
+
+    # Evaluate an expression, returning None if it contains a symbol that
+    # isn't defined yet (unless this is the final pass)
+
+    def evaluate(self, text, allow_undefined=True):
+        try:
+            return Expression(tokenize(text), self.lookup,
+                              self.now).evaluate()
+        except UndefinedSymbol:
+            if self.final or not allow_undefined:
+                raise
+            self.undefined = True
+            return None
+
+    # Evaluate an expression that must be a number
+
+    def number(self, text):
+        value = self.evaluate(text)
+
+        if value is not None and not isinstance(value, int):
+            raise AsmError("Expected a number: {}".format(text))
+
+        return value
+
+    def define(self, name, value):
+        if name in self.symbols:
+            raise AsmError("Symbol already defined: {}".format(name))
+
+        self.symbols[name] = value
+
+    # Write bytes at the program counter, checking for guards and for code
+    # that has already been assembled
+
+    def emit(self, data, line):
+        start = self.pc
+
+        for value in data:
+            if self.pc > 0xFFFF:
+                raise AsmError("Assembled past the end of memory")
+
+            if self.final:
+                if self.pc in self.guards:
+                    raise AsmError("Guard puller at ${:04X}".format(self.pc))
+
+                if self.used[self.pc]:
+                    raise AsmError(
+                        "Trying to assemble over existing code at "
+                        "${:04X}".format(self.pc)
+                    )
+
+            self.memory[self.pc] = value & 0xFF
+            self.used[self.pc] = 1
+            self.pc += 1
+
+        self.low = min(self.low, start)
+        self.high = max(self.high, self.pc)
+
+        if self.final and data:
+            self.listing.append((start, bytes(data), line))
+
+    # Assemble a list of (line number, line) tuples from a source file
+
+    def run_pass(self, lines, origin, final):
+        self.final = final
+        self.symbols = dict(self.predefined)
+        self.scopes = []
+        self.macros = {}
+        self.memory = bytearray(0x10000)
+        self.used = bytearray(0x10000)
+        self.guards = set()
+        self.pc = origin
+        self.low = 0x10000
+        self.high = 0
+        self.saves = []
+        self.listing = []
+        self.undefined = False
+
+        self.assemble_lines(lines)
+
+        if self.macro is not None:
+            raise AsmError("MACRO without ENDMACRO")
+
+    def assemble_lines(self, lines):
+        self.macro = None
+
+        for filename, number, line in lines:
+            try:
+                self.assemble_line(filename, number, line)
+            except AsmError as error:
+                if isinstance(error, UndefinedSymbol) and not self.final:
+                    self.undefined = True
+                    continue
+
+                if getattr(error, "located", False):
+                    raise
+
+                located = AsmError("{}:{}: {}".format(filename, number,
+                                                      error))
+                located.located = True
+                raise located from None
+
+    def assemble_line(self, filename, number, line):
+        text = strip_comment(line).strip()
+
+        # Collect the lines of a macro definition until we reach ENDMACRO
+
+        if self.macro is not None:
+            if text.upper() == "ENDMACRO":
+                name, parameters, body = self.macro
+                self.macros[name] = (parameters, body)
+                self.macro = None
+            else:
+                self.macro[2].append((filename, number, line))
+            return
+
+        for statement in split_outside(text, ":"):
+            self.assemble_statement(statement.strip(), filename, number,
+                                    line)
+
+    def assemble_statement(self, statement, filename, number, line):
+        if not statement:
+            return
+
+        # Labels
+
+        if statement.startswith("."):
+            match = re.match(r"\.([A-Za-z_][A-Za-z0-9_]*)\s*(.*)$",
+                             statement)
+
+            if not match:
+                raise AsmError("Bad label: {}".format(statement))
+
+            self.define(match.group(1), self.pc)
+            self.assemble_statement(match.group(2), filename, number, line)
+            return
+
+        # Symbol assignments
+
+        match = re.match(r"([A-Za-z_][A-Za-z0-9_]*%?)\s*=\s*(.+)$", statement)
+
+        if match:
+            value = self.evaluate(match.group(2))
+
+            if match.group(1) == "P%":
+                self.pc = value
+            elif value is not None:
+                self.define(match.group(1), value)
+
+            return
+
+        parts = statement.split(None, 1)
+        keyword = parts[0].upper()
+        operand = parts[1].strip() if len(parts) > 1 else ""
+
+        if keyword in mos6502.INSTRUCTIONS:
+            self.emit(self.instruction(keyword, operand), line)
+        elif keyword == "MACRO":
+            macro = operand.split(None, 1)
+            parameters = [parameter.strip() for parameter in
+                          split_outside(macro[1], ",")] if len(macro) > 1 \
+                else []
+            self.macro = (macro[0], parameters, [])
+        elif parts[0] in self.macros:
+            self.expand_macro(parts[0], operand)
+        else:
+            self.directive(keyword, operand, line)
+
+    def expand_macro(self, name, operand):
+        parameters, body = self.macros[name]
+        arguments = split_outside(operand, ",") if operand else []
+
+        if len(arguments) != len(parameters):
+            raise AsmError("Wrong number of arguments to {}".format(name))
+
+        self.scopes.append(dict(
+            (parameter, self.evaluate(argument))
+            for parameter, argument in zip(parameters, arguments)
+        ))
+
+        macro = self.macro
+        self.macro = None
+
+        for filename, number, line in body:
+            self.assemble_line(filename, number, line)
+
+        self.macro = macro
+        self.scopes.pop()
+
+    # Return the bytes for a list of EQUB, EQUW or EQUS values
+
+    def data(self, operand, size):
+        result = []
+
+        for item in split_outside(operand, ","):
+            value = self.evaluate(item.strip())
+
+            if isinstance(value, str):
+                result.extend(ord(char) for char in value)
+            elif value is None:
+                result.extend([0] * size)
+            else:
+                if self.final and not -(1 << (8 * size - 1)) <= value \
+                        < (1 << (8 * size)):
+                    raise AsmError("Value out of range: {}".format(item))
+
+                for n in range(size):
+                    result.append((value >> (8 * n)) & 0xFF)
+
+        return result
+
+    def directive(self, keyword, operand, line):
+        if keyword == "ORG":
+            self.pc = self.number(operand)
+
+            if self.pc is None:
+                raise AsmError("ORG must be defined in the first pass")
+
+        elif keyword == "GUARD":
+            self.guards.add(self.number(operand))
+
+        elif keyword in ("EQUB", "EQUS"):
+            self.emit(self.data(operand, 1), line)
+
+        elif keyword == "EQUW":
+            self.emit(self.data(operand, 2), line)
+
+        elif keyword == "SKIP":
+            self.pc += self.number(operand) or 0
+
+        elif keyword == "ALIGN":
+            alignment = self.number(operand)
+            self.pc = (self.pc + alignment - 1) // alignment * alignment
+
+        elif keyword == "INCBIN":
+            path = os.path.join(self.folder, self.evaluate(operand))
+
+            with open(path, "rb") as f:
+                self.emit(f.read(), line)
+
+        elif keyword == "SAVE":
+            arguments = split_outside(operand, ",")
+
+            if len(arguments) < 3:
+                raise AsmError("SAVE needs a filename, start and end")
+
+            self.saves.append((self.evaluate(arguments[0].strip()),
+                               self.number(arguments[1]),
+                               self.number(arguments[2])))
+
+        elif keyword == "PRINT":
+            if self.final:
+                print(" ".join(str(self.evaluate(item.strip()))
+                               for item in split_outside(operand, ",")))
+
+        else:
+            raise AsmError("Unknown instruction or directive: {}".format(
+                keyword
+            ))
+
+    # Return the bytes for an instruction
+
+    def instruction(self, mnemonic, operand):
+        modes = mos6502.INSTRUCTIONS[mnemonic]
+
+        if operand == "" or operand.upper() == "A" and "acc" in modes:
+            mode = "acc" if "acc" in modes else "imp"
+            if mode not in modes:
+                raise AsmError("{} needs an operand".format(mnemonic))
+            return [modes[mode]]
+
+        if operand.startswith("#"):
+            return self.encode(mnemonic, "imm", self.number(operand[1:]))
+
+        if "rel" in modes:
+            target = self.number(operand)
+
+            if target is None:
+                return [modes["rel"], 0]
+
+            offset = target - (self.pc + 2)
+
+            if self.final and not -128 <= offset <= 127:
+                raise AsmError("Branch out of range")
+
+            return [modes["rel"], offset & 0xFF]
+
+        match = re.match(r"\((.*),\s*[Xx]\s*\)$", operand)
+
+        if match:
+            return self.encode(mnemonic, "indx", self.number(match.group(1)))
+
+        match = re.match(r"\((.*)\)\s*,\s*[Yy]$", operand)
+
+        if match:
+            return self.encode(mnemonic, "indy", self.number(match.group(1)))
+
+        match = re.match(r"\((.*)\)$", operand)
+
+        if match and "ind" in modes:
+            return self.encode(mnemonic, "ind", self.number(match.group(1)))
+
+        match = re.match(r"(.*),\s*([XxYy])$", operand)
+
+        if match:
+            index = match.group(2).lower()
+            value = self.number(match.group(1))
+            return self.encode(mnemonic, self.choose(modes, "zp" + index,
+                                                     "abs" + index, value),
+                               value)
+
+        value = self.number(operand)
+        return self.encode(mnemonic, self.choose(modes, "zp", "abs", value),
+                           value)
+
+    # Choose between the zero page and absolute versions of an addressing
+    # mode, using zero page if the value fits (and assuming a 16-bit address
+    # if the value isn't known yet)
+
+    def choose(self, modes, zero_page, absolute, value):
+        if zero_page in modes and (absolute not in modes or (
+                value is not None and 0 <= value < 0x100)):
+            return zero_page
+
+        if absolute not in modes:
+            raise AsmError("Bad addressing mode")
+
+        return absolute
+
+    def encode(self, mnemonic, mode, value):
+        modes = mos6502.INSTRUCTIONS[mnemonic]
+
+        if mode not in modes:
+            raise AsmError("{} does not support this addressing mode".format(
+                mnemonic
+            ))
+
+        size = mos6502.MODE_SIZES[mode]
+
+        if value is None:
+            value = 0
+
+        if self.final:
+            if size == 2 and not -128 <= value <= 0xFF:
+                raise AsmError("Value out of range: {}".format(value))
+            if size == 3 and not 0 <= value <= 0xFFFF:
+                raise AsmError("Address out of range: {}".format(value))
+
+        if size == 2:
+            return [modes[mode], value & 0xFF]
+
+        return [modes[mode], value & 0xFF, (value >> 8) & 0xFF]
+
+    # Assemble a list of (filename, line number, line) tuples, running passes
+    # until the symbols stop changing, followed by a final pass
+
+    def assemble(self, lines, origin=0):
+        for _ in range(MAX_PASSES):
+            self.run_pass(lines, origin, False)
+
+            if self.symbols == self.previous:
+                break
+
+            self.previous = self.symbols
+        else:
+            raise AsmError("Symbols did not settle after {} passes".format(
+                MAX_PASSES
+            ))
+
+        self.run_pass(lines, origin, True)
+
+    # Return a dictionary of the files listed in SAVE directives, keyed by
+    # filename
+
+    def outputs(self):
+        return dict((filename, bytes(self.memory[start:end]))
+                    for filename, start, end in self.saves)
+
+
+# Split source code into a list of (filename, line number, line) tuples
+
+def source_lines(source, filename="<source>"):
+    return [(filename, number, line)
+            for number, line in enumerate(source.splitlines(), 1)]
+
+
+# Assemble a snippet of code at the given address, returning the bytes, where
+# symbols is an optional dictionary of symbols that the code can refer to
+
+def assemble(source, origin, symbols=None):
+    assembler = Assembler(symbols)
+    assembler.assemble(source_lines(source), origin)
+
+    if assembler.high <= assembler.low:
+        return b""
+
+    return bytes(assembler.memory[assembler.low:assembler.high])
+
+
+# Assemble a source file, save each file listed in a SAVE directive into the
+# output folder (creating it if it doesn't exist), and return the assembler
+# (so the caller can print the listing)
+
+def assemble_file(path, output_folder=".", symbols=None):
+    with open(path) as f:
+        source = f.read()
+
+    assembler = Assembler(symbols, os.path.dirname(os.path.abspath(path)))
+    assembler.assemble(source_lines(source, os.path.basename(path)))
+    os.makedirs(output_folder, exist_ok=True)
+
+    for filename, data_block in sorted(assembler.outputs().items()):
+        with open(os.path.join(output_folder, filename), "wb") as f:
+            f.write(data_block)
+
+    return assembler
+
+
+# Return the listing from an assembler as a list of strings
+
+def listing(assembler):
+    lines = []
+
+    for address, data_block, line in assembler.listing:
+        for n in range(0, len(data_block), 3):
+            lines.append("{:04X}   {:<9} {}".format(
+                address + n,
+                " ".join("{:02X}".format(value)
+                         for value in data_block[n:n + 3]),
+                line.rstrip() if n == 0 else ""
+            ).rstrip())
+
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Assemble 6502 source code")
+    parser.add_argument("-i", dest="source", required=True,
+                        help="source file to assemble")
+    parser.add_argument("-o", dest="output", default=".",
+                        help="folder for the saved files (default: .)")
+    parser.add_argument("-v", dest="verbose", action="store_true",
+                        help="print a listing of the assembled code")
+    args = parser.parse_args()
+
+    try:
+        assembler = assemble_file(args.source, args.output)
+    except (AsmError, IOError) as error:
+        print("Error: {}".format(error))
+        sys.exit(1)
+
+    if args.verbose:
+        print("\n".join(listing(assembler)))
+
+    for filename, start, end in assembler.saves:
+        print("Saving file '{}'".format(filename))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+#
+# ******************************************************************************
+#
+# CONTENT-ADDRESSED BUILD CACHE
+#
+# Written by Mark Moxon
+#
+# This module stores the outputs of build steps in a cache folder, keyed by a
+# hash of everything that goes into the step: the contents of the input files
+# (such as the original disk image, the assembly source or the patching
+# scripts), the tools that run the step (hashed from their executables, so a
+# new version of BeebAsm or Python gives a new key) and the step's arguments.
+# If a step is run again with the same inputs, its outputs are copied out of
+# the cache instead of running the step.
+#
+# Each cache entry is a folder named after its key, containing the output
+# files. Whenever an entry is stored or used, its modification time is updated,
+# so when the cache grows past its size limit, the least recently used entries
+# are deleted first.
+#
+# ******************************************************************************
+
+from __future__ import print_function
+import hashlib
+import os
+import shutil
+
+
+# The default size limit for the cache, in bytes
+
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+# The hashes of files we have already hashed, keyed by (path, size, mtime), so
+# files that are inputs to several steps are only read once
+
+file_hash_cache = {}
+
+
+# Return the SHA-256 hash of a file's contents, as a hex string
+
+def hash_file(path):
+    info = os.stat(path)
+    signature = (os.path.abspath(path), info.st_size, info.st_mtime_ns)
+
+    if signature not in file_hash_cache:
+        digest = hashlib.sha256()
+
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+
+        file_hash_cache[signature] = digest.hexdigest()
+
+    return file_hash_cache[signature]
+
+
+# The exception raised when a step's tool can't be found
+
+class ToolNotFound(Exception):
+    pass
+
+
+# Return the path of an executable, looking it up on the path if necessary,
+# and raising ToolNotFound if it isn't on the path or at the given location
+
+def find_tool(tool):
+    path = shutil.which(tool)
+
+    if path is None and not os.path.isfile(tool):
+        raise ToolNotFound("Cannot find {} (is it installed and on the "
+                           "path?)".format(tool))
+
+    return path or tool
+
+
+# Return the cache key for a step, where files is a list of input file paths,
+# tools is a list of executables and args is a list of strings (such as the
+# step name and its arguments), raising ToolNotFound if a tool is missing
+
+def make_key(files=(), tools=(), args=()):
+    digest = hashlib.sha256()
+
+    for label, values in (("file", [hash_file(path) for path in files]),
+                          ("tool", [hash_file(find_tool(tool))
+                                    for tool in tools]),
+                          ("arg", list(args))):
+        for value in values:
+            digest.update("{}:{}\n".format(label, value).encode("utf-8"))
+
+    return digest.hexdigest()
+
+
+# A build cache in a folder, with a size limit in bytes
+
+class BuildCache(object):
+
+    def __init__(self, folder, max_size=DEFAULT_MAX_SIZE):
+        self.folder = folder
+        self.max_size = max_size
+
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+    def entry(self, key):
+        return os.path.join(self.folder, key)
+
+    # Copy the outputs for a key out of the cache, where outputs is a list of
+    # the paths to copy them to, returning True if they were all found, or
+    # False if this is a cache miss
+
+    def fetch(self, key, outputs):
+        entry = self.entry(key)
+
+        if not all(os.path.isfile(os.path.join(entry, os.path.basename(path)))
+                   for path in outputs):
+            return False
+
+        for path in outputs:
+            shutil.copyfile(os.path.join(entry, os.path.basename(path)), path)
+
+        os.utime(entry, None)
+        return True
+
+    # Store the outputs for a key in the cache, where outputs is a list of the
+    # paths of the output files, and then evict old entries if the cache is
+    # now too big
+
+    def store(self, key, outputs):
+        entry = self.entry(key)
+        temporary = "{}.{}.tmp".format(entry, os.getpid())
+
+        shutil.rmtree(temporary, ignore_errors=True)
+        os.makedirs(temporary)
+
+        for path in outputs:
+            shutil.copyfile(path,
+                            os.path.join(temporary, os.path.basename(path)))
+
+        # Move the finished entry into place in one go, so a build that is
+        # interrupted never leaves a half-written entry behind
+
+        shutil.rmtree(entry, ignore_errors=True)
+        os.rename(temporary, entry)
+
+        self.evict()
+
+    # Return a list of (last used time, size, path) tuples for every entry in
+    # the cache
+
+    def entries(self):
+        entries = []
+
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+
+            if name.endswith(".tmp") or not os.path.isdir(path):
+                continue
+
+            size = sum(os.path.getsize(os.path.join(path, filename))
+                       for filename in os.listdir(path))
+            entries.append((os.path.getmtime(path), size, path))
+
+        return entries
+
+    # Delete the least recently used entries until the cache fits within its
+    # size limit
+
+    def evict(self):
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+
+        while entries and total > self.max_size:
+            _, size, path = entries.pop(0)
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
@@ -0,0 +1,540 @@
+#!/usr/bin/env python
+#
+# ******************************************************************************
+#
+# HEADLESS 6502 CPU CORE
+#
+# Written by Mark Moxon
+#
+# This module contains a cycle-counting 6502 CPU core with no video, sound or
+# I/O, so we can run the game's drawing routines in a 64K memory image and
+# measure what they cost. It runs the documented instruction set (using the
+# tables in mos6502.py), and counts the cycles for each instruction as
+# follows:
+#
+#   * Each instruction takes the number of cycles in mos6502.CYCLES
+#
+#   * Reads in the abs,X, abs,Y and (zp),Y addressing modes take an extra
+#     cycle if the indexed address is on a different page to the base address
+#
+#   * Taken branches take an extra cycle, plus another if the branch target
+#     is on a different page to the next instruction
+#
+# Opcode dispatch is table-driven. When this module is loaded, we generate the
+# Python source for one handler function per opcode, by combining a snippet
+# for the addressing mode with a snippet for the operation, and compile them
+# all in one go. Each CPU then builds its own table of handlers as closures
+# over its memory and registers, so each instruction is a single call through
+# a 256-entry table with no decoding at run time.
+# Each handler takes the address of the instruction and returns the address
+# of the next instruction, so the program counter stays in a local variable
+# in the run loop.
+#
+# The N and Z flags are stored as the value that sets them (so N is bit 7 of
+# n, and Z is set when z is zero), as most instructions set both flags from
+# the same result, and this means the handlers don't have to work out the
+# flags until they are needed.
+#
+# Traps let us replace routines with Python functions, which is how we stub
+# out the line-drawing routine and count the lines instead of drawing them.
+# A trap puts the undocumented opcode $02 at an address (this opcode jams a
+# real 6502, so it never appears in running code), and when the CPU runs that
+# opcode, it calls the trap function for that address, which returns the
+# address to continue from. The cycles for a trapped routine are not counted,
+# apart from the JSR that calls it.
+#
+# The call() method calls a subroutine by pushing a return address that
+# points to a trap, in the same way as JSR, and runs until the subroutine
+# returns to it.
+#
+# ******************************************************************************
+
+import mos6502
+
+
+# The opcode that we use for traps
+
+TRAP_OPCODE = 0x02
+
+# The address that call() returns to, which is in the unused area just below
+# the 6502 vectors
+
+RETURN_ADDRESS = 0xFFF0
+
+# The maximum number of instructions that call() runs before giving up
+
+DEFAULT_LIMIT = 10000000
+
+# The bits in the status register
+
+FLAG_N = 0x80
+FLAG_V = 0x40
+FLAG_U = 0x20
+FLAG_B = 0x10
+FLAG_D = 0x08
+FLAG_I = 0x04
+FLAG_Z = 0x02
+FLAG_C = 0x01
+
+
+# Exception raised when the CPU hits an undocumented opcode, or runs for too
+# long
+
+class EmulatorError(Exception):
+    pass
+
+
+# Exception raised by the return trap to stop the run loop
+
+class Halt(Exception):
+    pass
+
+
+# The code that works out the operand address for each addressing mode, where
+# the address of the instruction is in pc, m is the memory and c is the CPU,
+# with the extra page-crossing cycle in {cross} (which is only filled in for
+# instructions that take it)
+
+ADDRESSING = {
+    "imp": [],
+    "acc": [],
+    "imm": ["address = pc + 1"],
+    "zp": ["address = m[pc + 1]"],
+    "zpx": ["address = (m[pc + 1] + c.x) & 0xFF"],
+    "zpy": ["address = (m[pc + 1] + c.y) & 0xFF"],
+    "abs": ["address = m[pc + 1] | m[pc + 2] << 8"],
+    "absx": ["low = m[pc + 1] + c.x",
+             "address = ((m[pc + 2] << 8) + low) & 0xFFFF",
+             "{cross}"],
+    "absy": ["low = m[pc + 1] + c.y",
+             "address = ((m[pc + 2] << 8) + low) & 0xFFFF",
+             "{cross}"],
+    "indx": ["pointer = (m[pc + 1] + c.x) & 0xFF",
+             "address = m[pointer] | m[(pointer + 1) & 0xFF] << 8"],
+    "indy": ["pointer = m[pc + 1]",
+             "low = m[pointer] + c.y",
+             "address = ((m[(pointer + 1) & 0xFF] << 8) + low) & 0xFFFF",
+             "{cross}"],
+    "ind": ["pointer = m[pc + 1] | m[pc + 2] << 8",
+            "address = m[pointer] | m[(pointer & 0xFF00)"
+            " | ((pointer + 1) & 0xFF)] << 8"],
+    "rel": [],
+}
+
+# The code for the extra page-crossing cycle
+
+PAGE_CROSSING_CODE = "if low > 0xFF: c.cycles += 1"
+
+# The code for each operation that reads memory, where the operand is in
+# value, which is read from the operand address before the operation runs
+
+READ_OPERATIONS = {
+    "LDA": ["c.a = c.n = c.z = value"],
+    "LDX": ["c.x = c.n = c.z = value"],
+    "LDY": ["c.y = c.n = c.z = value"],
+    "AND": ["c.a = c.n = c.z = c.a & value"],
+    "ORA": ["c.a = c.n = c.z = c.a | value"],
+    "EOR": ["c.a = c.n = c.z = c.a ^ value"],
+    "ADC": ["if c.d:",
+            "    add_decimal(c, value)",
+            "else:",
+            "    a = c.a",
+            "    total = a + value + c.c",
+            "    c.v = ((a ^ total) & (value ^ total) & 0x80) >> 7",
+            "    c.c = total >> 8",
+            "    c.a = c.n = c.z = total & 0xFF"],
+    "SBC": ["if c.d:",
+            "    subtract_decimal(c, value)",
+            "else:",
+            "    a = c.a",
+            "    value ^= 0xFF",
+            "    total = a + value + c.c",
+            "    c.v = ((a ^ total) & (value ^ total) & 0x80) >> 7",
+            "    c.c = total >> 8",
+            "    c.a = c.n = c.z = total & 0xFF"],
+    "CMP": ["total = c.a - value",
+            "c.c = 1 if total >= 0 else 0",
+            "c.n = c.z = total & 0xFF"],
+    "CPX": ["total = c.x - value",
+            "c.c = 1 if total >= 0 else 0",
+            "c.n = c.z = total & 0xFF"],
+    "CPY": ["total = c.y - value",
+            "c.c = 1 if total >= 0 else 0",
+            "c.n = c.z = total & 0xFF"],
+    "BIT": ["c.n = value",
+            "c.v = (value >> 6) & 1",
+            "c.z = c.a & value"],
+}
+
+# The code for each operation that writes memory
+
+WRITE_OPERATIONS = {
+    "STA": ["m[address] = c.a"],
+    "STX": ["m[address] = c.x"],
+    "STY": ["m[address] = c.y"],
+}
+
+# The code for each read-modify-write operation, which updates value (this is
+# either the accumulator or the byte at the operand address)
+
+MODIFY_OPERATIONS = {
+    "ASL": ["c.c = value >> 7",
+            "value = c.n = c.z = (value << 1) & 0xFF"],
+    "LSR": ["c.c = value & 1",
+            "value = c.n = c.z = value >> 1"],
+    "ROL": ["value = (value << 1) | c.c",
+            "c.c = value >> 8",
+            "value = c.n = c.z = value & 0xFF"],
+    "ROR": ["value |= c.c << 8",
+            "c.c = value & 1",
+            "value = c.n = c.z = value >> 1"],
+    "INC": ["value = c.n = c.z = (value + 1) & 0xFF"],
+    "DEC": ["value = c.n = c.z = (value - 1) & 0xFF"],
+}
+
+# The code for each implied operation that doesn't change the flow of control
+
+IMPLIED_OPERATIONS = {
+    "CLC": ["c.c = 0"],
+    "SEC": ["c.c = 1"],
+    "CLI": ["c.i = 0"],
+    "SEI": ["c.i = 1"],
+    "CLV": ["c.v = 0"],
+    "CLD": ["c.d = 0"],
+    "SED": ["c.d = 1"],
+    "NOP": [],
+    "INX": ["c.x = c.n = c.z = (c.x + 1) & 0xFF"],
+    "INY": ["c.y = c.n = c.z = (c.y + 1) & 0xFF"],
+    "DEX": ["c.x = c.n = c.z = (c.x - 1) & 0xFF"],
+    "DEY": ["c.y = c.n = c.z = (c.y - 1) & 0xFF"],
+    "TAX": ["c.x = c.n = c.z = c.a"],
+    "TAY": ["c.y = c.n = c.z = c.a"],
+    "TXA": ["c.a = c.n = c.z = c.x"],
+    "TYA": ["c.a = c.n = c.z = c.y"],
+    "TSX": ["c.x = c.n = c.z = c.s"],
+    "TXS": ["c.s = c.x"],
+    "PHA": ["m[0x100 | c.s] = c.a",
+            "c.s = (c.s - 1) & 0xFF"],
+    "PHP": ["m[0x100 | c.s] = c.status() | 0x30",
+            "c.s = (c.s - 1) & 0xFF"],
+    "PLA": ["c.s = (c.s + 1) & 0xFF",
+            "c.a = c.n = c.z = m[0x100 | c.s]"],
+    "PLP": ["c.s = (c.s + 1) & 0xFF",
+            "c.set_status(m[0x100 | c.s])"],
+}
+
+# The condition for each branch instruction
+
+BRANCH_CONDITIONS = {
+    "BPL": "not c.n & 0x80",
+    "BMI": "c.n & 0x80",
+    "BVC": "not c.v",
+    "BVS": "c.v",
+    "BCC": "not c.c",
+    "BCS": "c.c",
+    "BNE": "c.z",
+    "BEQ": "not c.z",
+}
+
+# The code for each instruction that changes the flow of control, which must
+# return the address of the next instruction
+
+FLOW_OPERATIONS = {
+    "JMP": ["return address"],
+    "JSR": ["after = pc + 2",
+            "s = c.s",
+            "m[0x100 | s] = after >> 8",
+            "m[0x100 | ((s - 1) & 0xFF)] = after & 0xFF",
+            "c.s = (s - 2) & 0xFF",
+            "return address"],
+    "RTS": ["s = c.s",
+            "c.s = (s + 2) & 0xFF",
+            "return ((m[0x100 | ((s + 1) & 0xFF)]"
+            " | m[0x100 | ((s + 2) & 0xFF)] << 8) + 1) & 0xFFFF"],
+    "RTI": ["c.s = (c.s + 1) & 0xFF",
+            "c.set_status(m[0x100 | c.s])",
+            "s = c.s",
+            "c.s = (s + 2) & 0xFF",
+            "return m[0x100 | ((s + 1) & 0xFF)]"
+            " | m[0x100 | ((s + 2) & 0xFF)] << 8"],
+    "BRK": ["after = pc + 2",
+            "s = c.s",
+            "m[0x100 | s] = after >> 8",
+            "m[0x100 | ((s - 1) & 0xFF)] = after & 0xFF",
+            "m[0x100 | ((s - 2) & 0xFF)] = c.status() | 0x30",
+            "c.s = (s - 3) & 0xFF",
+            "c.i = 1",
+            "return m[0xFFFE] | m[0xFFFF] << 8"],
+}
+
+# The code for a branch instruction, with the condition in {condition}
+
+BRANCH_CODE = [
+    "if {condition}:",
+    "    offset = m[pc + 1]",
+    "    after = pc + 2",
+    "    target = (after + offset - ((offset & 0x80) << 1)) & 0xFFFF",
+    "    c.cycles += 2 if (target ^ after) & 0xFF00 else 1",
+    "    return target",
+    "return pc + 2",
+]
+
+
+# Return the body of the handler for an opcode as a list of lines, or None if
+# the opcode is undocumented
+
+def handler_body(opcode):
+    if mos6502.OPCODES[opcode] is None:
+        return None
+
+    mnemonic, mode = mos6502.OPCODES[opcode]
+    size = mos6502.MODE_SIZES[mode]
+    cross = PAGE_CROSSING_CODE if mos6502.PAGE_CROSSING[opcode] else ""
+    lines = [line.format(cross=cross) for line in ADDRESSING[mode]]
+
+    if mnemonic in BRANCH_CONDITIONS:
+        return [line.format(condition=BRANCH_CONDITIONS[mnemonic])
+                for line in BRANCH_CODE]
+
+    if mnemonic in FLOW_OPERATIONS:
+        return lines + FLOW_OPERATIONS[mnemonic]
+
+    if mnemonic in READ_OPERATIONS:
+        lines += ["value = m[address]"] + READ_OPERATIONS[mnemonic]
+    elif mnemonic in WRITE_OPERATIONS:
+        lines += WRITE_OPERATIONS[mnemonic]
+    elif mnemonic in MODIFY_OPERATIONS and mode == "acc":
+        lines += (["value = c.a"] + MODIFY_OPERATIONS[mnemonic]
+                  + ["c.a = value"])
+    elif mnemonic in MODIFY_OPERATIONS:
+        lines += (["value = m[address]"] + MODIFY_OPERATIONS[mnemonic]
+                  + ["m[address] = value"])
+    else:
+        lines += IMPLIED_OPERATIONS[mnemonic]
+
+    return lines + ["return pc + {}".format(size)]
+
+
+# Return the Python source for a function that builds the handler table for a
+# CPU, where each handler is a closure over the memory (m), the CPU (c) and
+# the trap functions (traps)
+
+def table_source():
+    lines = ["def build_handlers(m, c, traps):"]
+    names = []
+
+    for opcode in range(256):
+        body = handler_body(opcode)
+
+        if opcode == TRAP_OPCODE:
+            name = "trap"
+        elif body is None:
+            name = "undocumented"
+        else:
+            name = "op_{:02x}".format(opcode)
+            lines.append("    def {}(pc):".format(name))
+            lines.extend("        " + line for line in body if line)
+
+        names.append(name)
+
+    lines += [
+        "    def trap(pc):",
+        "        if pc not in traps:",
+        "            undocumented(pc)",
+        "        return traps[pc](c)",
+        "    def undocumented(pc):",
+        "        raise EmulatorError('Undocumented opcode &{:02X} at &{:04X}'"
+        ".format(m[pc], pc))",
+        "    return [{}]".format(", ".join(names)),
+    ]
+
+    return "\n".join(lines)
+
+
+# Add value to the accumulator in decimal mode, as on the NMOS 6502 (where the
+# N, V and Z flags are set from the binary result)
+
+def add_decimal(c, value):
+    a = c.a
+    total = a + value + c.c
+    low = (a & 0x0F) + (value & 0x0F) + c.c
+
+    if low > 9:
+        low += 6
+
+    high = (a >> 4) + (value >> 4) + (low > 0x0F)
+    c.z = total & 0xFF
+    c.n = (high << 4) & 0xFF
+    c.v = 1 if ~(a ^ value) & (a ^ (high << 4)) & 0x80 else 0
+
+    if high > 9:
+        high += 6
+
+    c.c = 1 if high > 0x0F else 0
+    c.a = ((high << 4) | (low & 0x0F)) & 0xFF
+
+
+# Subtract value from the accumulator in decimal mode, as on the NMOS 6502
+# (where the flags are set from the binary result)
+
+def subtract_decimal(c, value):
+    a = c.a
+    borrow = 1 - c.c
+    total = a - value - borrow
+    low = (a & 0x0F) - (value & 0x0F) - borrow
+    high = (a >> 4) - (value >> 4)
+
+    if low < 0:
+        low -= 6
+        high -= 1
+
+    if high < 0:
+        high -= 6
+
+    c.c = 1 if total >= 0 else 0
+    c.v = 1 if (a ^ value) & (a ^ total) & 0x80 else 0
+    c.n = c.z = total & 0xFF
+    c.a = ((high << 4) | (low & 0x0F)) & 0xFF
+
+
+# Compile the handler table builder once, when the module is loaded
+
+NAMESPACE = {}
+
+exec(compile(table_source(), "<cpu6502 handlers>", "exec"),
+     {"EmulatorError": EmulatorError, "add_decimal": add_decimal,
+      "subtract_decimal": subtract_decimal},
+     NAMESPACE)
+
+# The base number of cycles for each opcode, with zero for traps and
+# undocumented opcodes
+
+BASE_CYCLES = [cycles or 0 for cycles in mos6502.CYCLES]
+
+
+# A 6502 CPU attached to a 64K bytearray of memory, with the registers and
+# flags as attributes, and a running count of the cycles and instructions it
+# has executed
+
+class CPU(object):
+
+    __slots__ = ("memory", "a", "x", "y", "s", "n", "v", "d", "i", "z", "c",
+                 "pc", "cycles", "instructions", "traps", "originals",
+                 "handlers")
+
+    def __init__(self, memory):
+        self.memory = memory
+        self.a = self.x = self.y = 0
+        self.s = 0xFF
+        self.n = self.v = self.d = self.i = self.c = 0
+        self.z = 1
+        self.pc = 0
+        self.cycles = 0
+        self.instructions = 0
+        self.traps = {}
+        self.originals = {}
+        self.handlers = NAMESPACE["build_handlers"](memory, self, self.traps)
+        self.trap(RETURN_ADDRESS, halt)
+
+    # Return the status register as a byte
+
+    def status(self):
+        return ((self.n & FLAG_N) | self.v << 6 | FLAG_U | self.d << 3
+                | self.i << 2 | (0 if self.z else FLAG_Z) | self.c)
+
+    # Set the flags from a status register byte
+
+    def set_status(self, value):
+        self.n = value & FLAG_N
+        self.v = (value >> 6) & 1
+        self.d = (value >> 3) & 1
+        self.i = (value >> 2) & 1
+        self.z = 0 if value & FLAG_Z else 1
+        self.c = value & FLAG_C
+
+    # Push a byte onto the stack
+
+    def push(self, value):
+        self.memory[0x100 | self.s] = value
+        self.s = (self.s - 1) & 0xFF
+
+    # Pull a byte from the stack
+
+    def pull(self):
+        self.s = (self.s + 1) & 0xFF
+        return self.memory[0x100 | self.s]
+
+    # Pull a return address from the stack, as RTS does, and return the
+    # address to continue from
+
+    def rts(self):
+        low = self.pull()
+        return ((self.pull() << 8 | low) + 1) & 0xFFFF
+
+    # Put a trap at an address, so when the CPU gets there, it calls
+    # function(cpu), which returns the address to continue from
+
+    def trap(self, address, function):
+        if address not in self.originals:
+            self.originals[address] = self.memory[address]
+
+        self.memory[address] = TRAP_OPCODE
+        self.traps[address] = function
+
+    # Remove the trap at an address, putting back the original byte
+
+    def untrap(self, address):
+        self.memory[address] = self.originals.pop(address)
+        del self.traps[address]
+
+    # Run from the current program counter until a trap raises Halt, running
+    # no more than limit instructions
+
+    def run(self, limit=DEFAULT_LIMIT):
+        memory = self.memory
+        handlers = self.handlers
+        base_cycles = BASE_CYCLES
+        pc = self.pc
+        cycles = 0
+        count = 0
+
+        try:
+            for count in range(limit):
+                opcode = memory[pc]
+                cycles += base_cycles[opcode]
+                pc = handlers[opcode](pc)
+            else:
+                count = limit
+                raise EmulatorError("No return after {} instructions, at "
+                                    "&{:04X}".format(limit, pc))
+        except Halt:
+            pass
+        finally:
+            self.pc = pc
+            self.cycles += cycles
+            self.instructions += count
+
+    # Call the subroutine at address and run until it returns, returning a
+    # tuple of the cycles and instructions that it took (including the JSR
+    # that calls it and the RTS at the end)
+
+    def call(self, address, limit=DEFAULT_LIMIT):
+        cycles = self.cycles
+        instructions = self.instructions
+
+        return_address = RETURN_ADDRESS - 1
+        self.push(return_address >> 8)
+        self.push(return_address & 0xFF)
+        self.pc = address
+        self.run(limit)
+
+        self.cycles += mos6502.CYCLES[mos6502.INSTRUCTIONS["JSR"]["abs"]]
+        self.instructions += 1
+
+        return (self.cycles - cycles, self.instructions - instructions)
+
+
+# The trap function for the return address, which stops the run loop
+
+def halt(cpu):
+    raise Halt()
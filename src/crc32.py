@@ -9,100 +9,316 @@
 # This script performs checksums on the compiled files from the build process,
 # and checks them against the extracted files from the original source disc
 #
+# Files are hashed through mmap in a thread pool (zlib and hashlib release the
+# GIL, so the files are hashed in parallel). The checksums for the reference
+# binaries are stored in reference-binaries/manifest.json, which contains the
+# CRC32, size and SHA-256 of each file, so when the first folder is one of the
+# reference folders, only the files that are missing from the manifest or
+# have changed size are hashed. Run with --write-manifest to rebuild the
+# manifest after changing the reference binaries, and --check-manifest to
+# hash every file in the first folder and report any manifest entries that
+# are missing or stale (as a patched byte doesn't change the size of a file,
+# this is the check to run in CI).
+#
+# Run with --json for machine-readable output, in which case the script exits
+# with a non-zero status if any of the files in both folders don't match.
+#
+# Run with --diff when comparing two folders to list the differing byte ranges
+# in each file that doesn't match, along with their runtime addresses and the
+# patches responsible (see diff_report.py). The platform is taken from the name
+# of the reference folder (ntsc, pal or plus4), or can be set with --platform.
+#
 # ******************************************************************************
 
 from __future__ import print_function
-import sys
+import argparse
+import hashlib
+import json
+import mmap
 import os
 import os.path
+import sys
 import zlib
+from concurrent.futures import ThreadPoolExecutor
+import diff_report
+
+
+# The name of the manifest file in the folder above the reference folders
+
+MANIFEST_FILE = "manifest.json"
+
+
+# Return a dictionary containing the CRC32, size and SHA-256 of a file, hashing
+# it through mmap so the whole file doesn't have to be copied into memory
+
+def hash_file(full_name):
+    with open(full_name, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+
+        if size == 0:
+            data = b''
+        else:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            return {
+                'crc32': zlib.crc32(data) & 0xffffffff,
+                'size': size,
+                'sha256': hashlib.sha256(data).hexdigest(),
+            }
+        finally:
+            if size:
+                data.close()
+
+
+# Return a list of the files in a folder that we checksum
+
+def list_files(folder):
+    return [name for name in sorted(os.listdir(folder))
+            if not name.startswith(".") and name != MANIFEST_FILE
+            and os.path.isfile(os.path.join(folder, name))]
+
+
+# Return the path of the manifest for a folder, and the key for the folder's
+# entry in the manifest
+
+def manifest_path(folder):
+    folder = os.path.normpath(folder)
+    return (os.path.join(os.path.dirname(folder), MANIFEST_FILE),
+            os.path.basename(folder))
+
+
+# Load the manifest entries for a folder, returning an empty dictionary if
+# there aren't any
+
+def load_manifest(folder):
+    path, key = manifest_path(folder)
+
+    if not os.path.isfile(path):
+        return {}
+
+    with open(path) as f:
+        return json.load(f).get(key, {})
+
+
+# Save the checksums for a folder into its manifest
+
+def save_manifest(folder, hashes):
+    path, key = manifest_path(folder)
+    manifest = {}
+
+    if os.path.isfile(path):
+        with open(path) as f:
+            manifest = json.load(f)
+
+    manifest[key] = hashes
+
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+# Return a dictionary of checksums for the files in a folder, keyed by
+# filename, hashing the files in parallel, and taking the checksums from the
+# manifest (if use_manifest is set) for any files that are listed there with
+# the correct size
+
+def hash_folder(folder, jobs, use_manifest=False):
+    names = list_files(folder)
+    manifest = load_manifest(folder) if use_manifest else {}
+    hashes = {}
+    to_hash = []
+
+    for name in names:
+        entry = manifest.get(name)
+        if entry and entry['size'] == os.path.getsize(
+                os.path.join(folder, name)):
+            hashes[name] = entry
+        else:
+            to_hash.append(name)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = executor.map(
+            hash_file, [os.path.join(folder, name) for name in to_hash]
+        )
+        hashes.update(zip(to_hash, results))
+
+    return hashes
+
+
+# Return the label for a folder in the two-folder report
+
+def folder_label(folder):
+    if 'reference-binaries' in folder:
+        return '[--originals--]'
+    elif 'output' in folder:
+        return '[---output----]'
+    else:
+        return '[{0: ^13}]'.format(folder[0:13]).replace(' ', '-')
+
+
+# Return the diff report for two folders, as a list of lines
+
+def diff_lines(args, folder1, folder2):
+    platform = args.platform or os.path.basename(os.path.normpath(folder1))
+
+    if platform not in ('pal', 'ntsc', 'plus4'):
+        return ['Cannot tell the platform for --diff, use --platform']
+
+    return diff_report.diff_folders(folder1, folder2, platform)
 
 
 def main():
-    if len(sys.argv) <= 2:
+    parser = argparse.ArgumentParser(
+        description="Checksum the files in a folder, or compare two folders"
+    )
+    parser.add_argument("folders", nargs="*", default=["."])
+    parser.add_argument("--json", action="store_true",
+                        help="print the results as JSON")
+    parser.add_argument("--write-manifest", action="store_true",
+                        help="save the checksums for the first folder into "
+                        "its manifest")
+    parser.add_argument("--check-manifest", action="store_true",
+                        help="hash the first folder and report any entries "
+                        "in its manifest that are missing or stale")
+    parser.add_argument("--diff", action="store_true",
+                        help="list the differing byte ranges in files that "
+                        "don't match")
+    parser.add_argument("--platform", choices=["pal", "ntsc", "plus4"],
+                        help="platform for --diff (default: the name of the "
+                        "first folder)")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1,
+                        help="number of files to hash at once")
+    args = parser.parse_args()
+
+    if len(args.folders) > 2:
+        parser.error("expected one or two folders")
+
+    if args.write_manifest:
+        hashes = hash_folder(args.folders[0], args.jobs)
+        save_manifest(args.folders[0], hashes)
+        print('Saved {} checksums to {}'.format(
+            len(hashes), manifest_path(args.folders[0])[0]))
+        return
+
+    if args.check_manifest:
+        folder = args.folders[0]
+        hashes = hash_folder(folder, args.jobs)
+        manifest = load_manifest(folder)
+        stale = [name for name in sorted(set(hashes) | set(manifest))
+                 if hashes.get(name) != manifest.get(name)]
+
+        for name in stale:
+            print('Stale manifest entry for {}'.format(name))
+
+        print('{} of {} checksums in {} are stale'.format(
+            len(stale), len(hashes), manifest_path(folder)[0]))
+        sys.exit(1 if stale else 0)
+
+    if len(args.folders) == 1:
         # Do CRC on single folder
-        folder = sys.argv[1] if len(sys.argv) == 2 else "."
-        names = sorted(os.listdir(folder))
+        folder = args.folders[0]
+        hashes = hash_folder(folder, args.jobs)
+
+        if args.json:
+            print(json.dumps({
+                'folder': folder,
+                'files': [dict(name=name, **hashes[name])
+                          for name in sorted(hashes)],
+            }, indent=2))
+            return
 
         print()
         print('Checksum   Size  Filename')
         print('------------------------------------------')
 
-        for name in names:
-            if not name.startswith("."):
-                full_name = os.path.join(folder, name)
-                if not os.path.isfile(full_name):
-                    continue
-                with open(full_name, 'rb') as f:
-                    data = f.read()
-                print('%08x  %5d  %s' % (
-                    zlib.crc32(data) & 0xffffffff,
-                    len(data),
-                    full_name)
-                )
+        for name in sorted(hashes):
+            print('%08x  %5d  %s' % (
+                hashes[name]['crc32'],
+                hashes[name]['size'],
+                os.path.join(folder, name))
+            )
         print()
     else:
-        # Do CRC on two folders
-        folder1 = sys.argv[1]
-        names1 = sorted(os.listdir(folder1))
-        folder2 = sys.argv[2]
-        names2 = sorted(os.listdir(folder2))
-        names = list(names1)
-        names.extend(x for x in names2 if x not in names)
-
-        if 'reference-binaries' in folder1:
-            src = '[--originals--]'
-        elif 'output' in folder1:
-            src = '[---output----]'
-        else:
-            src = '[{0: ^13}]'.format(folder1[0:13]).replace(' ', '-')
+        # Do CRC on two folders, using the manifest for the reference folder
+        folder1, folder2 = args.folders
+        hashes1 = hash_folder(folder1, args.jobs,
+                              'reference-binaries' in folder1)
+        hashes2 = hash_folder(folder2, args.jobs)
+        names = sorted(hashes1)
+        names.extend(x for x in sorted(hashes2) if x not in hashes1)
 
-        if 'reference-binaries' in folder2:
-            dest = '[--originals--]'
-        elif 'output' in folder2:
-            dest = '[---output----]'
-        else:
-            dest = '[{0: ^13}]'.format(folder2[0:13]).replace(' ', '-')
+        if args.json:
+            files = []
+
+            for name in names:
+                first = hashes1.get(name)
+                second = hashes2.get(name)
+                files.append({
+                    'name': name,
+                    'reference': first,
+                    'output': second,
+                    'match': (first is not None and second is not None
+                              and first['sha256'] == second['sha256']),
+                })
+
+            mismatches = [entry['name'] for entry in files
+                          if entry['reference'] and entry['output']
+                          and not entry['match']]
+
+            results = {
+                'reference': folder1,
+                'output': folder2,
+                'files': files,
+                'mismatches': mismatches,
+            }
+
+            if args.diff and mismatches:
+                results['diff'] = diff_lines(args, folder1, folder2)
+
+            print(json.dumps(results, indent=2))
+
+            if mismatches:
+                sys.exit(1)
+            return
 
         print()
-        print(src + '  ' + dest)
+        print(folder_label(folder1) + '  ' + folder_label(folder2))
         print('Checksum   Size  Checksum   Size  Match  Filename')
         print('-----------------------------------------------------------')
 
         for name in names:
-            if not name.startswith("."):
-                full_name1 = os.path.join(folder1, name)
-                full_name2 = os.path.join(folder2, name)
-
-                if name in names1 and name in names2 and os.path.isfile(full_name1) and os.path.isfile(full_name2):
-                    with open(full_name1, 'rb') as f:
-                        data1 = f.read()
-                    with open(full_name2, 'rb') as f:
-                        data2 = f.read()
-                    crc1 = zlib.crc32(data1) & 0xffffffff
-                    crc2 = zlib.crc32(data2) & 0xffffffff
-                    match = ' Yes ' if crc1 == crc2 and len(data1) == len(data2) else ' No  '
-                    print('%08x  %5d  %08x  %5d  %s  %s' % (
-                        crc1,
-                        len(data1),
-                        crc2,
-                        len(data2),
-                        match,
-                        name)
-                    )
-                elif name in names1 and os.path.isfile(full_name1):
-                    with open(full_name1, 'rb') as f:
-                        data = f.read()
-                    print('%08x  %5d  %s  %s  %s  %s' % (
-                        zlib.crc32(data) & 0xffffffff,
-                        len(data),
-                        '-       ',
-                        '    -',
-                        '  -  ',
-                        name)
-                    )
+            if name in hashes1 and name in hashes2:
+                crc1 = hashes1[name]['crc32']
+                crc2 = hashes2[name]['crc32']
+                size1 = hashes1[name]['size']
+                size2 = hashes2[name]['size']
+                match = ' Yes ' if crc1 == crc2 and size1 == size2 else ' No  '
+                print('%08x  %5d  %08x  %5d  %s  %s' % (
+                    crc1,
+                    size1,
+                    crc2,
+                    size2,
+                    match,
+                    name)
+                )
+            elif name in hashes1:
+                print('%08x  %5d  %s  %s  %s  %s' % (
+                    hashes1[name]['crc32'],
+                    hashes1[name]['size'],
+                    '-       ',
+                    '    -',
+                    '  -  ',
+                    name)
+                )
         print()
 
+        if args.diff and any(
+                name in hashes2 and hashes1[name] != hashes2[name]
+                for name in hashes1):
+            print('\n'.join(diff_lines(args, folder1, folder2)))
+            print()
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,668 @@
+#!/usr/bin/env python
+#
+# ******************************************************************************
+#
+# ELITE FLICKER-FREE CYCLE COUNTS
+#
+# Written by Mark Moxon
+#
+# This script works out how many CPU cycles the routines that the flicker-free
+# patch modifies take, in both the original and the patched versions of the
+# game, so we can see what the flicker-free drawing costs.
+#
+# It builds the memory image of the running game for each version (using
+# runtime_image.py for the Commodore 64, so the routines that the loader moves
+# into the sprite area are in the right place), assembles the flicker-free
+# source in-process (using the same assembly as patch_check.py) to get the
+# patched binaries and the addresses of the new routines, and then analyses
+# each routine statically as follows:
+#
+#   * Build a control flow graph by following every path from the routine's
+#     entry point, decoding the instructions with mos6502.py, and stopping at
+#     RTS, or when the code jumps or falls out of the routine's address range
+#
+#   * Give each instruction its cycle count from mos6502.CYCLES, and give each
+#     taken branch an extra cycle, plus another if the branch target is on a
+#     different page to the next instruction
+#
+#   * Indexed reads that could cross a page boundary (abs,X and abs,Y with a
+#     base address that isn't page-aligned, and (zp),Y) take an extra cycle in
+#     the worst case, but not in the best case
+#
+#   * Find the loops by looking for back edges in a depth-first walk of the
+#     graph, and work out the best and worst cycle counts for one iteration
+#     of each loop
+#
+#   * Remove the back edges, and work out the best and worst cycle counts
+#     from the entry point to the exit, going round each loop once
+#
+# Subroutine calls (JSR) to routines that we analyse, or to code within the
+# same routine, include the cycles for the subroutine. Calls to any other
+# routines (such as the line-drawing routine LL30) only count the JSR, and are
+# listed separately, as their cycle counts depend on the data. The new
+# routines that only exist in the patched version are the spill-over from the
+# routines that jump to them, so jumps to these are also included.
+#
+# Run this script with:
+#
+#   python cycle_count.py [--platform <c64|plus4>] [--disk <C64 disk image>]
+#                         [--prg <Plus/4 PRG>] [-v]
+#
+# which prints a table of the best and worst cycle counts for each routine in
+# the original and patched versions, along with the difference. The default
+# is to analyse both platforms, using the PAL disk and the unpacked Plus/4
+# binary in the original-disks folder, and -v also prints the cycle counts for
+# each loop and the external routines that each routine calls.
+#
+# ******************************************************************************
+
+from __future__ import print_function
+import argparse
+import os
+import elite_patcher
+import elite_patches
+import mos6502
+import patch_check
+import patch_plan
+import runtime_image
+
+
+# The routines that we analyse, each of which is a tuple of (name, location,
+# original, patched), where:
+#
+#   * location is "ship", "planet" or "bline", which gives the offset between
+#     the Commodore 64 and Plus/4 addresses (see OFFSETS), or None for new
+#     routines
+#
+#   * original is the (start, end) address range of the original routine on
+#     the Commodore 64, or None for new routines
+#
+#   * patched is either the name of a label in the flicker-free source, in
+#     which case the routine runs from that label to the next routine label
+#     (see ROUTINE_LABELS) or the end of its SAVE block, or it is an address
+#     range on the Commodore 64 for routines that are patched in place
+#
+# The LL9 parts are the address ranges of those parts of LL9, which the patch
+# modifies in place
+
+ROUTINES = [
+    ("SHPPT", "ship", (0x9932, 0x9978), "SHPPT"),
+    ("LL9 (Part 1)", "ship", (0x9A86, 0x9AE6), (0x9A86, 0x9AE6)),
+    ("LL9 (Part 9)", "ship", (0x9F2A, 0x9F9F), (0x9F2A, 0x9F9F)),
+    ("LL9 (Part 10)", "ship", (0x9F9F, 0xA013), (0x9F9F, 0xA013)),
+    ("LL9 (Part 11)", "ship", (0xA13F, 0xA178), (0xA13F, 0xA178)),
+    ("LL78", "ship", (0xA15B, 0xA178), "LL78"),
+    ("LL155 (LL9 Part 12)", "ship", (0xA178, 0xA19F), "LL155"),
+    ("BLINE", "bline", (0x2977, 0x2A12), "BLINE"),
+    ("PL9", "planet", (0x7D8C, 0x7DA4), "PL9"),
+    ("WPLS2", "planet", (0x80BB, 0x80F5), "WPLS2"),
+    ("LLX30", None, None, "LSPUT"),
+    ("PATCH1", None, None, "PATCH1"),
+    ("PATCH2", None, None, "PATCH2"),
+    ("PATCH3", None, None, "PATCH3"),
+    ("PATCH4", None, None, "PATCH4"),
+    ("PATCH5", None, None, "PATCH5"),
+    ("PATCH6", None, None, "PATCH6"),
+    ("EraseRestOfPlanet", None, None, "EraseRestOfPlanet"),
+    ("DrawPlanetLine", None, None, "DrawPlanetLine"),
+    ("DrawNewPlanetLine", None, None, "DrawNewPlanetLine"),
+]
+
+# The labels in the flicker-free source that start a routine, so we can work
+# out where each routine ends
+
+ROUTINE_LABELS = [
+    "SHPPT", "LL78", "LL155", "BLINE", "PL9", "WPLS2", "LSPUT", "PATCH1",
+    "PATCH2", "PATCH3", "PATCH4", "PATCH5", "PATCH6", "EraseRestOfPlanet",
+    "DrawPlanetLine", "DrawNewPlanetLine", "TRUMBLE", "PATCHEND",
+]
+
+# The offset to add to each type of Commodore 64 address to get the Plus/4
+# address (see the Plus/4 section of elite_patches.py)
+
+OFFSETS = {
+    "c64": {"ship": 0, "planet": 0, "bline": 0},
+    "plus4": {"ship": 0x0900, "planet": 0x08F0, "bline": -3},
+}
+
+# The names of the platforms, for the report
+
+PLATFORM_NAMES = {
+    "c64": "Commodore 64",
+    "plus4": "Commodore Plus/4",
+}
+
+
+# The results of analysing a routine, where best and worst are the cycle
+# counts from the entry point to the exit (going round each loop once), loops
+# is a dictionary of (best, worst) cycle counts for one iteration of each
+# loop, keyed by the address of the loop's first instruction, and calls is a
+# set of the addresses of the external routines that it calls
+
+class Analysis(object):
+
+    def __init__(self, best, worst, loops, calls):
+        self.best = best
+        self.worst = worst
+        self.loops = loops
+        self.calls = calls
+
+
+# A cycle counter for a 64K memory image, where routines is a dictionary of
+# the routines we analyse, keyed by entry address, with each entry being a
+# tuple of (end, inline), where end is the address just after the end of the
+# routine, and inline is True if jumps to the routine should include its
+# cycles
+
+class CycleCounter(object):
+
+    def __init__(self, memory, routines):
+        self.memory = bytes(memory)
+        self.routines = routines
+        self.results = {}
+        self.active = set()
+
+    # Analyse the routine from entry up to (but not including) end, returning
+    # an Analysis
+
+    def analyse(self, entry, end):
+        key = (entry, end)
+
+        if key not in self.results:
+            self.active.add(key)
+            nodes, calls = self.build_graph(entry, end)
+            self.results[key] = analyse_graph(nodes, entry, calls)
+            self.active.discard(key)
+
+        return self.results[key]
+
+    # Return the analysis for a subroutine that is called from the routine
+    # from entry to end, or None if it is an external routine (or one we are
+    # already analysing, which would be recursive)
+
+    def callee(self, target, entry, end):
+        if target in self.routines:
+            key = (target, self.routines[target][0])
+        elif entry <= target < end:
+            key = (target, end)
+        else:
+            return None
+
+        if key in self.active:
+            return None
+
+        return self.analyse(*key)
+
+    # Build the control flow graph for the routine from entry up to (but not
+    # including) end, returning a tuple of (nodes, calls), where nodes is a
+    # dictionary keyed by address, with each node being a tuple of (best,
+    # worst, edges), and each edge being a tuple of (target, best, worst),
+    # where target is None for edges that leave the routine and best and
+    # worst are the extra cycles for taking the edge
+
+    def build_graph(self, entry, end):
+        nodes = {}
+        calls = set()
+        queue = [entry]
+
+        while queue:
+            address = queue.pop()
+
+            if address in nodes:
+                continue
+
+            mnemonic, mode, operand, size = mos6502.decode(self.memory,
+                                                           address, address)
+            opcode = self.memory[address]
+            after = (address + size) & 0xFFFF
+
+            if mode == "data":
+                nodes[address] = (0, 0, [(None, 0, 0)])
+                continue
+
+            best = worst = mos6502.CYCLES[opcode]
+
+            if mos6502.PAGE_CROSSING[opcode] and (mode == "indy"
+                                                  or operand & 0xFF):
+                worst += 1
+
+            if mnemonic in ("RTS", "RTI", "BRK"):
+                edges = [(None, 0, 0)]
+            elif mnemonic == "JMP":
+                edges = [self.jump(operand, mode, entry, end, calls)]
+            else:
+                if mnemonic == "JSR":
+                    called = self.callee(operand, entry, end)
+
+                    if called is None:
+                        calls.add(operand)
+                    else:
+                        best += called.best
+                        worst += called.worst
+                        calls.update(called.calls)
+
+                edges = [(after, 0, 0)]
+
+                if mode == "rel":
+                    penalty = 1 + ((operand >> 8) != (after >> 8))
+                    edges.append((operand, penalty, penalty))
+
+            edges = [(target if target is None or entry <= target < end
+                      else None, extra_best, extra_worst)
+                     for target, extra_best, extra_worst in edges]
+
+            nodes[address] = (best, worst, edges)
+            queue.extend(target for target, _, _ in edges
+                         if target is not None)
+
+        return (nodes, calls)
+
+    # Return the edge for a JMP instruction, where jumps to new routines
+    # include the cycles for the routine, and jumps to any other address
+    # outside the routine leave the routine
+
+    def jump(self, target, mode, entry, end, calls):
+        if mode == "ind" or not entry <= target < end:
+            if mode != "ind" and self.routines.get(target, (0, False))[1]:
+                called = self.callee(target, entry, end)
+
+                if called is not None:
+                    calls.update(called.calls)
+                    return (None, called.best, called.worst)
+
+            if mode != "ind" and target not in self.routines:
+                calls.add(target)
+
+            return (None, 0, 0)
+
+        return (target, 0, 0)
+
+
+# Analyse a control flow graph from build_graph, returning an Analysis
+
+def analyse_graph(nodes, entry, calls):
+    order, back_edges = depth_first(nodes, entry)
+
+    # Work out the best and worst cycle counts from each node to the exit,
+    # ignoring the back edges, by working backwards from the exit (so each
+    # node's successors are done before the node itself)
+
+    best = {}
+    worst = {}
+
+    for address in order:
+        cost_best, cost_worst, edges = nodes[address]
+        options = [(extra_best + (best[target] if target is not None else 0),
+                    extra_worst + (worst[target] if target is not None else 0))
+                   for target, extra_best, extra_worst in edges
+                   if (address, target) not in back_edges]
+
+        best[address] = cost_best + min([option[0] for option in options]
+                                        or [0])
+        worst[address] = cost_worst + max([option[1] for option in options]
+                                          or [0])
+
+    # Work out the best and worst cycle counts for one iteration of each loop
+
+    loops = {}
+
+    for tail, header in back_edges:
+        body = loop_body(nodes, tail, header)
+        iteration = loop_iteration(nodes, order, body, tail, header)
+
+        if header in loops:
+            iteration = (min(loops[header][0], iteration[0]),
+                         max(loops[header][1], iteration[1]))
+
+        loops[header] = iteration
+
+    return Analysis(best[entry], worst[entry], loops, calls)
+
+
+# Walk the graph depth-first from the entry, returning a tuple of (order,
+# back_edges), where order is a list of the nodes in post-order (so each node
+# comes after all of its successors, ignoring back edges), and back_edges is
+# a set of (tail, header) tuples
+
+def depth_first(nodes, entry):
+    order = []
+    back_edges = set()
+    state = {entry: "visiting"}
+    stack = [(entry, iter(nodes[entry][2]))]
+
+    while stack:
+        address, edges = stack[-1]
+
+        for target, _, _ in edges:
+            if target is None:
+                continue
+
+            if state.get(target) == "visiting":
+                back_edges.add((address, target))
+            elif target not in state:
+                state[target] = "visiting"
+                stack.append((target, iter(nodes[target][2])))
+                break
+        else:
+            state[address] = "done"
+            order.append(address)
+            stack.pop()
+
+    return (order, back_edges)
+
+
+# Return the set of nodes in the loop with the given back edge, which are the
+# header and all the nodes that can reach the tail without going through the
+# header
+
+def loop_body(nodes, tail, header):
+    predecessors = {}
+
+    for address, (_, _, edges) in nodes.items():
+        for target, _, _ in edges:
+            if target is not None:
+                predecessors.setdefault(target, []).append(address)
+
+    body = set([header, tail])
+    queue = [tail]
+
+    while queue:
+        address = queue.pop()
+
+        if address == header:
+            continue
+
+        for predecessor in predecessors.get(address, []):
+            if predecessor not in body:
+                body.add(predecessor)
+                queue.append(predecessor)
+
+    return body
+
+
+# Return the (best, worst) cycle counts for one iteration of a loop, from the
+# header round to the header again via the back edge from the tail
+
+def loop_iteration(nodes, order, body, tail, header):
+    best = {}
+    worst = {}
+
+    for address in order:
+        if address not in body:
+            continue
+
+        cost_best, cost_worst, edges = nodes[address]
+
+        if address == tail:
+            extra = [(extra_best, extra_worst)
+                     for target, extra_best, extra_worst in edges
+                     if target == header]
+            best[address] = cost_best + extra[0][0]
+            worst[address] = cost_worst + extra[0][1]
+            continue
+
+        options = [(extra_best + best[target], extra_worst + worst[target])
+                   for target, extra_best, extra_worst in edges
+                   if target in body and target != header and target in best]
+
+        if options:
+            best[address] = cost_best + min(option[0] for option in options)
+            worst[address] = cost_worst + max(option[1] for option in options)
+
+    return (best.get(header, 0), worst.get(header, 0))
+
+
+# Return a dictionary of (start, end) ranges for the routine labels in an
+# assembler, where each routine ends at the next routine label or the end of
+# its SAVE block, whichever comes first
+
+def label_ranges(assembler):
+    starts = sorted(assembler.symbols[label] for label in ROUTINE_LABELS
+                    if label in assembler.symbols)
+    ranges = {}
+
+    for label in ROUTINE_LABELS:
+        if label not in assembler.symbols:
+            continue
+
+        start = assembler.symbols[label]
+        end = min([address for address in starts if address > start]
+                  + [save_end for _, save_start, save_end in assembler.saves
+                     if save_start <= start < save_end])
+        ranges[label] = (start, end)
+
+    return ranges
+
+
+# Assemble the flicker-free source for a platform in-process, returning the
+# assembler (see patch_check.py)
+
+def assemble_source(platform):
+    return patch_check.assemble_source(platform)
+
+
+# Build the original and patched memory images for the Commodore 64 from a
+# disk image or folder of extracted files
+
+def c64_images(path, bins):
+    original = runtime_image.load_game_files(path)
+    patched = dict((filename, bytearray(data_block))
+                   for filename, data_block in original.items())
+
+    plan = patch_plan.compile_plan(elite_patches.C64_PATCHES, original,
+                                   elite_patches.LOAD_ADDRESSES, bins=bins,
+                                   symbols=elite_patches.C64_SYMBOLS)
+
+    for filename in patched:
+        plan.apply(filename, patched[filename])
+
+    return (runtime_image.build_image(original).ram,
+            runtime_image.build_image(patched).ram)
+
+
+# The blocks of memory that the Plus/4 game's initialisation code at $5100
+# moves before the game starts, each of which is a tuple of (start, end,
+# destination), where the block runs from start up to (but not including) end
+# (this moves the tables from $4700 down to $0700, such as the sine table at
+# $0AC0)
+
+PLUS4_MOVES = [
+    (0x4700, 0x5100, 0x0700),
+]
+
+
+# Build the original and patched memory images for the Plus/4 from the
+# unpacked game binary
+
+def plus4_images(path, bins):
+    with open(path, "rb") as f:
+        original = f.read()
+
+    patched = bytearray(original)
+
+    plan = patch_plan.compile_plan(elite_patches.PLUS4_PATCHES,
+                                   {elite_patcher.PLUS4_FILE: original},
+                                   elite_patches.LOAD_ADDRESSES, bins=bins,
+                                   symbols=elite_patches.PLUS4_SYMBOLS)
+    plan.apply(elite_patcher.PLUS4_FILE, patched)
+
+    images = []
+    start = elite_patches.LOAD_ADDRESSES[elite_patcher.PLUS4_FILE] + 2
+
+    for data_block in (original, patched):
+        memory = bytearray(runtime_image.RAM_SIZE)
+        memory[start:start + len(data_block) - 2] = data_block[2:]
+
+        for move_start, move_end, destination in PLUS4_MOVES:
+            memory[destination:destination + move_end - move_start] = \
+                memory[move_start:move_end]
+
+        images.append(memory)
+
+    return tuple(images)
+
+
+# Return a list of (name, original range, patched range) tuples for the
+# routines on a platform, where the ranges are None for routines that aren't
+# in that version
+
+def routine_ranges(platform, assembler):
+    labels = label_ranges(assembler)
+    ranges = []
+
+    for name, location, original, patched in ROUTINES:
+        offset = OFFSETS[platform].get(location, 0)
+
+        if original is not None:
+            original = (original[0] + offset, original[1] + offset)
+
+        if isinstance(patched, tuple):
+            patched = (patched[0] + offset, patched[1] + offset)
+        else:
+            patched = labels.get(patched)
+
+        ranges.append((name, original, patched))
+
+    return ranges
+
+
+# Analyse all of the routines for a platform, returning a list of (name,
+# original analysis, patched analysis) tuples, where the analysis is None for
+# routines that aren't in that version
+
+def analyse_platform(platform, original_memory, patched_memory, assembler):
+    ranges = routine_ranges(platform, assembler)
+
+    original_routines = dict((original[0], (original[1], False))
+                             for _, original, _ in ranges if original)
+    patched_routines = dict((patched[0], (patched[1], original is None))
+                            for _, original, patched in ranges if patched)
+
+    original_counter = CycleCounter(original_memory, original_routines)
+    patched_counter = CycleCounter(patched_memory, patched_routines)
+
+    return [(name,
+             original_counter.analyse(*original) if original else None,
+             patched_counter.analyse(*patched) if patched else None)
+            for name, original, patched in ranges]
+
+
+# Return the name of an address, using the symbols from the assembler
+
+def address_name(address, names):
+    return names.get(address, "&{:04X}".format(address))
+
+
+# Return a cycle count range as a string
+
+def format_counts(analysis):
+    if analysis is None:
+        return "-"
+
+    if analysis.best == analysis.worst:
+        return str(analysis.best)
+
+    return "{}-{}".format(analysis.best, analysis.worst)
+
+
+# Return the report for a platform as a list of strings
+
+def report(platform, results, assembler, verbose=False):
+    names = dict((address, name) for name, address
+                 in sorted(assembler.symbols.items(), reverse=True)
+                 if isinstance(address, int))
+
+    lines = [
+        PLATFORM_NAMES[platform],
+        "",
+        "{:<22} {:>11} {:>11} {:>11}".format("Routine", "Original",
+                                             "Patched", "Delta"),
+        "-" * 58,
+    ]
+
+    for name, original, patched in results:
+        if original is not None and patched is not None:
+            delta = "{:+d}/{:+d}".format(patched.best - original.best,
+                                         patched.worst - original.worst)
+        else:
+            delta = "-"
+
+        lines.append("{:<22} {:>11} {:>11} {:>11}".format(
+            name, format_counts(original), format_counts(patched), delta
+        ))
+
+        if not verbose:
+            continue
+
+        for version, analysis in (("original", original),
+                                  ("patched", patched)):
+            if analysis is None:
+                continue
+
+            for header in sorted(analysis.loops):
+                best, worst = analysis.loops[header]
+                lines.append("    {:<8} loop at &{:04X}: {} cycles per "
+                             "iteration".format(
+                                 version, header,
+                                 best if best == worst
+                                 else "{}-{}".format(best, worst)
+                             ))
+
+            if analysis.calls:
+                lines.append("    {:<8} calls {}".format(
+                    version,
+                    ", ".join(sorted(address_name(address, names)
+                                     for address in analysis.calls))
+                ))
+
+    lines.append("")
+    return lines
+
+
+def main():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    originals = os.path.join(root, "original-disks")
+
+    parser = argparse.ArgumentParser(
+        description="Count the cycles in the original and flicker-free "
+        "drawing routines"
+    )
+    parser.add_argument("--platform", choices=["c64", "plus4"],
+                        help="only analyse this platform")
+    parser.add_argument("--disk",
+                        default=os.path.join(
+                            originals, "elite[firebird_1986](pal)(v040486).g64"
+                        ),
+                        help="Commodore 64 disk image or folder of extracted "
+                        "files (default: the original PAL disk)")
+    parser.add_argument("--prg",
+                        default=os.path.join(originals,
+                                             elite_patcher.PLUS4_FILE),
+                        help="unpacked Plus/4 binary (default: {})".format(
+                            elite_patcher.PLUS4_FILE
+                        ))
+    parser.add_argument("-v", dest="verbose", action="store_true",
+                        help="print the loops and external calls for each "
+                        "routine")
+    args = parser.parse_args()
+
+    print()
+
+    for platform in ("c64", "plus4"):
+        if args.platform and platform != args.platform:
+            continue
+
+        assembler = assemble_source(platform)
+        bins = assembler.outputs()
+
+        if platform == "c64":
+            original, patched = c64_images(args.disk, bins)
+        else:
+            original, patched = plus4_images(args.prg, bins)
+
+        results = analyse_platform(platform, original, patched, assembler)
+        print("\n".join(report(platform, results, assembler, args.verbose)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,646 @@
+#!/usr/bin/env python
+#
+# ******************************************************************************
+#
+# D64 DISK IMAGE READER AND WRITER
+#
+# Written by Mark Moxon
+#
+# This script reads and writes D64 disk images, which are sector-by-sector
+# dumps of Commodore 1541 disks, without having to call c1541.
+#
+# A 1541 disk has 35 tracks (some images have 40), numbered from 1, with each
+# track containing a different number of 256-byte sectors, numbered from 0:
+#
+#   * Tracks 1 to 17 have 21 sectors
+#   * Tracks 18 to 24 have 19 sectors
+#   * Tracks 25 to 30 have 18 sectors
+#   * Tracks 31 to 40 have 17 sectors
+#
+# Track 18 contains the BAM (the block availability map, in sector 0) and the
+# directory (in a chain of sectors starting from the track and sector given at
+# the start of the BAM). Each directory sector contains eight 32-byte entries,
+# each of which contains the file type, the track and sector of the first
+# block of the file, and the filename.
+#
+# Each block of a file (and of the directory) starts with the track and sector
+# of the next block in the chain. If the track is 0 then this is the last block
+# and the sector number is the offset of the last byte in the block.
+#
+# The directory and file-chain walkers in this script take a function that
+# returns the contents of a given track and sector, so they can also be used
+# with other disk image formats (see g64.py).
+#
+# The D64Writer class builds a new disk image in memory. It allocates sectors
+# through a BAM bitmap in the same way as c1541, so the first block of each file
+# goes on the free track nearest the directory, and the rest of the file
+# follows at the configured interleave, moving away from the directory when a
+# track fills up. The finished image is written to disk in a single write.
+#
+# The writer also supports a "fast" layout, which places each block at the
+# position on the disk where the KERNAL loader will be ready for it, rather
+# than counting sectors like c1541. The interleave is converted into a fraction
+# of a revolution (so it means the same on tracks with different numbers of
+# sectors), and each block goes in the first free sector to come round after
+# the previous block plus this gap, including the time for any head steps.
+# Files can also be allocated in a different order from the one they appear in
+# the directory, so the biggest files can be placed on the tracks nearest the
+# directory, which cuts down on head movement when they are loaded.
+#
+# The load_time function models how long the KERNAL loader takes to load a
+# file from a given chain of blocks, in disk revolutions and head steps, so
+# different layouts and interleaves can be compared without a real 1541.
+#
+# Run this script with "python d64.py <image> [<folder>]" to list the files in
+# a D64 image, or to extract them all into a folder.
+#
+# ******************************************************************************
+
+from __future__ import print_function
+import os
+import sys
+
+
+# The exception raised when a disk image cannot be read
+
+class D64Error(Exception):
+    pass
+
+
+# The size of a sector in bytes
+
+SECTOR_SIZE = 256
+
+# The track containing the BAM and directory
+
+DIRECTORY_TRACK = 18
+
+# The file types stored in the bottom three bits of the directory entry
+
+FILE_TYPES = ["del", "seq", "prg", "usr", "rel"]
+
+# The number of sectors on each track, indexed by track number (so entry 0 is
+# unused)
+
+SECTORS_PER_TRACK = [0] + [21] * 17 + [19] * 7 + [18] * 6 + [17] * 10
+
+# The offset of the start of each track in the image, indexed by track number
+
+TRACK_OFFSETS = [0, 0]
+
+for track in range(1, len(SECTORS_PER_TRACK)):
+    TRACK_OFFSETS.append(TRACK_OFFSETS[-1]
+                         + SECTORS_PER_TRACK[track] * SECTOR_SIZE)
+
+
+# Return the number of tracks in an image of the given size (which may have an
+# extra byte of error information for each sector)
+
+def get_track_count(image_size):
+    for tracks in (35, 40):
+        sectors = TRACK_OFFSETS[tracks + 1] // SECTOR_SIZE
+        if image_size in (sectors * SECTOR_SIZE, sectors * (SECTOR_SIZE + 1)):
+            return tracks
+
+    raise D64Error("Unknown D64 image size: {} bytes".format(image_size))
+
+
+# The file type bytes for closed files in directory entries
+
+FILE_TYPE_BYTES = {"del": 0x80, "seq": 0x81, "prg": 0x82, "usr": 0x83}
+
+# The number of tracks in a standard D64 image
+
+TRACK_COUNT = 35
+
+# The sector interleave used by c1541 for files and for the directory
+
+FILE_INTERLEAVE = 10
+DIRECTORY_INTERLEAVE = 3
+
+# The constants for the load-time model: the disk spins at 300 rpm, so one
+# revolution takes 200 ms, each step of the head between adjacent tracks takes
+# around 12 ms, and once a block has been read, the drive takes around 80 ms to
+# send it to the computer over the serial bus and follow the link to the next
+# block (this is what the default interleave of 10 is tuned for, as ten sectors
+# on the outer tracks is the first sector to pass under the head after this)
+
+REVOLUTION_MS = 200.0
+STEP_MS = 12.0
+KERNAL_BLOCK_MS = 80.0
+
+# The supported sector layouts for new disks
+
+LAYOUTS = ["c1541", "fast"]
+
+
+# Convert a PETSCII filename from a directory entry into a string, in the same
+# way as c1541 (so unshifted letters become lower case)
+
+def petscii_to_str(name):
+    chars = []
+
+    for c in bytearray(name.rstrip(b"\xA0")):
+        if 0x41 <= c <= 0x5A:
+            chars.append(chr(c + 0x20))
+        elif 0xC1 <= c <= 0xDA:
+            chars.append(chr(c - 0x80))
+        elif 0x20 <= c <= 0x7E:
+            chars.append(chr(c))
+        else:
+            chars.append("?")
+
+    return "".join(chars)
+
+
+# Convert a string into a PETSCII filename, in the same way as c1541 (so lower
+# case letters become unshifted letters)
+
+def str_to_petscii(name):
+    petscii = bytearray()
+
+    for c in name:
+        if "a" <= c <= "z":
+            petscii.append(ord(c) - 0x20)
+        elif "A" <= c <= "Z":
+            petscii.append(ord(c) + 0x80)
+        else:
+            petscii.append(ord(c) & 0xFF)
+
+    return bytes(petscii)
+
+
+# Pad a PETSCII string to the given length with shifted spaces
+
+def pad_petscii(name, length):
+    return (str_to_petscii(name) + b"\xA0" * length)[:length]
+
+
+# Follow a chain of blocks from the given track and sector, returning the data
+# from all of them, where get_sector(track, sector) returns a sector's contents
+
+def read_chain(get_sector, track, sector):
+    data = bytearray()
+    visited = set()
+
+    while track != 0:
+        if (track, sector) in visited:
+            raise D64Error("Loop in block chain at {}/{}".format(track, sector))
+
+        visited.add((track, sector))
+        block = get_sector(track, sector)
+        track, sector = block[0], block[1]
+
+        if track == 0:
+            data.extend(block[2:sector + 1])
+        else:
+            data.extend(block[2:])
+
+    return bytes(data)
+
+
+# Return a list of the entries in the directory, where each entry is a
+# dictionary containing the name, type, track, sector and size (in blocks)
+
+def read_directory(get_sector):
+    bam = get_sector(DIRECTORY_TRACK, 0)
+    track, sector = bam[0], bam[1]
+    entries = []
+    visited = set()
+
+    while track != 0:
+        if (track, sector) in visited:
+            raise D64Error("Loop in directory at {}/{}".format(track, sector))
+
+        visited.add((track, sector))
+        block = get_sector(track, sector)
+
+        for n in range(0, SECTOR_SIZE, 32):
+            entry = block[n:n + 32]
+            file_type = entry[2]
+
+            if file_type & 0x07 == 0 and not file_type & 0x80:
+                continue
+
+            entries.append({
+                "name": petscii_to_str(bytes(entry[5:21])),
+                "type": FILE_TYPES[file_type & 0x07]
+                if file_type & 0x07 < len(FILE_TYPES) else "???",
+                "track": entry[3],
+                "sector": entry[4],
+                "blocks": entry[30] + 256 * entry[31],
+            })
+
+        track, sector = block[0], block[1]
+
+    return entries
+
+
+# Return the disk name from the BAM
+
+def read_disk_name(get_sector):
+    return petscii_to_str(bytes(get_sector(DIRECTORY_TRACK, 0)[0x90:0xA0]))
+
+
+# Read all the files on a disk, returning a dictionary of file contents keyed
+# by filename (deleted files are skipped)
+
+def read_all_files(get_sector):
+    files = {}
+
+    for entry in read_directory(get_sector):
+        if entry["type"] != "del":
+            files[entry["name"]] = read_chain(get_sector, entry["track"],
+                                              entry["sector"])
+
+    return files
+
+
+# A D64 disk image held in memory
+
+class D64Image(object):
+
+    def __init__(self, data):
+        self.data = memoryview(bytes(data))
+        self.tracks = get_track_count(len(self.data))
+
+    # Return the contents of a sector
+
+    def sector(self, track, sector):
+        if not 1 <= track <= self.tracks \
+                or not 0 <= sector < SECTORS_PER_TRACK[track]:
+            raise D64Error("Illegal track and sector {}/{}".format(track,
+                                                                  sector))
+
+        offset = TRACK_OFFSETS[track] + sector * SECTOR_SIZE
+        return self.data[offset:offset + SECTOR_SIZE]
+
+    def directory(self):
+        return read_directory(self.sector)
+
+    def disk_name(self):
+        return read_disk_name(self.sector)
+
+    # Return the contents of the named file
+
+    def read_file(self, name):
+        for entry in self.directory():
+            if entry["name"] == name and entry["type"] != "del":
+                return read_chain(self.sector, entry["track"], entry["sector"])
+
+        raise D64Error("File not found: {}".format(name))
+
+    def read_all_files(self):
+        return read_all_files(self.sector)
+
+
+# Return the number of blocks needed to store a file on disk
+
+def block_count(data):
+    return max(1, -(-len(data) // (SECTOR_SIZE - 2)))
+
+
+# Model the time taken by the KERNAL loader to load a file from the given list
+# of (track, sector) blocks, starting with the head on the directory track just
+# after reading the directory, returning a tuple of (revolutions, head steps)
+#
+# Sectors are assumed to be spaced evenly around each track, with sector 0 of
+# every track lined up, and after reading each block, the drive sends it to the
+# computer, steps to the next block's track and waits for its sector to come
+# round under the head
+
+def load_time(blocks, block_ms=KERNAL_BLOCK_MS, step_ms=STEP_MS):
+    track = DIRECTORY_TRACK
+    start = 2.0 / SECTORS_PER_TRACK[DIRECTORY_TRACK]
+    elapsed = 0.0
+    steps = 0
+
+    for next_track, sector in blocks:
+        distance = abs(next_track - track)
+        steps += distance
+        elapsed += distance * step_ms / REVOLUTION_MS
+        track = next_track
+
+        # Wait for the start of the sector, then read it and send it
+
+        sectors = SECTORS_PER_TRACK[track]
+        elapsed += (float(sector) / sectors - start - elapsed) % 1.0
+        elapsed += 1.0 / sectors + block_ms / REVOLUTION_MS
+
+    return elapsed, steps
+
+
+# A D64 disk image that is built in memory, one file at a time
+
+class D64Writer(object):
+
+    def __init__(self, disk_name, disk_id, interleave=FILE_INTERLEAVE,
+                 layout="c1541"):
+        if layout not in LAYOUTS:
+            raise D64Error("Unknown layout: {}".format(layout))
+
+        self.data = bytearray(TRACK_OFFSETS[TRACK_COUNT + 1])
+        self.disk_name = disk_name
+        self.disk_id = disk_id
+        self.interleave = interleave
+        self.layout_name = layout
+        self.entries = []
+        self.layout = {}
+
+        # The BAM bitmap for each track, with bit n set if sector n is free
+
+        self.bam = [0] + [(1 << SECTORS_PER_TRACK[track]) - 1
+                          for track in range(1, TRACK_COUNT + 1)]
+
+        self.allocate(DIRECTORY_TRACK, 0)
+
+    # Return a writable view of a sector
+
+    def sector(self, track, sector):
+        offset = TRACK_OFFSETS[track] + sector * SECTOR_SIZE
+        return memoryview(self.data)[offset:offset + SECTOR_SIZE]
+
+    # Mark a sector as used in the BAM
+
+    def allocate(self, track, sector):
+        self.bam[track] &= ~(1 << sector)
+
+    # Find the first free sector on a track at or after sector, wrapping
+    # around to the start of the track, and allocate it, returning None if the
+    # track is full
+
+    def allocate_on_track(self, track, sector):
+        sectors = SECTORS_PER_TRACK[track]
+
+        for n in range(sectors):
+            candidate = (sector + n) % sectors
+            if self.bam[track] & (1 << candidate):
+                self.allocate(track, candidate)
+                return candidate
+
+        return None
+
+    # Return the order in which to try tracks for the first block of a file,
+    # which is nearest the directory first, alternating below and above it
+
+    def first_track_order(self):
+        tracks = []
+
+        for distance in range(1, TRACK_COUNT):
+            for track in (DIRECTORY_TRACK - distance,
+                          DIRECTORY_TRACK + distance):
+                if 1 <= track <= TRACK_COUNT:
+                    tracks.append(track)
+
+        return tracks
+
+    # Allocate the first block of a file
+
+    def allocate_first(self):
+        for track in self.first_track_order():
+            sector = self.allocate_on_track(track, 0)
+            if sector is not None:
+                return track, sector
+
+        raise D64Error("Disk full")
+
+    # Allocate the next block of a file, following on from the given track
+    # and sector at the interleave, and moving away from the directory track
+    # when the current track fills up
+
+    def allocate_next(self, track, sector):
+        if self.layout_name == "fast":
+            return self.allocate_next_timed(track, sector)
+
+        sectors = SECTORS_PER_TRACK[track]
+        sector += self.interleave
+
+        if sector >= sectors:
+            sector -= sectors
+            if sector != 0:
+                sector -= 1
+
+        step = -1 if track < DIRECTORY_TRACK else 1
+
+        while 1 <= track <= TRACK_COUNT:
+            if track != DIRECTORY_TRACK:
+                found = self.allocate_on_track(
+                    track, sector % SECTORS_PER_TRACK[track]
+                )
+                if found is not None:
+                    return track, found
+
+            track += step
+
+        # If we run off the edge of the disk, fall back to the first free
+        # sector nearest the directory
+
+        return self.allocate_first()
+
+    # Allocate the next block of a file for the fast layout, by working out
+    # where the disk will be when the loader is ready for the next block, and
+    # picking the first free sector to come round after that, moving away from
+    # the directory track when the current track fills up
+
+    def allocate_next_timed(self, track, sector):
+        ready = float(sector + self.interleave) / SECTORS_PER_TRACK[track]
+        step = -1 if track < DIRECTORY_TRACK else 1
+        candidate = track
+
+        while 1 <= candidate <= TRACK_COUNT:
+            sectors = SECTORS_PER_TRACK[candidate]
+            free = [n for n in range(sectors)
+                    if self.bam[candidate] & (1 << n)]
+
+            if candidate != DIRECTORY_TRACK and free:
+                arrival = ready + (abs(candidate - track) * STEP_MS
+                                   / REVOLUTION_MS)
+                found = min(free, key=lambda n:
+                            (float(n) / sectors - arrival) % 1.0)
+                self.allocate(candidate, found)
+                return candidate, found
+
+            candidate += step
+
+        return self.allocate_first()
+
+    # Allocate the blocks for a file of the given number of blocks, returning
+    # a list of (track, sector) tuples
+
+    def allocate_file(self, count):
+        blocks = [self.allocate_first()]
+
+        for _ in range(1, count):
+            blocks.append(self.allocate_next(*blocks[-1]))
+
+        return blocks
+
+    # Write a file to the disk, where file_type is "prg" or "seq", using the
+    # given list of blocks if there is one, or allocating new blocks if not
+
+    def add_file(self, name, data, file_type="prg", blocks=None):
+        data = bytes(data)
+        chunks = [data[n:n + SECTOR_SIZE - 2]
+                  for n in range(0, len(data), SECTOR_SIZE - 2)] or [b""]
+
+        if blocks is None:
+            blocks = self.allocate_file(len(chunks))
+
+        for n, chunk in enumerate(chunks):
+            block = self.sector(*blocks[n])
+
+            if n + 1 < len(blocks):
+                block[0:2] = bytes(blocks[n + 1])
+            else:
+                block[0:2] = bytes((0, len(chunk) + 1))
+
+            block[2:2 + len(chunk)] = chunk
+
+        self.entries.append((name, file_type, blocks[0], len(blocks)))
+        self.layout[name] = blocks
+
+        return blocks
+
+    # Write a list of (name, data, file_type) files to the disk, allocating
+    # blocks for the named files in first before any of the others (so they
+    # get the tracks nearest the directory), while still adding the files to
+    # the directory in the order given
+
+    def add_files(self, files, first=()):
+        names = [name for name, _, _ in files]
+        order = [names.index(name) for name in first if name in names]
+        order += [n for n in range(len(files)) if n not in order]
+        allocated = {}
+
+        for n in order:
+            allocated[n] = self.allocate_file(block_count(files[n][1]))
+
+        for n, (name, data, file_type) in enumerate(files):
+            self.add_file(name, data, file_type, allocated[n])
+
+    # Build the directory and BAM, and return the finished image, without
+    # changing the writer, so this can be called more than once (the directory
+    # sectors are allocated in a copy of the BAM, and written to a copy of the
+    # disk data)
+
+    def image(self):
+        data, bam = self.data, self.bam
+        self.data, self.bam = bytearray(data), list(bam)
+
+        try:
+            return self.build_image()
+        finally:
+            self.data, self.bam = data, bam
+
+    # Build the directory and BAM in the writer's own disk data and BAM, and
+    # return the finished image (this is called by image on a copy of the
+    # writer's state)
+
+    def build_image(self):
+
+        # Write the directory, eight entries to a sector, starting at 18/1
+
+        directory = [(DIRECTORY_TRACK, 1)]
+        self.allocate(DIRECTORY_TRACK, 1)
+
+        for _ in range(8, len(self.entries), 8):
+            sector = self.allocate_on_track(
+                DIRECTORY_TRACK,
+                (directory[-1][1] + DIRECTORY_INTERLEAVE)
+                % SECTORS_PER_TRACK[DIRECTORY_TRACK]
+            )
+            if sector is None:
+                raise D64Error("Directory full")
+            directory.append((DIRECTORY_TRACK, sector))
+
+        for n, (track, sector) in enumerate(directory):
+            block = self.sector(track, sector)
+
+            if n + 1 < len(directory):
+                block[0:2] = bytes(directory[n + 1])
+            else:
+                block[0:2] = b"\x00\xFF"
+
+            for m, entry in enumerate(self.entries[n * 8:n * 8 + 8]):
+                name, file_type, first, size = entry
+                offset = m * 32
+                block[offset + 2] = FILE_TYPE_BYTES[file_type]
+                block[offset + 3:offset + 5] = bytes(first)
+                block[offset + 5:offset + 21] = pad_petscii(name, 16)
+                block[offset + 30:offset + 32] = bytes((size % 256,
+                                                        size // 256))
+
+        # Write the BAM, which contains the free sector count and bitmap for
+        # each track, followed by the disk name and ID
+
+        bam = self.sector(DIRECTORY_TRACK, 0)
+        bam[0:4] = bytes((DIRECTORY_TRACK, 1, 0x41, 0x00))
+
+        for track in range(1, TRACK_COUNT + 1):
+            bitmap = self.bam[track]
+            offset = track * 4
+            bam[offset] = bin(bitmap).count("1")
+            bam[offset + 1:offset + 4] = bitmap.to_bytes(3, "little")
+
+        bam[0x90:0xA0] = pad_petscii(self.disk_name, 16)
+        bam[0xA0:0xA2] = b"\xA0\xA0"
+        bam[0xA2:0xA4] = (str_to_petscii(self.disk_id) + b"  ")[:2]
+        bam[0xA4:0xAB] = b"\xA0\x32\x41\xA0\xA0\xA0\xA0"
+
+        return bytes(self.data)
+
+    # Return a list of (name, blocks, revolutions, head steps) tuples giving
+    # the modelled load time for each file on the disk, in directory order
+
+    def load_report(self, block_ms=KERNAL_BLOCK_MS, step_ms=STEP_MS):
+        report = []
+
+        for name, _, _, _ in self.entries:
+            revolutions, steps = load_time(self.layout[name], block_ms,
+                                           step_ms)
+            report.append((name, len(self.layout[name]), revolutions, steps))
+
+        return report
+
+    # Write the finished image to a file
+
+    def save(self, filename):
+        data = self.image()
+
+        with open(filename, "wb") as f:
+            f.write(data)
+
+
+# Load a D64 image from a file
+
+def load_d64(filename):
+    with open(filename, "rb") as f:
+        return D64Image(f.read())
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: d64.py <image> [<folder>]")
+        sys.exit(1)
+
+    image = load_d64(sys.argv[1])
+
+    if len(sys.argv) == 2:
+        print('0 "{}"'.format(image.disk_name()))
+        for entry in image.directory():
+            print('{:<5d}"{}" {}'.format(entry["blocks"], entry["name"],
+                                         entry["type"]))
+        return
+
+    folder = sys.argv[2]
+    files = image.read_all_files()
+
+    for name in sorted(files):
+        with open(os.path.join(folder, name), "wb") as f:
+            f.write(files[name])
+
+        print("[ Extract ] {}".format(name))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+#
+# ******************************************************************************
+#
+# ELITE FLICKER-FREE DIFF REPORT
+#
+# Written by Mark Moxon
+#
+# This script compares the files from a build with the reference binaries, and
+# for each file that doesn't match, it lists the ranges of bytes that differ,
+# along with their runtime addresses and the patches that wrote them.
+#
+# The differing ranges are found in bulk rather than byte by byte: the two
+# files are converted into integers and XORed together, and the result is
+# converted back into bytes and searched for runs of non-zero bytes with a
+# regular expression, all of which runs at C speed.
+#
+# The patches are found by compiling the patch manifest into a patch plan (see
+# patch_plan.py), which records which patch wrote each byte of each file.
+#
+# Encrypted files are compared as they are, rather than after decrypting them,
+# as decryption is a suffix sum, so one wrong encrypted byte would change
+# every decrypted byte before it. Each encrypted byte n depends on decrypted
+# bytes n and n + 1, so a differing range of encrypted bytes is extended by
+# one byte at the end (within the scrambled range) before looking up the
+# patches that wrote it, and the addresses shown are those of the encrypted
+# bytes that differ.
+#
+# Run this script with:
+#
+#   python diff_report.py <reference folder> <build folder> <pal|ntsc|plus4>
+#
+# where the build folder contains the original files from the disk image and
+# the binaries from BeebAsm, as well as the files produced by the build.
+#
+# ******************************************************************************
+
+from __future__ import print_function
+import os
+import re
+import sys
+import elite_patcher
+import elite_patches
+import gma_codec
+import patch_plan
+
+
+# A run of non-zero bytes in the XOR of two files
+
+DIFFERENT = re.compile(b"[^\x00]+")
+
+# The stage of each build file, keyed by the suffix on the filename
+
+STAGES = {
+    "": "original",
+    "decrypted": "decrypted",
+    "modified": "modified",
+    "encrypted": "encrypted",
+}
+
+
+# Return a list of (start, end) ranges of offsets where two blocks of data
+# differ, where each range runs from start up to (but not including) end, and
+# ranges that are separated by fewer than gap matching bytes are merged
+
+def diff_ranges(data1, data2, gap=0):
+    length = min(len(data1), len(data2))
+
+    xored = (int.from_bytes(data1[:length], "little")
+             ^ int.from_bytes(data2[:length], "little")).to_bytes(length,
+                                                                   "little")
+
+    ranges = [match.span() for match in DIFFERENT.finditer(xored)]
+
+    if len(data1) != len(data2):
+        ranges.append((length, max(len(data1), len(data2))))
+
+    merged = []
+
+    for start, end in ranges:
+        if merged and start - merged[-1][1] <= gap:
+            merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+
+    return merged
+
+
+# Return the patch file, load address and stage for a build file, or None if
+# the file isn't one of the game files that we patch
+
+def describe_file(filename):
+    if filename == "elite_+4_modified.prg":
+        filename = elite_patcher.PLUS4_FILE + ".modified"
+
+    base, _, suffix = filename.partition(".")
+
+    if filename.startswith(elite_patcher.PLUS4_FILE):
+        base = elite_patcher.PLUS4_FILE
+        suffix = filename[len(base) + 1:]
+
+    if base not in elite_patches.LOAD_ADDRESSES or suffix not in STAGES:
+        return None
+
+    return base, elite_patches.LOAD_ADDRESSES[base], STAGES[suffix]
+
+
+# Return the range of offsets in the decrypted file that can change the
+# encrypted bytes from offset start up to (but not including) offset end, as
+# each encrypted byte n in the scrambled range is decrypted byte n plus
+# decrypted byte n + 1 (and the last scrambled byte uses the seed instead)
+
+def decrypted_range(base, start, end):
+    _, scramble_from, scramble_to = gma_codec.scramble_range(base)
+
+    if scramble_from <= end - 1 < scramble_to:
+        end += 1
+
+    return (start, end)
+
+
+# Return a range of addresses or offsets as a string
+
+def format_range(start, end):
+    if end - start == 1:
+        return "0x{:04X}".format(start)
+
+    return "0x{:04X}-0x{:04X}".format(start, end - 1)
+
+
+# Compile the patch plan for a platform from the files in a build folder,
+# returning the plan and a dictionary of labels for each patch, such as
+# "LL9 (Part 10) at LL79 at 0x9FD9" or "BLINE at 0x2977 (bline.bin)"
+
+def compile_build_plan(folder, platform):
+    if platform == "plus4":
+        images = elite_patcher.load_files(folder, [elite_patcher.PLUS4_FILE])
+        manifest = elite_patches.PLUS4_PATCHES
+        plan = patch_plan.compile_plan(manifest, images,
+                                       elite_patches.LOAD_ADDRESSES,
+                                       bin_folder=folder,
+                                       symbols=elite_patches.PLUS4_SYMBOLS)
+        platform = None
+    else:
+        images = elite_patcher.load_files(
+            folder, elite_patcher.ENCRYPTED_FILES + ["gma1"]
+        )
+        decrypted = elite_patcher.decrypt_c64(images)
+        manifest = elite_patches.C64_PATCHES
+        plan = patch_plan.compile_plan(manifest, decrypted,
+                                       elite_patches.LOAD_ADDRESSES, platform,
+                                       folder,
+                                       symbols=elite_patches.C64_SYMBOLS)
+
+    labels = {}
+
+    for patch in manifest:
+        if patch.get("platform", platform) != platform:
+            continue
+
+        label = "{} at 0x{:04X}".format(patch["name"], patch["addr"])
+
+        if "bin" in patch:
+            label += " ({})".format(patch["bin"])
+
+        labels[patch["name"]] = label
+
+    return plan, labels
+
+
+# Return a list of report lines for one file, where plan and labels come from
+# compile_build_plan
+
+def diff_file(filename, data1, data2, plan=None, labels=None, gap=0):
+    info = describe_file(filename)
+
+    if data1 == data2:
+        return []
+
+    ranges = diff_ranges(data1, data2, gap)
+    count = sum(end - start for start, end in ranges)
+
+    lines = ["{}: {} differing range{} ({} byte{})".format(
+        filename, len(ranges), "" if len(ranges) == 1 else "s",
+        count, "" if count == 1 else "s"
+    )]
+
+    for start, end in ranges:
+        line = "  offset {}".format(format_range(start, end))
+
+        if info is not None:
+            base, load_address, stage = info
+            line += "  address {}".format(
+                format_range(load_address + start, load_address + end)
+            )
+
+            owners = []
+
+            if plan is not None and stage == "modified":
+                owners = plan.owners(base, start, end)
+            elif plan is not None and stage == "encrypted":
+                owners = plan.owners(base, *decrypted_range(base, start, end))
+
+            if owners:
+                line += "  " + ", ".join((labels or {}).get(name, name)
+                                         for name in owners)
+            elif stage in ("modified", "encrypted"):
+                line += "  not patched ({} stage)".format(stage)
+            else:
+                line += "  {} file".format(stage)
+
+        lines.append(line)
+
+    return lines
+
+
+# Compare all of the files that are in both folders, returning a list of
+# report lines for the files that differ
+
+def diff_folders(reference, folder, platform, gap=0):
+    plan, labels = None, None
+
+    try:
+        plan, labels = compile_build_plan(folder, platform)
+    except (IOError, OSError, patch_plan.PatchError) as error:
+        print("[ Warning ] Cannot compile patch plan: {}".format(error),
+              file=sys.stderr)
+
+    lines = []
+
+    for filename in sorted(os.listdir(reference)):
+        path1 = os.path.join(reference, filename)
+        path2 = os.path.join(folder, filename)
+
+        if filename.startswith(".") or not (os.path.isfile(path1)
+                                            and os.path.isfile(path2)):
+            continue
+
+        with open(path1, "rb") as f:
+            data1 = f.read()
+
+        with open(path2, "rb") as f:
+            data2 = f.read()
+
+        lines.extend(diff_file(filename, data1, data2, plan, labels, gap))
+
+    return lines
+
+
+def main():
+    if len(sys.argv) != 4 or sys.argv[3] not in ("pal", "ntsc", "plus4"):
+        print("Usage: diff_report.py <reference folder> <build folder> "
+              "<pal|ntsc|plus4>")
+        sys.exit(1)
+
+    lines = diff_folders(sys.argv[1], sys.argv[2], sys.argv[3])
+
+    print("\n".join(lines) if lines else "All files match")
+
+
+if __name__ == "__main__":
+    main()
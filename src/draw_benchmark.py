@@ -0,0 +1,527 @@
+#!/usr/bin/env python
+#
+# ******************************************************************************
+#
+# ELITE FLICKER-FREE DRAWING BENCHMARK
+#
+# Written by Mark Moxon
+#
+# This script runs the game's drawing routines in the headless 6502 CPU core
+# in cpu6502.py, so we can put numbers on what the flicker-free patch costs
+# when drawing real ships and planets. Where cycle_count.py works out the best
+# and worst cases from the code alone, this runs the code on actual data, so
+# the numbers include every loop iteration and every subroutine call.
+#
+# It builds the memory image of the running game for the original and the
+# flicker-free versions (in the same way as cycle_count.py), and then runs a
+# set of scenarios in each image. Each scenario is a list of calls to entry
+# points such as LL9, PL9, CIRCLE2 and BLINE, each with its own prepared state
+# (the ship data in INWK, the planet's radius and centre in K, K3 and K4, the
+# ball line heap, and so on). The last call in each scenario is the one that
+# is measured, and any earlier calls set things up, such as drawing the
+# previous frame so the measured call has something to erase.
+#
+# The line-drawing routine LL30 is replaced by a trap that records the line
+# and returns, so the cycles don't include drawing the lines, and we count the
+# lines instead. Everything else runs as it does in the game, from the ship
+# blueprints at XX21 to the log tables.
+#
+# The scenarios are fixed, so the table of cycles and line counts is the same
+# every time (only the time it takes to run changes).
+#
+# Run this script with:
+#
+#   python draw_benchmark.py [--platform <c64|plus4>] [--disk <C64 disk image>]
+#                            [--prg <Plus/4 PRG>] [--scenario <name>] [-v]
+#
+# which prints a table of the cycles and line draws for each scenario in the
+# original and patched versions, along with the difference in cycles, and the
+# number of emulated instructions per second. The --scenario option only runs
+# scenarios whose names contain the given text, and -v also prints the lines
+# that each measured call draws.
+#
+# ******************************************************************************
+
+from __future__ import print_function
+import argparse
+import math
+import os
+import time
+import asm6502
+import cpu6502
+import cycle_count
+import elite_patcher
+
+
+# The entry points that scenarios can call, each of which is a tuple of
+# (location, address), where the address is on the Commodore 64, and location
+# gives the offset to the Plus/4 address (see cycle_count.OFFSETS)
+
+ENTRY_POINTS = {
+    "LL9": ("ship", 0x9A86),
+    "PL9": ("planet", 0x7D8C),
+    "CIRCLE2": ("planet", 0x805E),
+    "BLINE": ("bline", 0x2977),
+}
+
+# The address of the ship blueprint lookup table XX21 (the table of addresses
+# for each ship type starts at XX21, with type 1 at XX21), which is the same
+# on both platforms
+
+XX21 = 0xD000
+
+# The address of a free block of memory that we use for the ship line heap
+# that XX19 points to, and for the ship data block that INF points to
+
+SHIP_HEAP = 0xF900
+SHIP_DATA = 0xFA00
+
+# The zero page address of INF, which points to the ship data block
+
+INF = 0x0059
+
+# The value of 1.0 in the orientation vectors
+
+UNIT = 0x6000
+
+# The zero page variables that the game sets up for the space view, which the
+# drawing routines use when clipping to the view, where &B7 is zero for the
+# space view, and &B8 is the y-coordinate of the bottom row of the space view
+
+VIEW_STATE = {
+    0x00B7: 0x00,
+    0x00B8: 0x8F,
+}
+
+# The ship types that the scenarios draw
+
+COBRA_MK3 = 11
+CORIOLIS = 2
+SIDEWINDER = 17
+
+# The planet types for a planet with an equator and meridian, and a planet
+# with a crater
+
+MERIDIAN_PLANET = 128
+CRATER_PLANET = 130
+
+
+# Return a number as a sign-magnitude value, as a list of bytes, low byte
+# first, with the sign in bit 7 of the last byte
+
+def sign_magnitude(value, size):
+    magnitude = min(abs(int(round(value))), (1 << (8 * size - 1)) - 1)
+
+    if value < 0:
+        magnitude |= 1 << (8 * size - 1)
+
+    return [(magnitude >> (8 * n)) & 0xFF for n in range(size)]
+
+
+# Return the nosev, roofv and sidev orientation vectors for a ship that has
+# been turned through the given yaw, pitch and roll angles (in degrees) from
+# facing straight ahead, as a list of 18 bytes in the INWK format
+
+def orientation(yaw, pitch, roll):
+    yaw, pitch, roll = (math.radians(angle) for angle in (yaw, pitch, roll))
+    vectors = [(0, 0, 1), (0, 1, 0), (1, 0, 0)]
+    rotated = []
+
+    for x, y, z in vectors:
+        x, y = (x * math.cos(roll) - y * math.sin(roll),
+                x * math.sin(roll) + y * math.cos(roll))
+        y, z = (y * math.cos(pitch) - z * math.sin(pitch),
+                y * math.sin(pitch) + z * math.cos(pitch))
+        x, z = (x * math.cos(yaw) + z * math.sin(yaw),
+                -x * math.sin(yaw) + z * math.cos(yaw))
+
+        for component in (x, y, z):
+            rotated += sign_magnitude(component * UNIT, 2)
+
+    return rotated
+
+
+# Return the state for drawing a ship of the given type at (x, y, z), with the
+# given orientation and display state in byte #31, for a call to LL9
+
+def ship_state(ship_type, x, y, z, angles, display=0):
+    inwk = (sign_magnitude(x, 3) + sign_magnitude(y, 3)
+            + sign_magnitude(z, 3) + orientation(*angles)
+            + [0, 0, 0, 0, display, 0, SHIP_HEAP & 0xFF, SHIP_HEAP >> 8, 0,
+               0])
+
+    return {
+        "INWK": inwk,
+        "TYPE": ship_type,
+        "XX0": blueprint(ship_type),
+        "XX19": [SHIP_HEAP & 0xFF, SHIP_HEAP >> 8],
+        INF: [SHIP_DATA & 0xFF, SHIP_DATA >> 8],
+    }
+
+
+# Return a function that fetches the blueprint address for a ship type from
+# the XX21 table in memory
+
+def blueprint(ship_type):
+    def fetch(memory):
+        address = XX21 + 2 * (ship_type - 1)
+        return list(memory[address:address + 2])
+
+    return fetch
+
+
+# Return the state for drawing a planet of the given type and radius, with
+# its centre at (x, y) on-screen, for a call to PL9 (the orientation is used
+# for the meridians and craters), where first is True if there is no planet
+# on-screen yet, so the ball line heap is empty
+
+def planet_state(planet_type, radius, x, y, angles=(0, 0, 0), first=False):
+    state = {
+        "INWK": [0, 0, 0, 0, 0, 0, 0, 4, 0] + orientation(*angles),
+        "TYPE": planet_type,
+        "K": [radius & 0xFF, radius >> 8],
+        "K3": [x & 0xFF, (x >> 8) & 0xFF],
+        "K4": [y & 0xFF, (y >> 8) & 0xFF],
+    }
+
+    if first:
+        state.update(empty_ball_heap())
+
+    return state
+
+
+# Return the state for a call to CIRCLE2 for a circle with the given radius
+# and centre, where the ball line heap is empty, and the step size and LSX2
+# are set up as in CIRCLE
+
+def circle_state(radius, x, y):
+    state = planet_state(MERIDIAN_PLANET, radius, x, y, first=True)
+    state["STP"] = 8 if radius < 8 else 4 if radius < 60 else 2
+    state["LSX2"] = 0
+    return state
+
+
+# Return the state for an empty ball line heap, as left by WP1, with a break
+# marker in the first byte of LSY2, so the first point in the heap starts a
+# segment
+
+def empty_ball_heap():
+    return {"LSP": 1, "LSX2": 0xFF, "LSY2": 0xFF, "LSNUM": 0, "LSNUM2": 1}
+
+
+# Return the state for a call to BLINE to add the point (x, y + offset) to
+# the circle, where offset is passed in (T X), following on from the previous
+# point in K5, with FLAG set to flag (so this is the first point of the
+# circle if flag is $FF)
+
+def bline_state(previous, x, y, offset, flag=0):
+    state = empty_ball_heap()
+    state.update({
+        "LSX2": 0,
+        "K4": [y & 0xFF, (y >> 8) & 0xFF],
+        "K5": [previous[0] & 0xFF, (previous[0] >> 8) & 0xFF,
+               previous[1] & 0xFF, (previous[1] >> 8) & 0xFF],
+        "K6": [x & 0xFF, (x >> 8) & 0xFF],
+        "T": (offset >> 8) & 0xFF,
+        "FLAG": flag,
+        "CNT": 0,
+        "STP": 4,
+    })
+    return (state, {"X": offset & 0xFF, "C": 0})
+
+
+# The scenarios, each of which is a tuple of (name, calls), where each call is
+# a tuple of (entry point, state, registers), where state is a dictionary of
+# the bytes to put into memory before the call, keyed by label (which can be
+# an expression like LSY2-1, or an address), and registers is a dictionary
+# of the A, X, Y and C registers to set
+
+SCENARIOS = [
+    ("Cobra Mk III first frame", [
+        ("LL9", ship_state(COBRA_MK3, 0, 0, 0x600, (30, 20, 0)), {}),
+    ]),
+    ("Cobra Mk III redraw", [
+        ("LL9", ship_state(COBRA_MK3, 0, 0, 0x600, (30, 20, 0)), {}),
+        ("LL9", ship_state(COBRA_MK3, 40, -20, 0x5C0, (34, 22, 3), 8), {}),
+    ]),
+    ("Cobra Mk III close up", [
+        ("LL9", ship_state(COBRA_MK3, 0, 0, 0x240, (160, 10, 0)), {}),
+        ("LL9", ship_state(COBRA_MK3, 10, 0, 0x230, (163, 12, 2), 8), {}),
+    ]),
+    ("Cobra Mk III moves away", [
+        ("LL9", ship_state(COBRA_MK3, 0, 0, 0x600, (30, 20, 0)), {}),
+        ("LL9", ship_state(COBRA_MK3, 0, 0, -0x600, (30, 20, 0), 8), {}),
+    ]),
+    ("Cobra Mk III as a dot", [
+        ("LL9", ship_state(COBRA_MK3, 0, 0, 0x3000, (30, 20, 0)), {}),
+        ("LL9", ship_state(COBRA_MK3, 30, 10, 0x3000, (30, 20, 0), 8), {}),
+    ]),
+    ("Coriolis station redraw", [
+        ("LL9", ship_state(CORIOLIS, 0, 0, 0xA00, (45, 10, 0)), {}),
+        ("LL9", ship_state(CORIOLIS, 0, 0, 0x9C0, (45, 10, 4), 8), {}),
+    ]),
+    ("Sidewinder redraw", [
+        ("LL9", ship_state(SIDEWINDER, -80, 30, 0x400, (200, -15, 0)), {}),
+        ("LL9", ship_state(SIDEWINDER, -70, 30, 0x3E0, (204, -15, 5), 8),
+         {}),
+    ]),
+    ("Planet first frame", [
+        ("PL9", planet_state(MERIDIAN_PLANET, 40, 128, 72, (20, 30, 0),
+                             first=True), {}),
+    ]),
+    ("Planet redraw", [
+        ("PL9", planet_state(MERIDIAN_PLANET, 40, 128, 72, (20, 30, 0),
+                             first=True), {}),
+        ("PL9", planet_state(MERIDIAN_PLANET, 42, 130, 73, (22, 31, 0)),
+         {}),
+    ]),
+    ("Cratered planet redraw", [
+        ("PL9", planet_state(CRATER_PLANET, 70, 100, 60, (40, 60, 0),
+                             first=True), {}),
+        ("PL9", planet_state(CRATER_PLANET, 72, 101, 61, (42, 61, 0)), {}),
+    ]),
+    ("Large planet redraw", [
+        ("PL9", planet_state(MERIDIAN_PLANET, 300, 128, 72, first=True),
+         {}),
+        ("PL9", planet_state(MERIDIAN_PLANET, 310, 120, 80), {}),
+    ]),
+    ("CIRCLE2 radius 20", [
+        ("CIRCLE2", circle_state(20, 128, 72), {}),
+    ]),
+    ("CIRCLE2 radius 60", [
+        ("CIRCLE2", circle_state(60, 128, 72), {}),
+    ]),
+    ("CIRCLE2 radius 120 clipped", [
+        ("CIRCLE2", circle_state(120, 60, 72), {}),
+    ]),
+    ("BLINE first point", [
+        ("BLINE",) + bline_state((100, 72), 120, 72, 10, 0xFF),
+    ]),
+    ("BLINE segment", [
+        ("BLINE",) + bline_state((100, 72), 120, 72, 10),
+    ]),
+    ("BLINE clipped segment", [
+        ("BLINE",) + bline_state((0xFFF0, 72), 20, 72, 10),
+    ]),
+]
+
+# The registers that can be set for a call
+
+REGISTERS = ("A", "X", "Y", "C")
+
+
+# The trap for LL30, which records the line in (X1, Y1) to (X2, Y2) and
+# returns from the subroutine, where lines is the list of lines for the
+# current call
+
+class LineRecorder(object):
+
+    def __init__(self, x1):
+        self.x1 = x1
+        self.lines = []
+
+    def __call__(self, cpu):
+        self.lines.append(tuple(cpu.memory[self.x1:self.x1 + 4]))
+        return cpu.rts()
+
+
+# The result of a measured call, where lines is a list of the (X1, Y1, X2, Y2)
+# lines that the call sent to LL30, and executed is the number of instructions
+# that the whole scenario ran, including the calls that set it up
+
+class CallResult(object):
+
+    def __init__(self, cycles, instructions, lines, executed):
+        self.cycles = cycles
+        self.instructions = instructions
+        self.lines = lines
+        self.executed = executed
+
+
+# Return the address of a label or expression, using the symbols from the
+# flicker-free source, or the address itself if it is a number
+
+def address_of(label, symbols):
+    if isinstance(label, int):
+        return label
+
+    def lookup(name):
+        if name not in symbols:
+            raise asm6502.UndefinedSymbol(
+                "Symbol not defined: {}".format(name)
+            )
+
+        return symbols[name]
+
+    return asm6502.Expression(asm6502.tokenize(label), lookup,
+                              None).evaluate()
+
+
+# Return a dictionary of the entry point addresses for a platform
+
+def entry_points(platform):
+    return dict((name, address + cycle_count.OFFSETS[platform][location])
+                for name, (location, address) in ENTRY_POINTS.items())
+
+
+# Put a call's state into memory and the CPU's registers
+
+def prepare(cpu, state, registers, symbols):
+    for label, value in state.items():
+        if callable(value):
+            value = value(cpu.memory)
+
+        if isinstance(value, int):
+            value = [value]
+
+        address = address_of(label, symbols)
+        cpu.memory[address:address + len(value)] = bytes(value)
+
+    for register in REGISTERS:
+        if register in registers:
+            setattr(cpu, register.lower(), registers[register])
+
+
+# Run a scenario's calls in a copy of a memory image, returning the CallResult
+# for the last call, where each call can run for up to limit instructions
+
+def run_scenario(image, calls, symbols, entries,
+                 limit=cpu6502.DEFAULT_LIMIT):
+    cpu = cpu6502.CPU(bytearray(image))
+    recorder = LineRecorder(symbols["X1"])
+    cpu.trap(symbols["LL30"], recorder)
+    prepare(cpu, VIEW_STATE, {}, symbols)
+
+    for entry, state, registers in calls:
+        recorder.lines = []
+        prepare(cpu, state, registers, symbols)
+        cycles, instructions = cpu.call(entries[entry], limit)
+
+    return CallResult(cycles, instructions, recorder.lines, cpu.instructions)
+
+
+# Run the scenarios in the original and patched images, returning a list of
+# (name, original result, patched result) tuples
+
+def run_scenarios(original, patched, symbols, platform, scenarios):
+    entries = entry_points(platform)
+
+    return [(name,
+             run_scenario(original, calls, symbols, entries),
+             run_scenario(patched, calls, symbols, entries))
+            for name, calls in scenarios]
+
+
+# Return the report for a platform as a list of strings
+
+def report(platform, results, verbose=False):
+    lines = [
+        cycle_count.PLATFORM_NAMES[platform],
+        "",
+        "{:<28} {:>15} {:>15} {:>8}".format("Scenario", "Original",
+                                            "Patched", "Delta"),
+        "{:<28} {:>9} {:>5} {:>9} {:>5}".format("", "Cycles", "Lines",
+                                                "Cycles", "Lines"),
+        "-" * 70,
+    ]
+
+    for name, original, patched in results:
+        lines.append("{:<28} {:>9} {:>5} {:>9} {:>5} {:>+8}".format(
+            name, original.cycles, len(original.lines), patched.cycles,
+            len(patched.lines), patched.cycles - original.cycles
+        ))
+
+        if not verbose:
+            continue
+
+        for version, result in (("original", original), ("patched", patched)):
+            lines.append("    {:<8} {}".format(version, " ".join(
+                "({},{})-({},{})".format(*line) for line in result.lines
+            ) or "no lines"))
+
+    lines.append("")
+    return lines
+
+
+# Add the options for choosing the platform and the original game files to
+# an argument parser
+
+def add_image_arguments(parser):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    originals = os.path.join(root, "original-disks")
+
+    parser.add_argument("--platform", choices=["c64", "plus4"],
+                        help="only run this platform")
+    parser.add_argument("--disk",
+                        default=os.path.join(
+                            originals, "elite[firebird_1986](pal)(v040486).g64"
+                        ),
+                        help="Commodore 64 disk image or folder of extracted "
+                        "files (default: the original PAL disk)")
+    parser.add_argument("--prg",
+                        default=os.path.join(originals,
+                                             elite_patcher.PLUS4_FILE),
+                        help="unpacked Plus/4 binary (default: {})".format(
+                            elite_patcher.PLUS4_FILE
+                        ))
+
+
+# Build the original and patched memory images for a platform, returning a
+# tuple of (original, patched, symbols), where symbols are the symbols from
+# the flicker-free source
+
+def platform_images(platform, args):
+    assembler = cycle_count.assemble_source(platform)
+    bins = assembler.outputs()
+
+    if platform == "c64":
+        original, patched = cycle_count.c64_images(args.disk, bins)
+    else:
+        original, patched = cycle_count.plus4_images(args.prg, bins)
+
+    return (original, patched, assembler.symbols)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the original and flicker-free drawing routines in "
+        "a 6502 emulator and count the cycles and line draws"
+    )
+    add_image_arguments(parser)
+    parser.add_argument("--scenario",
+                        help="only run scenarios whose names contain this")
+    parser.add_argument("-v", dest="verbose", action="store_true",
+                        help="print the lines that each scenario draws")
+    args = parser.parse_args()
+
+    scenarios = [scenario for scenario in SCENARIOS
+                 if not args.scenario
+                 or args.scenario.lower() in scenario[0].lower()]
+    instructions = 0
+    elapsed = 0
+
+    print()
+
+    for platform in ("c64", "plus4"):
+        if args.platform and platform != args.platform:
+            continue
+
+        original, patched, symbols = platform_images(platform, args)
+
+        start = time.time()
+        results = run_scenarios(original, patched, symbols, platform,
+                                scenarios)
+        elapsed += time.time() - start
+        instructions += sum(original.executed + patched.executed
+                            for _, original, patched in results)
+
+        print("\n".join(report(platform, results, args.verbose)))
+
+    if elapsed:
+        print("[ Speed   ] {:.2f} million instructions per second".format(
+            instructions / elapsed / 1e6
+        ))
+
+
+if __name__ == "__main__":
+    main()
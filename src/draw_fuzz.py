@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+#
+# ******************************************************************************
+#
+# ELITE FLICKER-FREE DIFFERENTIAL FUZZER
+#
+# Written by Mark Moxon
+#
+# This script checks that the flicker-free drawing routines draw the same
+# lines as the originals. The flicker-free patch changes the order in which
+# lines are erased and drawn, so each old line is erased just after the new
+# line that replaces it is drawn, but the lines that go to the screen should
+# be the same. So if we run a redraw in the original and patched versions of
+# the game, we should get the same set of lines sent to the line-drawing
+# routine LL30, just in a different order.
+#
+# It uses the same 6502 emulator and memory images as draw_benchmark.py, but
+# instead of a fixed set of scenarios, it generates random cases, each of
+# which draws something and then redraws it after a small change:
+#
+#   * "ship" cases draw a random ship type at a random position and
+#     orientation with LL9, and then redraw it after it has moved and turned
+#     a little, which covers the clipping in LL145 and the ship line heap
+#
+#   * "planet" cases draw a planet of random type and radius with PL9 and then
+#     redraw it, which covers BLINE, the ball line heap and the erasing in
+#     LL155
+#
+#   * "circle" cases draw a circle of random radius with CIRCLE2
+#
+# The lines from the last call in each case are compared as sets, where a
+# line from (X1, Y1) to (X2, Y2) is the same as a line from (X2, Y2) to
+# (X1, Y1), and any case where the sets differ is reported.
+#
+# Each case is generated from the seed and the case number, so any case can
+# be run again on its own with --start and --cases 1 (along with the same
+# --seed and --kind options), whichever process runs it. The cases are split
+# into shards, which are run in parallel by a pool of worker processes, each
+# of which builds its own emulator for each case.
+#
+# Run this script with:
+#
+#   python draw_fuzz.py [--platform <c64|plus4>] [--disk <C64 disk image>]
+#                       [--prg <Plus/4 PRG>] [--kind <ship|planet|circle>]
+#                       [--cases <number>] [--start <number>] [--seed <seed>]
+#                       [--shard <size>] [--jobs <number>] [-v]
+#
+# which prints each case that differs, along with a summary for each
+# platform, and exits with an error if any cases differ. The -v option also
+# prints the lines that are only drawn by one version.
+#
+# ******************************************************************************
+
+from __future__ import print_function
+import argparse
+import concurrent.futures
+import os
+import random
+import sys
+import time
+import cpu6502
+import cycle_count
+import draw_benchmark
+
+
+# The ship types in the blueprint table at XX21, which has the same 33 ships
+# on both platforms
+
+SHIP_TYPES = range(1, 34)
+
+# The planet types that PL9 draws
+
+PLANET_TYPES = (draw_benchmark.MERIDIAN_PLANET, draw_benchmark.CRATER_PLANET)
+
+# The maximum number of instructions for each call, so a case that gets stuck
+# in a loop is reported rather than hanging the worker
+
+CALL_LIMIT = 2000000
+
+# The number of cases in each shard
+
+DEFAULT_SHARD = 50
+
+# The memory images for each platform in a worker process, keyed by platform,
+# each of which is a tuple of (original, patched, symbols, entry points), as
+# set up by start_worker
+
+WORKER_IMAGES = {}
+
+
+# Return a random set of yaw, pitch and roll angles, and a set of angles that
+# are turned a little from them
+
+def random_angles(rng):
+    angles = (rng.uniform(0, 360), rng.uniform(-90, 90), rng.uniform(0, 360))
+    turned = tuple(angle + rng.uniform(-5, 5) for angle in angles)
+    return (angles, turned)
+
+
+# Return a random ship case, as a tuple of (description, calls), where the
+# ship is drawn and then redrawn after moving and turning, and is sometimes
+# behind us or off-screen
+
+def ship_case(rng):
+    ship_type = rng.choice(SHIP_TYPES)
+    z = rng.randint(-0x400, 0x4000)
+    spread = max(z, 0x400)
+    x = rng.randint(-spread, spread)
+    y = rng.randint(-spread, spread)
+    angles, turned = random_angles(rng)
+    moved = (x + rng.randint(-32, 32), y + rng.randint(-32, 32),
+             z + rng.randint(-64, 64))
+
+    description = "ship type {} at ({}, {}, {}) turned ({:.0f}, {:.0f}, " \
+        "{:.0f})".format(ship_type, x, y, z, *angles)
+
+    return (description, [
+        ("LL9", draw_benchmark.ship_state(ship_type, x, y, z, angles), {}),
+        ("LL9", draw_benchmark.ship_state(ship_type, *moved, angles=turned,
+                                          display=8), {}),
+    ])
+
+
+# Return a random planet case, as a tuple of (description, calls), where the
+# planet is drawn and then redrawn with a slightly different radius, centre
+# and orientation
+
+def planet_case(rng):
+    planet_type = rng.choice(PLANET_TYPES)
+    radius = rng.randint(1, 600)
+    x = rng.randint(-200, 456)
+    y = rng.randint(-100, 244)
+    angles, turned = random_angles(rng)
+    moved = (max(1, radius + rng.randint(-8, 8)), x + rng.randint(-8, 8),
+             y + rng.randint(-8, 8))
+
+    description = "planet type {} radius {} at ({}, {}) turned ({:.0f}, " \
+        "{:.0f}, {:.0f})".format(planet_type, radius, x, y, *angles)
+
+    return (description, [
+        ("PL9", draw_benchmark.planet_state(planet_type, radius, x, y, angles,
+                                            first=True), {}),
+        ("PL9", draw_benchmark.planet_state(planet_type, *moved,
+                                            angles=turned), {}),
+    ])
+
+
+# Return a random circle case, as a tuple of (description, calls)
+
+def circle_case(rng):
+    radius = rng.randint(1, 400)
+    x = rng.randint(-200, 456)
+    y = rng.randint(-100, 244)
+
+    description = "circle radius {} at ({}, {})".format(radius, x, y)
+
+    return (description, [
+        ("CIRCLE2", draw_benchmark.circle_state(radius, x, y), {}),
+    ])
+
+
+# The kinds of case, each of which is a function that generates a random case
+# of that kind
+
+CASE_KINDS = {
+    "ship": ship_case,
+    "planet": planet_case,
+    "circle": circle_case,
+}
+
+
+# Return the case with the given number, as a tuple of (description, calls),
+# where the kind of case cycles through kinds, and the random numbers only
+# depend on the seed and the case number
+
+def make_case(seed, kinds, number):
+    rng = random.Random("{}:{}".format(seed, number))
+    return CASE_KINDS[kinds[number % len(kinds)]](rng)
+
+
+# Return a list of lines as a set of segments, where each segment has its
+# end points in order, so it doesn't matter which way round a line is drawn
+
+def segments(lines):
+    return set(tuple(sorted((line[:2], line[2:]))) for line in lines)
+
+
+# Run a case's calls in a memory image, returning a tuple of (segments,
+# instructions, error), where error is the error message if the emulator
+# stopped, or None
+
+def run_case(image, calls, symbols, entries):
+    try:
+        result = draw_benchmark.run_scenario(image, calls, symbols, entries,
+                                             CALL_LIMIT)
+    except cpu6502.EmulatorError as error:
+        return (set(), 0, str(error))
+
+    return (segments(result.lines), result.executed, None)
+
+
+# Set up a worker process with the memory images for each platform, keyed by
+# platform, each of which is a tuple of (original, patched, symbols)
+
+def start_worker(images):
+    for platform, (original, patched, symbols) in images.items():
+        WORKER_IMAGES[platform] = (original, patched, symbols,
+                                   draw_benchmark.entry_points(platform))
+
+
+# Run a shard of cases in a worker process, returning a tuple of (differences,
+# instructions), where differences is a list of (platform, number,
+# description, only original, only patched, errors) tuples, one for each case
+# whose lines differ or where the emulator stopped
+
+def run_shard(platform, seed, kinds, numbers):
+    original, patched, symbols, entries = WORKER_IMAGES[platform]
+    differences = []
+    instructions = 0
+
+    for number in numbers:
+        description, calls = make_case(seed, kinds, number)
+        original_lines, original_count, original_error = run_case(
+            original, calls, symbols, entries
+        )
+        patched_lines, patched_count, patched_error = run_case(
+            patched, calls, symbols, entries
+        )
+        instructions += original_count + patched_count
+
+        if (original_lines != patched_lines or original_error
+                or patched_error):
+            differences.append((
+                platform, number, description,
+                sorted(original_lines - patched_lines),
+                sorted(patched_lines - original_lines),
+                [error for error in (original_error, patched_error)
+                 if error]
+            ))
+
+    return (differences, instructions)
+
+
+# Return the report for a case that differs as a list of strings
+
+def report(difference, verbose=False):
+    platform, number, description, only_original, only_patched, errors = \
+        difference
+
+    lines = ["[ Differs ] {} case {}: {}: {} lines only in original, {} only "
+             "in patched".format(platform, number, description,
+                                 len(only_original), len(only_patched))]
+
+    for error in errors:
+        lines.append("    error    {}".format(error))
+
+    if verbose:
+        for version, only in (("original", only_original),
+                              ("patched", only_patched)):
+            if only:
+                lines.append("    {:<8} {}".format(version, " ".join(
+                    "({},{})-({},{})".format(*(start + end))
+                    for start, end in only
+                )))
+
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that the flicker-free drawing routines draw the "
+        "same lines as the originals, using random ships, planets and "
+        "circles in a 6502 emulator"
+    )
+    draw_benchmark.add_image_arguments(parser)
+    parser.add_argument("--kind", action="append",
+                        choices=sorted(CASE_KINDS),
+                        help="only run this kind of case (can be repeated)")
+    parser.add_argument("--cases", type=int, default=600,
+                        help="number of cases for each platform (default: "
+                        "600)")
+    parser.add_argument("--start", type=int, default=0,
+                        help="number of the first case (default: 0)")
+    parser.add_argument("--seed", default="elite",
+                        help="seed for the random cases (default: elite)")
+    parser.add_argument("--shard", type=int, default=DEFAULT_SHARD,
+                        help="number of cases in each shard (default: "
+                        "{})".format(DEFAULT_SHARD))
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes")
+    parser.add_argument("-v", dest="verbose", action="store_true",
+                        help="print the lines that only one version draws")
+    args = parser.parse_args()
+
+    kinds = sorted(set(args.kind or CASE_KINDS))
+    platforms = [platform for platform in ("c64", "plus4")
+                 if not args.platform or platform == args.platform]
+    images = dict((platform, draw_benchmark.platform_images(platform, args))
+                  for platform in platforms)
+    numbers = range(args.start, args.start + args.cases)
+    shard = max(1, args.shard)
+
+    differences = []
+    instructions = 0
+    start = time.time()
+
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=max(1, args.jobs), initializer=start_worker,
+            initargs=(images,)) as executor:
+        futures = [executor.submit(run_shard, platform, args.seed, kinds,
+                                   numbers[n:n + shard])
+                   for platform in platforms
+                   for n in range(0, len(numbers), shard)]
+
+        for future in concurrent.futures.as_completed(futures):
+            shard_differences, shard_instructions = future.result()
+            differences += shard_differences
+            instructions += shard_instructions
+
+    elapsed = time.time() - start
+
+    # Print the results in order, so the report is the same however the
+    # cases were split between the workers
+
+    differences.sort(key=lambda difference: (
+        platforms.index(difference[0]), difference[1]
+    ))
+
+    for difference in differences:
+        print("\n".join(report(difference, args.verbose)))
+
+    for platform in platforms:
+        print("[ Fuzz    ] {}: {} {} cases, {} differ".format(
+            cycle_count.PLATFORM_NAMES[platform], len(numbers),
+            "/".join(kinds),
+            sum(1 for difference in differences
+                if difference[0] == platform)
+        ))
+
+    print("[ Speed   ] {:.2f} million instructions per second over {} "
+          "workers".format(instructions / max(elapsed, 1e-9) / 1e6,
+                           max(1, args.jobs)))
+
+    if differences:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+#
+# ******************************************************************************
+#
+# ELITE FLICKER-FREE BATCH PATCHER
+#
+# Written by Mark Moxon
+#
+# This script searches a folder (and all its subfolders) for Commodore 64 disk
+# images and Plus/4 game binaries, identifies which release of Elite each one
+# contains using the fingerprints in elite_releases.py, and applies the
+# flicker-free patch to each supported release, using a pool of worker
+# processes so the files are patched in parallel.
+#
+# Run this script with:
+#
+#   python elite-batch.py <folder> <output folder> [--bins <folder>]
+#
+# where the bins folder contains the binaries and readme64.txt that are built
+# by BeebAsm (this defaults to work/asm, which is where elite-build.py puts
+# them). Each supported Commodore 64 disk is patched into a D64 disk image,
+# and each supported Plus/4 binary is patched into a PRG file, and these are
+# saved in the output folder, in the same subfolders as the originals. Files
+# that aren't supported releases are reported as unsupported.
+#
+# ******************************************************************************
+
+from __future__ import print_function
+import argparse
+import concurrent.futures
+import datetime
+import os
+import sys
+import d64
+import elite_patcher
+import elite_releases
+import g64
+import patch_plan
+
+
+# Return a sorted list of the paths of the files in a folder and its
+# subfolders that might contain a release of Elite
+
+def find_files(folder):
+    paths = []
+    extensions = (elite_releases.DISK_EXTENSIONS
+                  + elite_releases.PRG_EXTENSIONS)
+
+    for parent, _, filenames in os.walk(folder):
+        for filename in filenames:
+            if filename.lower().endswith(extensions):
+                paths.append(os.path.join(parent, filename))
+
+    return sorted(paths)
+
+
+# Load the binaries and readme from BeebAsm into a dictionary, keyed by
+# filename
+
+def load_bins(folder):
+    bins = {}
+
+    for filename in sorted(os.listdir(folder)):
+        if filename.endswith(".bin"):
+            key = filename
+        elif filename.lower() == "readme64.txt":
+            key = "readme64.txt"
+        else:
+            continue
+
+        with open(os.path.join(folder, filename), "rb") as f:
+            bins[key] = f.read()
+
+    return bins
+
+
+# Identify and patch one file, saving the result into the output folder, and
+# return a (status, release name, message) tuple, where status is "patched",
+# "unsupported" or "failed"
+#
+# This runs in a worker process, so any unexpected error is returned as a
+# failure for this file rather than raised, as that would stop the whole batch
+
+def patch_file(path, output_path, bins, build_date):
+    try:
+        return patch_release(path, output_path, bins, build_date)
+    except Exception as error:
+        return ("failed", None, "unexpected {}: {}".format(
+            type(error).__name__, error
+        ))
+
+
+# Identify and patch one file for patch_file, returning a (status, release
+# name, message) tuple
+
+def patch_release(path, output_path, bins, build_date):
+    try:
+        files = elite_releases.load_game_files(path)
+    except (IOError, ValueError) as error:
+        return ("unsupported", None, "cannot read file: {}".format(error))
+    except (d64.D64Error, g64.G64Error) as error:
+        return ("failed", None, "cannot read disk image: {}".format(error))
+
+    release = elite_releases.identify(files)
+
+    if release is None:
+        return ("unsupported", None, "unknown release")
+
+    platform = release["platform"]
+
+    try:
+        if platform == "plus4":
+            outputs = elite_patcher.patch_plus4(files, bins)
+            data_block = outputs["elite_+4_modified.prg"]
+            output_path += ".prg"
+        else:
+            files.update(elite_patcher.patch_c64(files, platform, bins))
+            files["readme64.txt"] = bins["readme64.txt"]
+            data_block = elite_patcher.build_c64_disk(platform, files,
+                                                      build_date)
+            output_path += ".d64"
+    except (patch_plan.PatchError, KeyError) as error:
+        return ("failed", release["name"], str(error))
+
+    folder = os.path.dirname(output_path)
+
+    if folder and not os.path.isdir(folder):
+        os.makedirs(folder, exist_ok=True)
+
+    with open(output_path, "wb") as f:
+        f.write(data_block)
+
+    return ("patched", release["name"], output_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Identify and patch every release of Elite in a folder"
+    )
+    parser.add_argument("folder")
+    parser.add_argument("output")
+    parser.add_argument("--bins", default=os.path.join("work", "asm"),
+                        help="folder containing the binaries from BeebAsm "
+                        "(default: work/asm)")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes")
+    parser.add_argument("--date", default=datetime.date.today().isoformat(),
+                        help="build date for the disk directory")
+    args = parser.parse_args()
+
+    bins = load_bins(args.bins)
+    paths = find_files(args.folder)
+    results = {}
+
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=max(1, args.jobs)) as executor:
+        futures = {}
+
+        for path in paths:
+            relative = os.path.relpath(path, args.folder)
+            output_path = os.path.join(
+                args.output,
+                os.path.splitext(relative)[0] + "-flicker-free"
+            )
+            futures[executor.submit(patch_file, path, output_path, bins,
+                                    args.date)] = relative
+
+        for future in concurrent.futures.as_completed(futures):
+            results[futures[future]] = future.result()
+
+    # Print the results in order, so the report is the same however the work
+    # was split between the workers
+
+    counts = {"patched": 0, "unsupported": 0, "failed": 0}
+
+    for relative in sorted(results):
+        status, name, message = results[relative]
+        counts[status] += 1
+
+        if status == "patched":
+            print("[ Patched ] {} ({}) -> {}".format(relative, name, message))
+        elif status == "failed":
+            print("[ Failed  ] {} ({}): {}".format(
+                relative, name or "unidentified", message
+            ))
+        else:
+            print("[ Skip    ] {}: {}".format(relative, message))
+
+    print("[ Batch   ] {} patched, {} unsupported, {} failed".format(
+        counts["patched"], counts["unsupported"], counts["failed"]
+    ))
+
+    if counts["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,525 @@
+#!/usr/bin/env python
+#
+# ******************************************************************************
+#
+# ELITE FLICKER-FREE BUILD DRIVER
+#
+# Written by Mark Moxon
+#
+# This script builds the NTSC, PAL and Plus/4 versions of flicker-free Elite.
+# It models the build as a graph of steps, each of which depends on the steps
+# that produce its inputs, and it runs independent steps at the same time:
+#
+#   * Assemble the readme (once, shared by both disks)
+#
+#   * Assemble the flicker-free code for the Commodore 64 (once, shared by
+#     the NTSC and PAL builds, as the output is identical) and for the Plus/4
+#
+#   * Extract the game files from the original NTSC and PAL disk images
+#     (using g64.py), and copy the unpacked Plus/4 game
+#
+#   * Patch each version (using elite-modify.py and elite-modify-plus4.py)
+#
+#   * Build the NTSC and PAL disk images (using elite-disk.py)
+#
+#   * Report the checksums for each version (using crc32.py)
+#
+# The external tools (BeebAsm and the Python scripts) are run as asyncio
+# subprocesses, and the file copies are run in a thread pool, with no more
+# than --jobs steps running at any one time. By default the assembly steps use
+# the built-in assembler in asm6502.py, which runs in the thread pool and
+# produces the same binaries as BeebAsm; use --assembler beebasm to run BeebAsm
+# instead.
+#
+# Steps that produce files can be cached (see build_cache.py), in which case
+# each step lists its input files, the tools it runs and its output files. If
+# the inputs and tools haven't changed since an earlier build, the outputs are
+# copied out of the cache rather than running the step again, so a rebuild
+# with no changes only has to copy the cached files and report the checksums.
+# The cache is stored in the .build-cache folder, which is limited to 256 MB by
+# default, with the least recently used entries being deleted first.
+#
+# Each version is built in its own folder inside the work folder (work/ntsc,
+# work/pal and work/plus4), and the shared BeebAsm output goes into work/asm,
+# from where it is copied into each version's folder, so the checksum reports
+# cover the same files as before. The output from each step is collected and
+# printed when the step finishes, so the logs from concurrent steps don't get
+# mixed up, and the checksum reports are printed in order at the end.
+#
+# Run this script from the repository folder with:
+#
+#   python src/elite-build.py [--assembler <builtin|beebasm>]
+#                             [--beebasm <path>] [--jobs <n>] [--no-cache]
+#
+# ******************************************************************************
+
+from __future__ import print_function
+import argparse
+import asyncio
+import datetime
+import os
+import shutil
+import sys
+import time
+import asm6502
+import build_cache
+
+
+# The exception raised when a build step fails
+
+class BuildError(Exception):
+    pass
+
+
+# The original disk image for each Commodore 64 version
+
+C64_DISKS = {
+    "ntsc": "elite[firebird_1986](ntsc)(v060186)(!).g64",
+    "pal": "elite[firebird_1986](pal)(v040486).g64",
+}
+
+# The files that BeebAsm produces for each platform
+
+C64_BINS = [
+    "shppt.bin", "ll78.bin", "ll155.bin", "bline.bin", "pl9.bin",
+    "wpls2.bin", "extra.bin", "extra2.bin",
+]
+
+PLUS4_BINS = [
+    "shppt-plus4.bin", "ll78-plus4.bin", "ll155-plus4.bin", "bline-plus4.bin",
+    "pl9-plus4.bin", "wpls2-plus4.bin", "extra-plus4.bin",
+    "trumble-plus4.bin",
+]
+
+# The files that are extracted from each original disk image
+
+C64_EXTRACTED = {
+    "ntsc": ["firebird", "gma1", "gma3", "gma4", "gma5", "gma6"],
+    "pal": ["firebird", "byebyejulie", "gma1", "gma3", "gma4", "gma5",
+            "gma6"],
+}
+
+# The files that elite-modify.py reads and writes
+
+C64_MODIFY_INPUTS = ["gma1", "gma4", "gma5", "gma6"]
+
+C64_MODIFY_OUTPUTS = [
+    "gma1.modified",
+    "gma4.decrypted", "gma4.modified", "gma4.encrypted",
+    "gma5.decrypted", "gma5.modified", "gma5.encrypted",
+    "gma6.decrypted", "gma6.modified", "gma6.encrypted",
+]
+
+# The Python modules that the patching and disk scripts import, which are part
+# of the cache key for those steps
+
+PATCHER_MODULES = [
+    "elite_patcher.py", "elite_patches.py", "patch_plan.py", "gma_codec.py",
+    "overlay_image.py", "d64.py", "asm6502.py", "mos6502.py",
+    "patch_check.py",
+]
+
+# The Python modules that make up the built-in assembler, which are part of
+# the cache key for the assembly steps when we use it
+
+ASSEMBLER_MODULES = ["asm6502.py", "mos6502.py"]
+
+# The readme file that BeebAsm produces, and the name it is given in each
+# version's folder (BeebAsm saves it in upper case, but the disk builder looks
+# for it in lower case, which only matters on case-sensitive file systems)
+
+README_FILE = "README64.txt"
+README_COPY = "readme64.txt"
+
+# The unpacked Plus/4 game binary
+
+PLUS4_FILE = "elite_+4_unpacked.prg"
+
+
+# A build step, which runs once all of the steps it depends on have finished,
+# where run is a coroutine function that takes the step and returns the
+# step's output as a string
+#
+# If outputs is a list of files, then the step can be cached, using a key
+# built from the step name, the input files, the tools and any extra
+# arguments in args
+
+class Step(object):
+
+    def __init__(self, name, depends, run, report=False, inputs=(),
+                 tools=(), outputs=None, args=()):
+        self.name = name
+        self.depends = depends
+        self.run = run
+        self.report = report
+        self.inputs = inputs
+        self.tools = tools
+        self.outputs = outputs
+        self.args = args
+        self.output = ""
+        self.cached = False
+
+    # Return the cache key for this step
+
+    def cache_key(self):
+        try:
+            return build_cache.make_key(self.inputs, self.tools,
+                                        [self.name] + list(self.args))
+        except build_cache.ToolNotFound as error:
+            raise BuildError("{} failed\n{}".format(self.name, error))
+
+
+# Return a coroutine function that runs a command in the given folder, and
+# saves its output into log_file (in the same folder) if one is given
+
+def command(args, cwd, log_file=None):
+
+    async def run(step):
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *args, cwd=cwd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT
+            )
+        except FileNotFoundError:
+            raise BuildError("{} failed\nCannot find {} (is it installed "
+                             "and on the path?)".format(step.name, args[0]))
+
+        output = (await process.communicate())[0].decode("latin-1")
+
+        if log_file is not None:
+            with open(os.path.join(cwd, log_file), "w") as f:
+                f.write(output)
+            output = ""
+
+        if process.returncode != 0:
+            raise BuildError("{} failed with exit code {}\n{}".format(
+                step.name, process.returncode, output
+            ))
+
+        return output
+
+    return run
+
+
+# Return a coroutine function that assembles a source file with the built-in
+# assembler in a worker thread, saving the files into the output folder, and
+# saving the listing into log_file (in the same folder) if one is given, in
+# the same way as running BeebAsm with -v
+
+def assemble(source, output_folder, log_file=None):
+
+    def run_assembler():
+        assembler = asm6502.assemble_file(source, output_folder)
+
+        if log_file is not None:
+            with open(os.path.join(output_folder, log_file), "w") as f:
+                for line in asm6502.listing(assembler):
+                    f.write(line + "\n")
+                for filename, _, _ in assembler.saves:
+                    f.write("Saving file '{}'\n".format(filename))
+
+    async def run(step):
+        try:
+            await asyncio.get_event_loop().run_in_executor(None,
+                                                           run_assembler)
+        except (asm6502.AsmError, IOError) as error:
+            raise BuildError("{} failed\n{}".format(step.name, error))
+
+        return ""
+
+    return run
+
+
+# Return a coroutine function that copies a list of files from one folder to
+# another in a worker thread, where renames is an optional dictionary of new
+# names for the copies
+
+def copy_files(source, destination, filenames, renames=None):
+
+    def copy():
+        for filename in filenames:
+            shutil.copyfile(
+                os.path.join(source, filename),
+                os.path.join(destination,
+                             (renames or {}).get(filename, filename))
+            )
+
+    async def run(step):
+        await asyncio.get_event_loop().run_in_executor(None, copy)
+        return ""
+
+    return run
+
+
+# Build the graph of steps for the whole build, returning a dictionary of
+# steps keyed by name
+
+def build_graph(root, work, disks, python, beebasm, build_date,
+                assembler="builtin"):
+    src = os.path.join(root, "src")
+    originals = os.path.join(root, "original-disks")
+    asm = os.path.join(work, "asm")
+    steps = []
+
+    def add(name, depends, run, report=False, **cache):
+        steps.append(Step(name, depends, run, report, **cache))
+
+    def script(name):
+        return [python, os.path.join(src, name)]
+
+    def paths(folder, filenames):
+        return [os.path.join(folder, filename) for filename in filenames]
+
+    patcher = paths(src, PATCHER_MODULES)
+
+    # The shared assembly steps, which are run once for all versions
+
+    for name, source, log_file, outputs in (
+        ("readme", "elite-flicker-free-readme.asm", None, [README_FILE]),
+        ("c64", "elite-flicker-free.asm", "compile.txt", C64_BINS),
+        ("plus4", "elite-flicker-free-plus4.asm", "compile-plus4.txt",
+         PLUS4_BINS),
+    ):
+        source = os.path.join(src, source)
+        outputs = paths(asm, outputs + ([log_file] if log_file else []))
+
+        if assembler == "beebasm":
+            args = [beebasm, "-i", source] + (["-v"] if log_file else [])
+            add("assemble " + name, [], command(args, asm, log_file),
+                inputs=[source], tools=[beebasm], outputs=outputs)
+        else:
+            add("assemble " + name, [], assemble(source, asm, log_file),
+                inputs=[source] + paths(src, ASSEMBLER_MODULES),
+                outputs=outputs)
+
+    # The Commodore 64 versions
+
+    for platform in sorted(C64_DISKS):
+        folder = os.path.join(work, platform)
+        disk = os.path.join(disks,
+                            "c64-elite-flicker-free-{}.d64".format(platform))
+
+        image = os.path.join(originals, C64_DISKS[platform])
+
+        add("extract " + platform, [], command(
+            script("g64.py") + [image, folder], folder
+        ), inputs=[image] + paths(src, ["g64.py", "d64.py"]),
+            tools=[python], outputs=paths(folder, C64_EXTRACTED[platform]))
+
+        add("copy bins " + platform, ["assemble c64"],
+            copy_files(asm, folder, C64_BINS))
+
+        add("copy readme " + platform, ["assemble readme"],
+            copy_files(asm, folder, [README_FILE],
+                       {README_FILE: README_COPY}))
+
+        add("modify " + platform,
+            ["extract " + platform, "copy bins " + platform],
+            command(script("elite-modify.py") + [platform, "--debug"],
+                    folder),
+            inputs=paths(folder, C64_MODIFY_INPUTS + C64_BINS)
+            + paths(src, ["elite-modify.py"]) + patcher,
+            tools=[python], outputs=paths(folder, C64_MODIFY_OUTPUTS),
+            args=[platform])
+
+        add("disk " + platform,
+            ["modify " + platform, "copy readme " + platform],
+            command(script("elite-disk.py") + [platform, disk, build_date],
+                    folder),
+            inputs=paths(folder, C64_EXTRACTED[platform] + C64_MODIFY_OUTPUTS
+                         + [README_COPY])
+            + paths(src, ["elite-disk.py"]) + patcher,
+            tools=[python], outputs=[disk], args=[platform, build_date])
+
+        add("checksum " + platform, ["modify " + platform], command(
+            script("crc32.py") + [
+                os.path.join("reference-binaries", platform),
+                os.path.relpath(folder, root)
+            ],
+            root
+        ), report=True)
+
+    # The Plus/4 version
+
+    folder = os.path.join(work, "plus4")
+
+    add("copy plus4", [], copy_files(originals, folder, [PLUS4_FILE]))
+
+    add("copy bins plus4", ["assemble plus4"],
+        copy_files(asm, folder, PLUS4_BINS))
+
+    add("modify plus4", ["copy plus4", "copy bins plus4"],
+        command(script("elite-modify-plus4.py"), folder),
+        inputs=paths(folder, [PLUS4_FILE] + PLUS4_BINS)
+        + paths(src, ["elite-modify-plus4.py"]) + patcher,
+        tools=[python], outputs=paths(folder, ["elite_+4_modified.prg"]))
+
+    add("checksum plus4", ["modify plus4"], command(
+        script("crc32.py") + [
+            os.path.join("reference-binaries", "plus4"),
+            os.path.relpath(folder, root)
+        ],
+        root
+    ), report=True)
+
+    return dict((step.name, step) for step in steps)
+
+
+# Check that every dependency in the graph exists and that there are no
+# cycles, returning the step names in an order where each step comes after
+# all of its dependencies
+
+def topological_order(steps):
+    order = []
+    state = {}
+
+    def visit(name, path):
+        if name not in steps:
+            raise BuildError("Unknown step: {}".format(name))
+
+        if state.get(name) == "done":
+            return
+
+        if state.get(name) == "visiting":
+            raise BuildError("Dependency cycle: {}".format(
+                " -> ".join(path + [name])
+            ))
+
+        state[name] = "visiting"
+
+        for depend in steps[name].depends:
+            visit(depend, path + [name])
+
+        state[name] = "done"
+        order.append(name)
+
+    for name in sorted(steps):
+        visit(name, [])
+
+    return order
+
+
+# Run a step, fetching its outputs from the cache if they are there, and
+# storing them in the cache if the step has to be run
+
+async def run_cached(step, cache):
+    if cache is None or step.outputs is None:
+        return await step.run(step)
+
+    loop = asyncio.get_event_loop()
+    key = await loop.run_in_executor(None, step.cache_key)
+
+    if await loop.run_in_executor(None, cache.fetch, key, step.outputs):
+        step.cached = True
+        return ""
+
+    output = await step.run(step)
+    await loop.run_in_executor(None, cache.store, key, step.outputs)
+    return output
+
+
+# Run all of the steps in the graph, with no more than jobs steps running at
+# once, starting each step as soon as its dependencies have finished, and
+# using the build cache if one is given
+
+async def run_graph(steps, jobs, cache=None, verbose=True):
+    limit = asyncio.Semaphore(jobs)
+    tasks = {}
+
+    async def run_step(step):
+        await asyncio.gather(*(tasks[depend] for depend in step.depends))
+
+        async with limit:
+            start = time.time()
+            step.output = await run_cached(step, cache)
+
+        if verbose:
+            print("[ {:<7} ] {} ({:.2f}s)".format(
+                "Cached" if step.cached else "Done",
+                step.name, time.time() - start
+            ))
+            if step.output and not step.report:
+                print(step.output.rstrip())
+
+    for name in topological_order(steps):
+        tasks[name] = asyncio.ensure_future(run_step(steps[name]))
+
+    try:
+        await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        raise
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build flicker-free Elite for the Commodore 64 and Plus/4"
+    )
+    parser.add_argument("--assembler", choices=["builtin", "beebasm"],
+                        default="builtin",
+                        help="assembler to use (default: builtin)")
+    parser.add_argument("--beebasm", default="beebasm",
+                        help="path to BeebAsm (default: beebasm)")
+    parser.add_argument("--python", default=sys.executable,
+                        help="path to Python (default: this Python)")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1,
+                        help="maximum number of steps to run at once")
+    parser.add_argument("--work", default="work",
+                        help="work folder (default: work)")
+    parser.add_argument("--disks", default=None,
+                        help="folder for the disk images "
+                        "(default: flicker-free-disks)")
+    parser.add_argument("--cache", default=None,
+                        help="build cache folder (default: .build-cache)")
+    parser.add_argument("--cache-size", type=int, default=256,
+                        help="build cache size limit in MB (default: 256)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="run every step without using the cache")
+    parser.add_argument("--date", default=datetime.date.today().isoformat(),
+                        help="build date for the disk directory")
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    work = os.path.abspath(args.work)
+    disks = os.path.abspath(args.disks or os.path.join(root,
+                                                       "flicker-free-disks"))
+
+    # Create an empty work folder, with a folder for each part of the build
+
+    shutil.rmtree(work, ignore_errors=True)
+
+    for folder in ("asm", "ntsc", "pal", "plus4"):
+        os.makedirs(os.path.join(work, folder))
+
+    steps = build_graph(root, work, disks, args.python, args.beebasm,
+                        args.date, args.assembler)
+    start = time.time()
+
+    cache = None
+
+    if not args.no_cache:
+        cache = build_cache.BuildCache(
+            args.cache or os.path.join(root, ".build-cache"),
+            args.cache_size * 1024 * 1024
+        )
+
+    try:
+        asyncio.run(run_graph(steps, max(1, args.jobs), cache))
+    except BuildError as error:
+        print("[ Error   ] {}".format(error))
+        sys.exit(1)
+
+    # Print the checksum reports in order, now that everything has finished
+
+    for name in ("checksum ntsc", "checksum pal", "checksum plus4"):
+        print(steps[name].output.rstrip())
+
+    print()
+    print("[ Build   ] Finished in {:.2f}s".format(time.time() - start))
+
+
+if __name__ == "__main__":
+    main()
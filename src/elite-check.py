@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+#
+# ******************************************************************************
+#
+# ELITE FLICKER-FREE PATCH SITE CHECKER
+#
+# Written by Mark Moxon
+#
+# This script checks every flicker-free patch site in a release of Elite
+# against the original instructions in the patch manifests, using the checks
+# in patch_check.py, so we can see whether a release can be patched without
+# decrypting it and looking at every site by hand.
+#
+# Run this script with:
+#
+#   python elite-check.py <disk image, PRG or folder> [--platform <platform>]
+#                         [-v]
+#
+# where the folder contains the files extracted from the disk (gma1, gma4,
+# gma5 and gma6) or the unpacked Plus/4 binary. The platform is worked out
+# from the files if it isn't given, and -v prints the decoded instructions and
+# the bound symbols for every site, rather than just the ones that don't
+# match.
+#
+# ******************************************************************************
+
+from __future__ import print_function
+import argparse
+import os
+import sys
+import elite_patcher
+import elite_patches
+import elite_releases
+import patch_check
+
+
+# Load the unmodified game files from a disk image, PRG file or folder of
+# extracted files, returning a tuple of (images, platform), where the C64 files
+# are decrypted
+
+def load_images(path, platform=None):
+    if os.path.isdir(path):
+        if platform == "plus4" or os.path.isfile(
+                os.path.join(path, elite_patcher.PLUS4_FILE)):
+            files = elite_patcher.load_files(path, [elite_patcher.PLUS4_FILE])
+        else:
+            files = elite_patcher.load_files(
+                path, elite_patcher.ENCRYPTED_FILES + ["gma1"]
+            )
+    else:
+        files = elite_releases.load_game_files(path)
+
+    if platform is None:
+        release = elite_releases.identify(files)
+
+        if release is not None:
+            platform = release["platform"]
+        elif elite_patcher.PLUS4_FILE in files:
+            platform = "plus4"
+        else:
+            raise ValueError("Unknown release, use --platform to choose one")
+
+    if platform == "plus4":
+        return (files, platform)
+
+    return (elite_patcher.decrypt_c64(files), platform)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check the flicker-free patch sites in an Elite release"
+    )
+    parser.add_argument("source",
+                        help="disk image, PRG file or folder of game files")
+    parser.add_argument("--platform", choices=["pal", "ntsc", "plus4"],
+                        help="platform of the release (default: identify it "
+                        "from the files)")
+    parser.add_argument("-v", dest="verbose", action="store_true",
+                        help="print the decoded instructions for every site")
+    args = parser.parse_args()
+
+    try:
+        images, platform = load_images(args.source, args.platform)
+    except (IOError, KeyError, ValueError) as error:
+        print("[ Error   ] {}".format(error))
+        sys.exit(1)
+
+    if platform == "plus4":
+        results = patch_check.check_manifest(elite_patches.PLUS4_PATCHES,
+                                             images,
+                                             elite_patches.LOAD_ADDRESSES)
+    else:
+        results = patch_check.check_manifest(elite_patches.C64_PATCHES,
+                                             images,
+                                             elite_patches.LOAD_ADDRESSES,
+                                             platform)
+
+    print("\n".join(patch_check.report(results, args.verbose)))
+
+    problems = patch_check.failures(results)
+    variables = patch_check.check_variables(
+        "plus4" if platform == "plus4" else "c64"
+    )
+
+    for problem in variables:
+        print("Variable {}".format(problem))
+
+    if platform == "plus4":
+        defects = patch_check.check_defects(elite_patches.PLUS4_PATCHES,
+                                            elite_patches.PLUS4_SYMBOLS)
+    else:
+        defects = patch_check.check_defects(elite_patches.C64_PATCHES,
+                                            elite_patches.C64_SYMBOLS,
+                                            platform)
+
+    stale = [result for result in defects if result[2] is not None]
+
+    for patch, _, problem in stale:
+        print("{}: patch {} at 0x{:04X} {}".format(
+            patch["file"], patch["name"], patch["addr"], problem
+        ))
+
+    print()
+    print("[ Check   ] {} of {} patch sites match".format(
+        len(results) - len(problems), len(results)
+    ))
+
+    known = [result for result in defects if result[1] is not None]
+
+    if known:
+        print("[ Defects ] {} known patch defect{}:".format(
+            len(known), "" if len(known) == 1 else "s"
+        ))
+
+        for patch, defect, _ in known:
+            print("    {}: patch {} at 0x{:04X}".format(
+                patch["file"], patch["name"], patch["addr"]
+            ))
+            print("    {}".format(defect))
+
+    if problems or variables or stale:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
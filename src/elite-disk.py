@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+#
+# ******************************************************************************
+#
+# COMMODORE 64 ELITE FLICKER-FREE DISK BUILDER
+#
+# Written by Mark Moxon
+#
+# This script builds the flicker-free disk image for Commodore 64 Elite from
+# the original and patched files, without having to call c1541. The disk is
+# built in memory by d64.py and is saved in one go.
+#
+# Run this script by changing directory to the folder containing the patched
+# files and running the script with:
+#
+#   python elite-disk.py <pal|ntsc> <d64 file> [<build date>]
+#
+# where the build date defaults to today's date.
+#
+# By default the disk uses the fast layout from d64.py, which puts the big
+# game files on the tracks nearest the directory and places each block where
+# the KERNAL loader will be ready for it. Use --layout c1541 to lay out the
+# disk like c1541 instead, --interleave to change the sector interleave, and
+# --report to print the modelled load time for each file, so layouts can be
+# compared.
+#
+# ******************************************************************************
+
+from __future__ import print_function
+import argparse
+import datetime
+import d64
+import elite_patcher
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build the flicker-free Commodore 64 Elite disk image"
+    )
+    parser.add_argument("platform", choices=["pal", "ntsc"])
+    parser.add_argument("d64_file")
+    parser.add_argument("build_date", nargs="?",
+                        default=datetime.date.today().isoformat())
+    parser.add_argument("--layout", choices=d64.LAYOUTS, default="fast",
+                        help="sector layout (default: fast)")
+    parser.add_argument("--interleave", type=int,
+                        default=d64.FILE_INTERLEAVE,
+                        help="sector interleave (default: {})".format(
+                            d64.FILE_INTERLEAVE))
+    parser.add_argument("--report", action="store_true",
+                        help="print the modelled load time for each file")
+    args = parser.parse_args()
+
+    sources = [source for _, source, _ in
+               elite_patcher.C64_DISK_FILES[args.platform]]
+    files = elite_patcher.load_files(".", sources)
+
+    disk = elite_patcher.write_c64_disk(args.platform, files,
+                                        args.build_date, args.interleave,
+                                        args.layout)
+    disk.save(args.d64_file)
+
+    print("[ Save    ] {}".format(args.d64_file))
+
+    if args.report:
+        print("File             Blocks   Revs  Steps   Time")
+        total = 0.0
+
+        for name, blocks, revolutions, steps in disk.load_report():
+            seconds = revolutions * d64.REVOLUTION_MS / 1000
+            total += seconds
+            print("{:<16} {:>6} {:>6.1f} {:>6} {:>5.1f}s".format(
+                name, blocks, revolutions, steps, seconds
+            ))
+
+        print("Total {:>38.1f}s".format(total))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+#!/usr/bin/env python
+#
+# ******************************************************************************
+#
+# ELITE FLICKER-FREE PATCHER
+#
+# Written by Mark Moxon
+#
+# This module applies the flicker-free patch to Commodore 64 and Commodore
+# Plus/4 Elite entirely in memory, so it can be called from other Python code
+# without spawning a process or writing any files. The elite-modify.py and
+# elite-modify-plus4.py scripts are thin wrappers around it.
+#
+# The main entry points are:
+#
+#   * decrypt_c64(images) takes a dictionary containing the gma1, gma4, gma5
+#     and gma6 files from the original disk, and returns a dictionary of the
+#     decrypted files as overlay images, which can be passed to patch_c64 to
+#     build multiple variants from the same decrypted files
+#
+#   * patch_c64(images, platform) takes a dictionary containing the gma1,
+#     gma4, gma5 and gma6 files from the original disk, and returns a
+#     dictionary containing gma1.modified, gma4.encrypted, gma5.encrypted and
+#     gma6.encrypted
+#
+#   * build_c64_disk(platform, files, build_date) takes a dictionary of the
+#     original and patched files, and returns a D64 disk image containing the
+#     flicker-free game (write_c64_disk does the same but returns the
+#     D64Writer, so the layout and modelled load times can be inspected)
+#
+#   * patch_plus4(images) takes a dictionary containing elite_+4_unpacked.prg
+#     and returns a dictionary containing elite_+4_modified.prg
+#
+# The binary files from BeebAsm are taken from the bins dictionary if one is
+# given, or are loaded from bin_folder otherwise.
+#
+# Each variant is patched in an overlay image that shares the decrypted files
+# (see overlay_image.py), so it only holds its own patches until it is
+# encrypted.
+#
+# If a dictionary of expected hashes is given in expected (in the same format
+# as the entries in reference-binaries/manifest.json, keyed by filename), then
+# each stage (the decrypted, modified and encrypted versions of each file) is
+# checked against its expected SHA-256 as soon as it is produced, and a
+# VerifyError is raised at the first mismatch.
+#
+# The intermediate files (the decrypted and modified versions of each
+# encrypted file) are only saved if debug_folder is set, in which case they
+# are saved into that folder, and progress messages are only printed if
+# verbose is set.
+#
+# ******************************************************************************
+
+from __future__ import print_function
+import hashlib
+import os
+import d64
+import elite_patches
+import gma_codec
+import overlay_image
+import patch_plan
+
+
+# The encrypted files that we patch, in the order that we process them
+
+ENCRYPTED_FILES = ["gma6", "gma5", "gma4"]
+
+# The stages that patch_c64 and patch_plus4 check against the expected hashes,
+# keyed by platform
+
+VERIFIED_STAGES = {
+    "c64": ["{}.{}".format(filename, stage)
+            for filename in ENCRYPTED_FILES
+            for stage in ("decrypted", "modified", "encrypted")]
+    + ["gma1.modified"],
+    "plus4": ["elite_+4_modified.prg"],
+}
+
+# The files that make up the flicker-free disk for each platform, in the order
+# they are written to the disk, as (name on disk, source file, file type)
+
+C64_DISK_FILES = {
+    "ntsc": [
+        ("firebird", "firebird", "prg"),
+        ("gma1", "gma1.modified", "prg"),
+        ("gma3", "gma3", "prg"),
+        ("gma4", "gma4.encrypted", "prg"),
+        ("gma5", "gma5.encrypted", "prg"),
+        ("gma6", "gma6.encrypted", "prg"),
+        ("readme", "readme64.txt", "seq"),
+    ],
+    "pal": [
+        ("firebird", "firebird", "prg"),
+        ("byebyejulie", "byebyejulie", "prg"),
+        ("gma1", "gma1.modified", "prg"),
+        ("gma3", "gma3", "prg"),
+        ("gma4", "gma4.encrypted", "prg"),
+        ("gma5", "gma5.encrypted", "prg"),
+        ("gma6", "gma6.encrypted", "prg"),
+        ("readme", "readme64.txt", "seq"),
+    ],
+}
+
+# The big game files, which are placed on the tracks nearest the directory in
+# this order when the disk is built with the fast layout, to cut down on
+# loading time
+
+C64_FAST_FILES = ["gma6", "gma4", "gma5"]
+
+# The disk name and ID for the flicker-free disks
+
+C64_DISK_NAME = "no-flicker elite"
+C64_DISK_ID = "1"
+
+# The name of the Plus/4 game binary
+
+PLUS4_FILE = "elite_+4_unpacked.prg"
+
+
+# The exception raised when a file doesn't match its expected hash
+
+class VerifyError(Exception):
+    pass
+
+
+# Check a file against its expected SHA-256, if expected is set and contains
+# an entry for the file, printing a warning if verbose is set and there is no
+# entry for the file, so it can't be checked
+
+def verify_file(expected, filename, data_block, verbose=False):
+    if expected is None:
+        return
+
+    if filename not in expected:
+        if verbose:
+            print("[ Warning ] {} not verified (no reference checksum)".format(
+                filename
+            ))
+        return
+
+    if hashlib.sha256(data_block).hexdigest() != expected[filename]["sha256"]:
+        raise VerifyError("{} does not match the reference binary".format(
+            filename
+        ))
+
+    if verbose:
+        print("[ Verify  ] {}".format(filename))
+
+
+# Save a debug file into debug_folder, if one has been specified
+
+def save_debug_file(debug_folder, filename, data_block, verbose):
+    if debug_folder is None:
+        return
+
+    with open(os.path.join(debug_folder, filename), "wb") as f:
+        f.write(data_block)
+
+    if verbose:
+        print("[ Save    ] {}".format(filename))
+
+
+# Return a list of the stages in VERIFIED_STAGES for a platform ("c64" or
+# "plus4") that have no entry in expected, so they can't be verified
+
+def unverified_stages(expected, platform):
+    return [stage for stage in VERIFIED_STAGES[platform]
+            if stage not in expected]
+
+
+# Decrypt the gma6, gma5 and gma4 files, returning a dictionary of overlay
+# images (one for each of these files, plus gma1) that can be used as the base
+# for any number of patched variants
+
+def decrypt_c64(images, debug_folder=None, verbose=False, expected=None):
+    decrypted = {}
+
+    for filename in ENCRYPTED_FILES:
+        data_block = gma_codec.decrypt_file(filename, images[filename])
+
+        if verbose:
+            print("[ Decrypt ] {}".format(filename))
+
+        verify_file(expected, filename + ".decrypted", data_block, verbose)
+        save_debug_file(debug_folder, filename + ".decrypted", data_block,
+                        verbose)
+
+        decrypted[filename] = overlay_image.OverlayImage(data_block)
+
+    decrypted["gma1"] = overlay_image.OverlayImage(images["gma1"])
+
+    return decrypted
+
+
+# Apply the flicker-free patch to Commodore 64 Elite for the given platform
+# ("pal" or "ntsc"), using the decrypted files from decrypt_c64 if they are
+# given (otherwise the files in images are decrypted first)
+
+def patch_c64(images, platform="pal", bins=None, bin_folder=".",
+              debug_folder=None, verbose=False, decrypted=None,
+              expected=None):
+    if decrypted is None:
+        decrypted = decrypt_c64(images, debug_folder, verbose, expected)
+
+    variant = dict((filename, image.fork())
+                   for filename, image in decrypted.items())
+    outputs = {}
+
+    # Compile the patches for this platform into a patch plan, which also
+    # checks that we are patching the bytes we expect to patch, and that none
+    # of the patches overlap
+
+    plan = patch_plan.compile_plan(elite_patches.C64_PATCHES, variant,
+                                   elite_patches.LOAD_ADDRESSES, platform,
+                                   bin_folder, bins,
+                                   elite_patches.C64_SYMBOLS)
+
+    # Apply the patches to each of the encrypted files and re-encrypt them,
+    # recalculating the encrypted bytes around each of the modifications and
+    # leaving the rest of the original encrypted file alone
+
+    for filename in ENCRYPTED_FILES:
+        plan.apply_overlay(filename, variant[filename])
+
+        if verbose:
+            print("[ Modify  ] {}: {}".format(filename,
+                                              plan.summary(filename)))
+
+        data_block = variant[filename].materialize()
+
+        verify_file(expected, filename + ".modified", data_block, verbose)
+        save_debug_file(debug_folder, filename + ".modified", data_block,
+                        verbose)
+
+        gma_codec.encrypt_ranges(data_block, bytes(images[filename]),
+                                 *gma_codec.scramble_range(filename),
+                                 ranges=variant[filename].ranges())
+
+        if verbose:
+            print("[ Encrypt ] {}.modified".format(filename))
+
+        verify_file(expected, filename + ".encrypted", data_block, verbose)
+        outputs[filename + ".encrypted"] = bytes(data_block)
+
+    # Finally, remove the disk protection from gma1
+
+    plan.apply_overlay("gma1", variant["gma1"])
+
+    if verbose:
+        print("[ Modify  ] gma1: {}".format(plan.summary("gma1")))
+
+    outputs["gma1.modified"] = bytes(variant["gma1"].materialize())
+    verify_file(expected, "gma1.modified", outputs["gma1.modified"], verbose)
+
+    return outputs
+
+
+# Write the flicker-free disk for the given platform into a D64Writer, where
+# files is a dictionary containing the source files listed in C64_DISK_FILES,
+# and the build date is added to the end of the directory as an empty SEQ file
+#
+# The layout is "fast" (the default) to place the big files for the quickest
+# loading, or "c1541" to lay out the disk in the same way as c1541
+
+def write_c64_disk(platform, files, build_date, interleave=None,
+                   layout="fast"):
+    if interleave is None:
+        interleave = d64.FILE_INTERLEAVE
+
+    disk = d64.D64Writer(C64_DISK_NAME, C64_DISK_ID, interleave, layout)
+
+    disk_files = [(name, files[source], file_type)
+                  for name, source, file_type in C64_DISK_FILES[platform]]
+    disk_files.append(("build {}".format(build_date), b"", "seq"))
+
+    disk.add_files(disk_files, C64_FAST_FILES if layout == "fast" else ())
+
+    return disk
+
+
+# Build the flicker-free disk image for the given platform, returning the
+# image as a bytes object
+
+def build_c64_disk(platform, files, build_date, interleave=None,
+                   layout="fast"):
+    return write_c64_disk(platform, files, build_date, interleave,
+                          layout).image()
+
+
+# Apply the flicker-free patch to Commodore Plus/4 Elite
+
+def patch_plus4(images, bins=None, bin_folder=".", verbose=False,
+                expected=None):
+    data_block = bytearray(images[PLUS4_FILE])
+
+    plan = patch_plan.compile_plan(elite_patches.PLUS4_PATCHES,
+                                   {PLUS4_FILE: data_block},
+                                   elite_patches.LOAD_ADDRESSES,
+                                   bin_folder=bin_folder, bins=bins,
+                                   symbols=elite_patches.PLUS4_SYMBOLS)
+
+    plan.apply(PLUS4_FILE, data_block)
+
+    if verbose:
+        print("[ Modify  ] {}: {}".format(PLUS4_FILE,
+                                          plan.summary(PLUS4_FILE)))
+
+    verify_file(expected, "elite_+4_modified.prg", data_block, verbose)
+
+    return {"elite_+4_modified.prg": bytes(data_block)}
+
+
+# Load the binary files from BeebAsm that are listed in expected from a
+# folder, checking each one against its expected hash, and return them in a
+# dictionary that can be passed to patch_c64 or patch_plus4 as bins
+
+def load_verified_bins(folder, expected, verbose=False):
+    bins = {}
+
+    for filename in sorted(expected):
+        path = os.path.join(folder, filename)
+
+        if filename.endswith(".bin") and os.path.isfile(path):
+            with open(path, "rb") as f:
+                bins[filename] = f.read()
+
+            verify_file(expected, filename, bins[filename], verbose)
+
+    return bins
+
+
+# Load a set of files from a folder into a dictionary, keyed by filename
+
+def load_files(folder, filenames, verbose=False):
+    images = {}
+
+    for filename in filenames:
+        with open(os.path.join(folder, filename), "rb") as f:
+            images[filename] = f.read()
+
+        if verbose:
+            print("[ Read    ] {}".format(filename))
+
+    return images
+
+
+# Save a dictionary of files into a folder
+
+def save_files(folder, outputs, verbose=False):
+    for filename in sorted(outputs):
+        with open(os.path.join(folder, filename), "wb") as f:
+            f.write(outputs[filename])
+
+        if verbose:
+            print("[ Save    ] {}".format(filename))
@@ -0,0 +1,981 @@
+#!/usr/bin/env python
+#
+# ******************************************************************************
+#
+# ELITE FLICKER-FREE PATCH MANIFESTS
+#
+# Written by Mark Moxon
+#
+# This file describes every modification that the flicker-free patch makes to
+# Commodore 64 and Commodore Plus/4 Elite, as data rather than code. Each patch
+# is a dictionary with the following keys:
+#
+#   * name      A description of the patch, for reporting
+#
+#   * file      The file being patched (such as "gma6")
+#
+#   * addr      The runtime address of the first byte to patch
+#
+#   * bin       The name of a binary file from BeebAsm to insert at addr
+#
+#   * asm       Assembly language to assemble at addr and insert (see
+#               asm6502.py), with multiple instructions separated by colons,
+#               which can refer to the labels in the platform's symbols
+#               (C64_SYMBOLS or PLUS4_SYMBOLS)
+#
+#   * bytes     A list of bytes to insert at addr
+#
+#   * nops      The number of NOPs to insert at addr (after any asm or bytes)
+#
+#   * copy_from The address to copy bytes from (the bytes are taken from the
+#               unmodified file), used with length
+#
+#   * length    The number of bytes to copy when using copy_from
+#
+#   * from      The original instructions at addr, in the same format as
+#               asm, which are disassembled and checked by patch_check.py
+#               before patching (see that file for details)
+#
+#   * expect    The bytes that we expect to find at addr before patching, so
+#               we can check we are patching the right place
+#
+#   * platform  Only apply this patch for this platform ("pal" or "ntsc")
+#
+#   * known     The instructions that the patch should insert at this site,
+#               in the same format as asm, if the patch has a known defect
+#               that we keep so the output still matches the reference
+#               binaries (patch_check.py checks that asm still assembles to
+#               something different and reports the site as a known patch
+#               defect, or reports a problem if the defect has gone)
+#
+# The manifests are compiled into a patch plan and applied by patch_plan.py.
+#
+# The code changes are described here, which can be read alongside the
+# following manifests:
+#
+# https://elite.bbcelite.com/deep_dives/backporting_the_flicker-free_algorithm.html
+#
+# The addresses in the following are from when the game binary is loaded into
+# memory. They were calculated by analysing a memory dump of the running game,
+# searching for patterns in the bytes to match them with the corrsponding code
+# from the BBC Micro version (which is very similar, if you ignore any different
+# addresses).
+#
+# ******************************************************************************
+
+import gma_codec
+
+
+# Load addresses for each of the files that we patch, which are two bytes
+# before the actual load address, so they include the PRG header
+
+LOAD_ADDRESSES = {
+    "gma1": 0x0334 - 2,
+    "gma4": gma_codec.GMA_FILES["gma4"]["load_address"],
+    "gma5": gma_codec.GMA_FILES["gma5"]["load_address"],
+    "gma6": gma_codec.GMA_FILES["gma6"]["load_address"],
+    "elite_+4_unpacked.prg": 0x1100 - 2,
+}
+
+# Set the addresses for the extra routines (LLX30, PATCH1, PATCH2) that we will
+# append to the end of the main game code (where there is a bit of free space)
+
+llx30 = 0xCCE0
+patch1 = 0xCD1E
+patch2 = 0xCD35
+
+# Set the addresses for the extra routines (EraseRestOfPlanet, PATCH4, PATCH5)
+# that we will insert into the sprite area (where there is a bit of free space)
+
+erasep = 0xCD3B
+patch4 = 0x69D0
+patch5 = 0x69D5
+
+# The variables that the original code and the patches refer to, which are at
+# the same addresses in all of the releases we patch (the "from" instructions
+# are checked against these by patch_check.py)
+
+VARIABLES = {
+    "T1": 0x06,
+    "XX1": 0x09,
+    "XX19": 0x2A,
+    "K4": 0x43,
+    "XX0": 0x57,
+    "V": 0x5B,
+    "XX15": 0x6B,
+    "U": 0x99,
+    "Q": 0x9A,
+    "XX17": 0x9F,
+    "FLAG": 0xA9,
+    "CNT": 0xAA,
+    "CNT2": 0xAB,
+    "XX4": 0xAD,
+    "XX20": 0xAE,
+    "XX3": 0x0100,
+}
+
+# The labels that the assembly language in the patches refers to, where PL20
+# and PL40 are the new addresses of these labels in the modified PL9 and PLS22
+# routines
+
+C64_SYMBOLS = dict(VARIABLES, **{
+    "LLX30": llx30,
+    "PATCH1": patch1,
+    "PATCH2": patch2,
+    "EraseRestOfPlanet": erasep,
+    "PATCH4": patch4,
+    "PATCH5": patch5,
+    "PL20": 0x7D95,
+    "PL40": 0x7F10,
+})
+
+C64_PATCHES = [
+
+    # SHPPT
+    #
+    # We start with the new version of SHPPT, which we have already assembled
+    # in BeebAsm and saved as the binary file shppt.bin, so we simply drop this
+    # over the top of the existing routine (which is slightly longer, so there
+    # is room).
+
+    {
+        "name": "SHPPT",
+        "file": "gma6",
+        "addr": 0x9932,
+        "bin": "shppt.bin",
+        "from": "JSR PROJ",
+        "expect": [0x20, 0xD8, 0x9A],
+    },
+
+    # LL9 (Part 1)
+    #
+    # This is the modification just after LL9. We insert the extra code with a
+    # call to the new PATCH1 routine, which implements the original
+    # instructions before moving on to the new code.
+    #
+    # From: LDA #31
+    #       STA XX4
+    #
+    # To:   JSR PATCH1
+    #       NOP
+
+    {
+        "name": "LL9 (Part 1)",
+        "file": "gma6",
+        "addr": 0x9A8A,
+        "asm": "JSR PATCH1",
+        "nops": 1,
+        "from": "LDA #31 : STA XX4",
+        "expect": [0xA9, 0x1F, 0x85, 0xAD],
+    },
+
+    # LL9 (Part 9)
+    #
+    # This is the modification at EE31.
+    #
+    # From: LDA #%00001000
+    #       BIT XX1+31
+    #       BEQ LL74
+    #       JSR LL155
+    #
+    # To:   LDY #9
+    #       LDA (XX0),Y
+    #       STA XX20
+    #       NOP
+    #       NOP
+    #       NOP
+
+    {
+        "name": "LL9 (Part 9) at EE31",
+        "file": "gma6",
+        "addr": 0x9F2A,
+        "asm": "LDY #9 : LDA (XX0),Y : STA XX20",
+        "nops": 3,
+        "from": "LDA #%00001000 : BIT XX1+31 : BEQ LL74 : "
+                "JSR LL155",
+        "expect": [0xA9, 0x08, 0x24, 0x28, 0xF0, 0x05, 0x20, 0x78, 0xA1],
+    },
+
+    # LL9 (Part 9)
+    #
+    # This is the modification just after LL74.
+    #
+    # From: LDY #9
+    #       LDA (XX0),Y
+    #       STA XX20
+    #       LDY #0
+    #       STY U
+    #       STY XX17
+    #       INC U
+    #
+    # To:   LDY #0
+    #       STY XX17
+    #       NOP x10
+
+    {
+        "name": "LL9 (Part 9) at LL74",
+        "file": "gma6",
+        "addr": 0x9F39,
+        "asm": "LDY #0 : STY XX17",
+        "nops": 10,
+        "from": "LDY #9 : LDA (XX0),Y : STA XX20 : LDY #0 : "
+                "STY U : STY XX17 : INC U",
+        "expect": [0xA0, 0x09, 0xB1, 0x57, 0x85, 0xAE, 0xA0, 0x00,
+                   0x84, 0x99, 0x84, 0x9F, 0xE6, 0x99],
+    },
+
+    # LL9 (Part 9)
+    #
+    # This is the modification at the end of the routine.
+    #
+    # From: LDY U
+    #       LDA XX15
+    #       STA (XX19),Y
+    #       INY
+    #       LDA XX15+1
+    #       STA (XX19),Y
+    #       INY
+    #       LDA XX15+2
+    #       STA (XX19),Y
+    #       INY
+    #       LDA XX15+3
+    #       STA (XX19),Y
+    #       INY
+    #       STY U
+    #
+    # To:   JSR LLX30
+    #       NOP x21
+
+    {
+        "name": "LL9 (Part 9) at end",
+        "file": "gma6",
+        "addr": 0x9F87,
+        "asm": "JSR LLX30",
+        "nops": 21,
+        "from": "LDY U : LDA XX15 : STA (XX19),Y : INY : "
+                "LDA XX15+1 : STA (XX19),Y : INY : "
+                "LDA XX15+2 : STA (XX19),Y : INY : "
+                "LDA XX15+3 : STA (XX19),Y : INY : STY U",
+        "expect": [0xA4, 0x99, 0xA5, 0x6B, 0x91, 0x2A, 0xC8, 0xA5,
+                   0x6C, 0x91, 0x2A, 0xC8, 0xA5, 0x6D, 0x91, 0x2A,
+                   0xC8, 0xA5, 0x6E, 0x91, 0x2A, 0xC8, 0x84, 0x99],
+    },
+
+    # LL9 (Part 10)
+    #
+    # This is the modification around LL75.
+    #
+    # From: STA T1
+    #       LDY XX17
+    #
+    # To:   STA CNT
+    #       LDY #0
+    #
+    # The original patch's hand-encoded bytes store the heap size at &30 rather
+    # than in CNT (&AA), but the modified LL78 compares LSNUM with CNT, so the
+    # heap size stored here is never read, and ships with a lot of visible
+    # edges can have their last edges cut off. We keep the original bytes so
+    # the output still matches the reference binaries, and list the intended
+    # instructions in "known", so patch_check.py reports the defect.
+
+    {
+        "name": "LL9 (Part 10) at LL75",
+        "file": "gma6",
+        "addr": 0x9FB4,
+        "asm": "STA &30 : LDY #0",
+        "from": "STA T1 : LDY XX17",
+        "expect": [0x85, 0x06, 0xA4, 0x9F],
+        "known": "STA CNT : LDY #0",
+    },
+
+    # LL9 (Part 10)
+    #
+    # This is the second INY after LL75.
+    #
+    # From: INY
+    #
+    # To:   NOP
+
+    {
+        "name": "LL9 (Part 10) after LL75",
+        "file": "gma6",
+        "addr": 0x9FC1,
+        "nops": 1,
+        "from": "INY",
+        "expect": [0xC8],
+    },
+
+    # LL9 (Part 10)
+    #
+    # These are the three modifications at LL79.
+    #
+    # From: LDA (V),Y
+    #       TAX
+    #       INY
+    #       LDA (V),Y
+    #       STA Q
+    #       ... four lots of unchanged LDA/STA, 5 bytes each ...
+    #       LDX Q
+    #
+    # To:   INY
+    #       LDA (V),Y
+    #       TAX
+    #       ... shuffle the LDA/STA block down by 4 bytes ...
+    #       INY
+    #       LDA (V),Y
+    #       TAX
+    #       NOP
+    #       NOP
+
+    {
+        "name": "LL9 (Part 10) at LL79",
+        "file": "gma6",
+        "addr": 0x9FD9,
+        "asm": "INY : LDA (V),Y : TAX",
+        "from": "LDA (V),Y : TAX : INY",
+        "expect": [0xB1, 0x5B, 0xAA, 0xC8],
+    },
+
+    {
+        "name": "LL9 (Part 10) LDA/STA block",
+        "file": "gma6",
+        "addr": 0x9FDD,
+        "copy_from": 0x9FE1,
+        "length": 4 * 5,
+        "from": "LDA (V),Y : STA Q : "
+                "LDA XX3+1,X : STA XX15+1 : LDA XX3,X : STA XX15 : "
+                "LDA XX3+2,X : STA XX15+2 : LDA XX3+3,X : STA XX15+3 : "
+                "LDX Q",
+    },
+
+    {
+        "name": "LL9 (Part 10) at LDX Q",
+        "file": "gma6",
+        "addr": 0x9FF1,
+        "asm": "INY : LDA (V),Y : TAX",
+        "nops": 2,
+        "expect": [0x03, 0x01, 0x85, 0x6E, 0xA6, 0x9A],
+    },
+
+    # LL9 (Part 10)
+    #
+    # This is the modification at the end of the routine. The C64 version has
+    # an extra JMP LL80 instruction at this point that we can modify to jump to
+    # a new routine PATCH2, which lets us insert the extra JSR LLX30 without
+    # taking up any more bytes.
+    #
+    # From: JMP LL80
+    #
+    # To:   JMP PATCH2
+
+    {
+        "name": "LL9 (Part 10) at end",
+        "file": "gma6",
+        "addr": 0xA010,
+        "asm": "JMP PATCH2",
+        "from": "JMP LL80",
+        "expect": [0x4C, 0x3F, 0xA1],
+    },
+
+    # LL9 (Part 11)
+    #
+    # This is the modification at LL80.
+    #
+    # We blank out the .LL80 section with 28 NOPs
+
+    {
+        "name": "LL9 (Part 11) at LL80",
+        "file": "gma6",
+        "addr": 0xA13F,
+        "nops": 28,
+        "from": "LDY U : LDA XX15 : STA (XX19),Y : INY : "
+                "LDA XX15+1 : STA (XX19),Y : INY : "
+                "LDA XX15+2 : STA (XX19),Y : INY : "
+                "LDA XX15+3 : STA (XX19),Y : INY : STY U : "
+                "CPY T1 : BCS LL81",
+        "expect": [0xA4, 0x99, 0xA5, 0x6B, 0x91, 0x2A, 0xC8, 0xA5,
+                   0x6C, 0x91, 0x2A, 0xC8, 0xA5, 0x6D, 0x91, 0x2A,
+                   0xC8, 0xA5, 0x6E, 0x91, 0x2A, 0xC8, 0x84, 0x99,
+                   0xC4, 0x06, 0xB0, 0x17],
+    },
+
+    # LL9 (Part 11)
+    #
+    # We have already assembled the modified part 11 in BeebAsm and saved it
+    # as the binary file ll78.bin, so now we drop this over the top of the
+    # existing routine (which is exactly the same size).
+
+    {
+        "name": "LL9 (Part 11) LL78",
+        "file": "gma6",
+        "addr": 0xA15B,
+        "bin": "ll78.bin",
+        "from": "INC XX17",
+        "expect": [0xE6, 0x9F],
+    },
+
+    # LL9 (Part 12)
+    #
+    # We have already assembled the modified part 12 in BeebAsm and saved it
+    # as the binary file ll155.bin, so now we drop this over the top of the
+    # existing routine (which is slightly longer, so there is room).
+
+    {
+        "name": "LL9 (Part 12) LL155",
+        "file": "gma6",
+        "addr": 0xA178,
+        "bin": "ll155.bin",
+        "from": "LDY #0 : LDA (XX19),Y",
+        "expect": [0xA0, 0x00, 0xB1, 0x2A],
+    },
+
+    # We now append the three extra routines required by the modifications to
+    # the end of the main binary (where there is enough free space for them):
+    #
+    #   LLX30
+    #   PATCH1
+    #   PATCH2
+    #
+    # We have already assembled these in BeebAsm and saved them as the binary
+    # file extra.bin, so we simply append this file to the end (llx30 is the
+    # address just after the end of gma6).
+
+    {
+        "name": "LLX30, PATCH1, PATCH2",
+        "file": "gma6",
+        "addr": llx30,
+        "bin": "extra.bin",
+    },
+
+    # We now move on to the routines for drawing flicker-free planets
+
+    # PL9 (Part 1 of 3)
+    #
+    # We have already assembled the modified part 1 of PL9 in BeebAsm and saved
+    # it as the binary file pl9.bin, so now we drop this over the top of the
+    # existing routine (the new routine is slightly bigger, so it ends by
+    # jumping to PATCH6, which contains the spill-over).
+
+    {
+        "name": "PL9 (Part 1 of 3)",
+        "file": "gma6",
+        "addr": 0x7D8C,
+        "bin": "pl9.bin",
+        "from": "JSR WPLS2",
+        "expect": [0x20, 0xBB, 0x80],
+    },
+
+    # PL9 (Part 2 of 3)
+    #
+    # The above modification moves PL20, so we need to modify the branch
+    # instruction at the start of part 2 of PL9.
+
+    {
+        "name": "PL9 (Part 2 of 3)",
+        "file": "gma6",
+        "addr": 0x7DA8,
+        "asm": "BCC PL20",
+        "from": "BCC PL20",
+        "expect": [0x90, 0xEE],
+    },
+
+    # PL9 (Part 3 of 3)
+    #
+    # The above modification moves PL20, so we need to modify the branch
+    # instruction at the start of part 3 of PL9.
+
+    {
+        "name": "PL9 (Part 3 of 3)",
+        "file": "gma6",
+        "addr": 0x7DE2,
+        "asm": "BMI PL20",
+        "from": "BMI PL20",
+        "expect": [0x30, 0xB4],
+    },
+
+    # WPLS2
+    #
+    # We have already assembled the modified WPLS2 in BeebAsm and saved it as
+    # the binary file wpls2.bin, so now we drop this over the top of the
+    # existing routine (which is quite a bit longer, so there is room).
+
+    {
+        "name": "WPLS2",
+        "file": "gma6",
+        "addr": 0x80BB,
+        "bin": "wpls2.bin",
+        "from": "LDY LSP",
+        "expect": [0xAC, 0xA4, 0x26],
+    },
+
+    # PLS22
+    #
+    # This is the modification on either side of PL40, with the label moving
+    # two bytes backwards to accommodate the modified code.
+    #
+    # From: BCS PL40
+    #       ...
+    #       STA CNT2
+    #       JMP PLL4
+    #      .PL40
+    #       RTS
+    #
+    # To:   BCS PL40
+    #       ...
+    #       JMP PATCH4
+    #      .PL40
+    #       JMP EraseRestOfPlanet
+
+    {
+        "name": "PLS22 branch to PL40",
+        "file": "gma6",
+        "addr": 0x7F04,
+        "asm": "BCS PL40",
+        "from": "BCS PL40",
+        "expect": [0xB0, 0x0C],
+    },
+
+    {
+        "name": "PLS22 at PL40",
+        "file": "gma6",
+        "addr": 0x7F0D,
+        "asm": "JMP PATCH4 : JMP EraseRestOfPlanet",
+        "from": "STA CNT2 : JMP PLL4 : RTS",
+        "expect": [0x85, 0xAB, 0x4C, 0x5F, 0x7E, 0x60],
+    },
+
+    # CIRCLE2
+    #
+    # This is the modification at the start of the routine.
+    #
+    # From: LDX #&FF
+    #       STX FLAG
+    #
+    # To:   JSR PATCH5
+    #       NOP
+
+    {
+        "name": "CIRCLE2",
+        "file": "gma6",
+        "addr": 0x805E,
+        "asm": "JSR PATCH5",
+        "nops": 1,
+        "from": "LDX #&FF : STX FLAG",
+        "expect": [0xA2, 0xFF, 0x86, 0xA9],
+    },
+
+    # BLINE
+    #
+    # We have already assembled the modified BLINE in BeebAsm and saved it as
+    # the binary file bline.bin, so now we drop this over the top of the
+    # existing routine in gma5 (the new routine is slightly bigger, so it ends
+    # by jumping to PATCH3, which contains the spill-over).
+
+    {
+        "name": "BLINE",
+        "file": "gma5",
+        "addr": 0x2977,
+        "bin": "bline.bin",
+        "from": "TXA : ADC K4",
+        "expect": [0x8A, 0x65, 0x43],
+    },
+
+    # We now insert the four extra routines required by the modifications into
+    # the unused space in gma4 just after the sprites:
+    #
+    #   PATCH3
+    #   PATCH4
+    #   PATCH5
+    #   PATCH6
+    #
+    # We have already assembled these in BeebAsm and saved them as the binary
+    # file extra2.bin, so we simply insert this file at the correct address.
+    # The contents of the GMA4 file is moved after decryption, so although the
+    # routines end up at $69C0, they actually get loaded and decrypted at
+    # $7C3A, so that's the address we use when inserting the code into the
+    # gma4 file.
+
+    {
+        "name": "PATCH3, PATCH4, PATCH5, PATCH6",
+        "file": "gma4",
+        "addr": 0x7C3A,
+        "bin": "extra2.bin",
+    },
+
+    # Finally, we need to remove the disk protection from gma1, as described
+    # here: https://www.lemon64.com/forum/viewtopic.php?t=67762&start=90
+    #
+    # For elite[firebird_1986](pal)(v040486).g64:
+    #
+    # From: JSR &C800
+    #       ...
+    #       BEQ
+    #
+    # To:   NOP x3
+    #       ...
+    #       BNE
+
+    {
+        "name": "Disk protection (PAL)",
+        "file": "gma1",
+        "addr": 0x0357,
+        "nops": 3,
+        "from": "JSR &C800",
+        "expect": [0x20, 0x00, 0xC8],
+        "platform": "pal",
+    },
+
+    {
+        "name": "Disk protection branch (PAL)",
+        "file": "gma1",
+        "addr": 0x035E,
+        "bytes": [0xD0],
+        "from": "BEQ P%+5",
+        "expect": [0xF0],
+        "platform": "pal",
+    },
+
+    # For elite[firebird_1986](ntsc)(v060186)(!).g64:
+    #
+    # From: JSR &C800
+    #
+    # To:   NOP x3
+
+    {
+        "name": "Disk protection (NTSC)",
+        "file": "gma1",
+        "addr": 0x0346,
+        "nops": 3,
+        "from": "JSR &C800",
+        "expect": [0x20, 0x00, 0xC8],
+        "platform": "ntsc",
+    },
+
+]
+
+# The Plus/4 version runs at a different address to the Commodore 64 version,
+# so most of the following patches are at addresses that are $0900 higher
+# (for the ship code) or $08F0 higher (for the planet code) than their
+# Commodore 64 counterparts
+
+# Set the addresses for the extra routines (LLX30, PATCH1, PATCH2) that we will
+# load into unused portions of the main game code
+
+plus4_llx30 = 0x7200
+plus4_patch1 = 0x723E
+plus4_patch2 = 0x7255
+
+# Set the addresses for the extra routines (EraseRestOfPlanet, PATCH4, PATCH5)
+# that we insert into the sprite area and the Trumble sprite-drawing routine
+
+plus4_erasep = 0x89BC
+plus4_patch4 = 0x1EA0
+plus4_patch5 = 0x1EA5
+
+# The labels that the assembly language in the patches refers to
+
+PLUS4_SYMBOLS = dict(VARIABLES, **{
+    "LLX30": plus4_llx30,
+    "PATCH1": plus4_patch1,
+    "PATCH2": plus4_patch2,
+    "EraseRestOfPlanet": plus4_erasep,
+    "PATCH4": plus4_patch4,
+    "PATCH5": plus4_patch5,
+    "PL20": 0x7D95 + 0x8F0,
+    "PL40": 0x7F10 + 0x8F0,
+})
+
+PLUS4_PATCHES = [
+
+    # SHPPT (see C64_PATCHES for details of each of the ship patches)
+
+    {
+        "name": "SHPPT",
+        "file": "elite_+4_unpacked.prg",
+        "addr": 0x9932 + 0x900,
+        "bin": "shppt-plus4.bin",
+        "from": "JSR PROJ",
+        "expect": [0x20, 0xD8, 0xA3],
+    },
+
+    # LL9 (Part 1)
+
+    {
+        "name": "LL9 (Part 1)",
+        "file": "elite_+4_unpacked.prg",
+        "addr": 0x9A8A + 0x900,
+        "asm": "JSR PATCH1",
+        "nops": 1,
+        "from": "LDA #31 : STA XX4",
+        "expect": [0xA9, 0x1F, 0x85, 0xAD],
+    },
+
+    # LL9 (Part 9)
+
+    {
+        "name": "LL9 (Part 9) at EE31",
+        "file": "elite_+4_unpacked.prg",
+        "addr": 0x9F2A + 0x900,
+        "asm": "LDY #9 : LDA (XX0),Y : STA XX20",
+        "nops": 3,
+        "from": "LDA #%00001000 : BIT XX1+31 : BEQ LL74 : "
+                "JSR LL155",
+        "expect": [0xA9, 0x08, 0x24, 0x28, 0xF0, 0x05, 0x20, 0x78, 0xAA],
+    },
+
+    {
+        "name": "LL9 (Part 9) at LL74",
+        "file": "elite_+4_unpacked.prg",
+        "addr": 0x9F39 + 0x900,
+        "asm": "LDY #0 : STY XX17",
+        "nops": 10,
+        "from": "LDY #9 : LDA (XX0),Y : STA XX20 : LDY #0 : "
+                "STY U : STY XX17 : INC U",
+        "expect": [0xA0, 0x09, 0xB1, 0x57, 0x85, 0xAE, 0xA0, 0x00,
+                   0x84, 0x99, 0x84, 0x9F, 0xE6, 0x99],
+    },
+
+    {
+        "name": "LL9 (Part 9) at end",
+        "file": "elite_+4_unpacked.prg",
+        "addr": 0x9F87 + 0x900,
+        "asm": "JSR LLX30",
+        "nops": 21,
+        "from": "LDY U : LDA XX15 : STA (XX19),Y : INY : "
+                "LDA XX15+1 : STA (XX19),Y : INY : "
+                "LDA XX15+2 : STA (XX19),Y : INY : "
+                "LDA XX15+3 : STA (XX19),Y : INY : STY U",
+        "expect": [0xA4, 0x99, 0xA5, 0x6B, 0x91, 0x2A, 0xC8, 0xA5,
+                   0x6C, 0x91, 0x2A, 0xC8, 0xA5, 0x6D, 0x91, 0x2A,
+                   0xC8, 0xA5, 0x6E, 0x91, 0x2A, 0xC8, 0x84, 0x99],
+    },
+
+    # LL9 (Part 10)
+
+    {
+        "name": "LL9 (Part 10) at LL75",
+        "file": "elite_+4_unpacked.prg",
+        "addr": 0x9FB4 + 0x900,
+        "asm": "STA &30 : LDY #0",
+        "from": "STA T1 : LDY XX17",
+        "expect": [0x85, 0x06, 0xA4, 0x9F],
+        "known": "STA CNT : LDY #0",
+    },
+
+    {
+        "name": "LL9 (Part 10) after LL75",
+        "file": "elite_+4_unpacked.prg",
+        "addr": 0x9FC1 + 0x900,
+        "nops": 1,
+        "from": "INY",
+        "expect": [0xC8],
+    },
+
+    {
+        "name": "LL9 (Part 10) at LL79",
+        "file": "elite_+4_unpacked.prg",
+        "addr": 0x9FD9 + 0x900,
+        "asm": "INY : LDA (V),Y : TAX",
+        "from": "LDA (V),Y : TAX : INY",
+        "expect": [0xB1, 0x5B, 0xAA, 0xC8],
+    },
+
+    {
+        "name": "LL9 (Part 10) LDA/STA block",
+        "file": "elite_+4_unpacked.prg",
+        "addr": 0x9FDD + 0x900,
+        "copy_from": 0x9FE1 + 0x900,
+        "length": 4 * 5,
+        "from": "LDA (V),Y : STA Q : "
+                "LDA XX3+1,X : STA XX15+1 : LDA XX3,X : STA XX15 : "
+                "LDA XX3+2,X : STA XX15+2 : LDA XX3+3,X : STA XX15+3 : "
+                "LDX Q",
+    },
+
+    {
+        "name": "LL9 (Part 10) at LDX Q",
+        "file": "elite_+4_unpacked.prg",
+        "addr": 0x9FF1 + 0x900,
+        "asm": "INY : LDA (V),Y : TAX",
+        "nops": 2,
+        "expect": [0x03, 0x01, 0x85, 0x6E, 0xA6, 0x9A],
+    },
+
+    {
+        "name": "LL9 (Part 10) at end",
+        "file": "elite_+4_unpacked.prg",
+        "addr": 0xA010 + 0x900,
+        "asm": "JMP PATCH2",
+        "from": "JMP LL80",
+        "expect": [0x4C, 0x3F, 0xAA],
+    },
+
+    # LL9 (Part 11)
+
+    {
+        "name": "LL9 (Part 11) at LL80",
+        "file": "elite_+4_unpacked.prg",
+        "addr": 0xA13F + 0x900,
+        "nops": 28,
+        "from": "LDY U : LDA XX15 : STA (XX19),Y : INY : "
+                "LDA XX15+1 : STA (XX19),Y : INY : "
+                "LDA XX15+2 : STA (XX19),Y : INY : "
+                "LDA XX15+3 : STA (XX19),Y : INY : STY U : "
+                "CPY T1 : BCS LL81",
+        "expect": [0xA4, 0x99, 0xA5, 0x6B, 0x91, 0x2A, 0xC8, 0xA5,
+                   0x6C, 0x91, 0x2A, 0xC8, 0xA5, 0x6D, 0x91, 0x2A,
+                   0xC8, 0xA5, 0x6E, 0x91, 0x2A, 0xC8, 0x84, 0x99,
+                   0xC4, 0x06, 0xB0, 0x17],
+    },
+
+    {
+        "name": "LL9 (Part 11) LL78",
+        "file": "elite_+4_unpacked.prg",
+        "addr": 0xA15B + 0x900,
+        "bin": "ll78-plus4.bin",
+        "from": "INC XX17",
+        "expect": [0xE6, 0x9F],
+    },
+
+    # LL9 (Part 12)
+
+    {
+        "name": "LL9 (Part 12) LL155",
+        "file": "elite_+4_unpacked.prg",
+        "addr": 0xA178 + 0x900,
+        "bin": "ll155-plus4.bin",
+        "from": "LDY #0 : LDA (XX19),Y",
+        "expect": [0xA0, 0x00, 0xB1, 0x2A],
+    },
+
+    # We now load the extra routines required by the modifications into the
+    # memory used by the explosion and Trumble sprites, which are not used in
+    # the Plus/4 version:
+    #
+    #   LLX30
+    #   PATCH1
+    #   PATCH2
+    #   DrawPlanetLine
+
+    {
+        "name": "LLX30, PATCH1, PATCH2, DrawPlanetLine",
+        "file": "elite_+4_unpacked.prg",
+        "addr": plus4_llx30,
+        "bin": "extra-plus4.bin",
+    },
+
+    # We now move on to the routines for drawing flicker-free planets
+
+    # PL9 (Part 1 of 3)
+
+    {
+        "name": "PL9 (Part 1 of 3)",
+        "file": "elite_+4_unpacked.prg",
+        "addr": 0x7D8C + 0x8F0,
+        "bin": "pl9-plus4.bin",
+        "from": "JSR WPLS2",
+        "expect": [0x20, 0xAB, 0x89],
+    },
+
+    # PL9 (Part 2 of 3)
+
+    {
+        "name": "PL9 (Part 2 of 3)",
+        "file": "elite_+4_unpacked.prg",
+        "addr": 0x7DA8 + 0x8F0,
+        "asm": "BCC PL20",
+        "from": "BCC PL20",
+        "expect": [0x90, 0xEE],
+    },
+
+    # PL9 (Part 3 of 3)
+
+    {
+        "name": "PL9 (Part 3 of 3)",
+        "file": "elite_+4_unpacked.prg",
+        "addr": 0x7DE2 + 0x8F0,
+        "asm": "BMI PL20",
+        "from": "BMI PL20",
+        "expect": [0x30, 0xB4],
+    },
+
+    # WPLS2
+    #
+    # The Plus/4 version of wpls2.bin also contains the following routines:
+    #
+    #   EraseRestOfPlanet
+    #   PATCH3
+    #   PATCH6
+
+    {
+        "name": "WPLS2",
+        "file": "elite_+4_unpacked.prg",
+        "addr": 0x80BB + 0x8F0,
+        "bin": "wpls2-plus4.bin",
+        "from": "LDY LSP",
+        "expect": [0xAC, 0xA1, 0x26],
+    },
+
+    # PLS22
+
+    {
+        "name": "PLS22 branch to PL40",
+        "file": "elite_+4_unpacked.prg",
+        "addr": 0x7F04 + 0x8F0,
+        "asm": "BCS PL40",
+        "from": "BCS PL40",
+        "expect": [0xB0, 0x0C],
+    },
+
+    {
+        "name": "PLS22 at PL40",
+        "file": "elite_+4_unpacked.prg",
+        "addr": 0x7F0D + 0x8F0,
+        "asm": "JMP PATCH4 : JMP EraseRestOfPlanet",
+        "from": "STA CNT2 : JMP PLL4 : RTS",
+        "expect": [0x85, 0xAB, 0x4C, 0x4F, 0x87, 0x60],
+    },
+
+    # CIRCLE2
+
+    {
+        "name": "CIRCLE2",
+        "file": "elite_+4_unpacked.prg",
+        "addr": 0x805E + 0x8F0,
+        "asm": "JSR PATCH5",
+        "nops": 1,
+        "from": "LDX #&FF : STX FLAG",
+        "expect": [0xA2, 0xFF, 0x86, 0xA9],
+    },
+
+    # BLINE
+
+    {
+        "name": "BLINE",
+        "file": "elite_+4_unpacked.prg",
+        "addr": 0x2974,
+        "bin": "bline-plus4.bin",
+        "from": "TXA : ADC K4",
+        "expect": [0x8A, 0x65, 0x43],
+    },
+
+    # We now load the extra routines required by the modifications into the
+    # memory used by the Trumble sprite-drawing routine, which contains a whole
+    # raft of NOPs in the Plus/4 version. We can therefore slip the following
+    # routines into this set of NOPs, adding a JMP beforehand to skip over the
+    # patches:
+    #
+    #   DrawNewPlanetLine
+    #   PATCH4
+    #   PATCH5
+
+    {
+        "name": "DrawNewPlanetLine, PATCH4, PATCH5",
+        "file": "elite_+4_unpacked.prg",
+        "addr": 0x1E6A,
+        "bin": "trumble-plus4.bin",
+        "from": "NOP : NOP : NOP",
+        "expect": [0xEA, 0xEA, 0xEA],
+    },
+
+]
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+#
+# ******************************************************************************
+#
+# ELITE RELEASE FINGERPRINTS
+#
+# Written by Mark Moxon
+#
+# This module identifies which release of Elite a set of game files comes
+# from, by hashing the parts of the game that differ between releases, so we
+# know whether the flicker-free patch supports it, and which platform to patch
+# it for.
+#
+# The Commodore 64 releases are identified from the gma1 loader (which
+# differs between PAL and NTSC) and the decrypted gma6 file (which contains
+# the main game code, and is the same in both of the supported releases). The
+# Plus/4 release is identified from the whole unpacked game binary.
+#
+# ******************************************************************************
+
+from __future__ import print_function
+import hashlib
+import d64
+import elite_patcher
+import g64
+import gma_codec
+
+
+# The supported releases, each of which is a dictionary with the name of the
+# release, the platform to patch it for, and the SHA-256 hashes of the files
+# that identify it
+
+RELEASES = [
+    {
+        "name": "Firebird v040486 (PAL)",
+        "platform": "pal",
+        "hashes": {
+            "gma1": "061445a8d973d0d9a540a3fc167b4c2b"
+                    "39fc4079ad224db3ff49ee87adaf72de",
+            "gma6.decrypted": "d62e7be84c9641a5236db60512928d4c"
+                              "91f94c954a76ed96e936f03d8fb0d703",
+        },
+    },
+    {
+        "name": "Firebird v060186 (NTSC)",
+        "platform": "ntsc",
+        "hashes": {
+            "gma1": "158244d15e57b867f8fee551fed9da44"
+                    "e6c21af5dffffcde0de76f590f2373e4",
+            "gma6.decrypted": "d62e7be84c9641a5236db60512928d4c"
+                              "91f94c954a76ed96e936f03d8fb0d703",
+        },
+    },
+    {
+        "name": "Pigmy Plus/4 (unpacked)",
+        "platform": "plus4",
+        "hashes": {
+            elite_patcher.PLUS4_FILE: "9bb3ea254f9045fe6be1759bf3428eaf"
+                                      "891e33d11a79bc3b639047b861d6f162",
+        },
+    },
+]
+
+# The file extensions of the disk images and binaries that we can identify
+
+DISK_EXTENSIONS = (".d64", ".g64")
+PRG_EXTENSIONS = (".prg",)
+
+
+# Return a dictionary of the SHA-256 hashes of the identifying files in a set
+# of game files, keyed by the names used in RELEASES
+
+def fingerprint(files):
+    hashes = {}
+
+    for filename in ("gma1", elite_patcher.PLUS4_FILE):
+        if filename in files:
+            hashes[filename] = hashlib.sha256(files[filename]).hexdigest()
+
+    if "gma6" in files:
+        data_block = gma_codec.decrypt_file("gma6", files["gma6"])
+        hashes["gma6.decrypted"] = hashlib.sha256(data_block).hexdigest()
+
+    return hashes
+
+
+# Return the release that a set of game files comes from, or None if it isn't
+# one of the supported releases
+
+def identify(files):
+    hashes = fingerprint(files)
+
+    for release in RELEASES:
+        if all(hashes.get(filename) == value
+               for filename, value in release["hashes"].items()):
+            return release
+
+    return None
+
+
+# Load the game files from a disk image or PRG file, returning a dictionary of
+# files keyed by filename (a PRG file is loaded as the unpacked Plus/4 game,
+# as that's the only PRG release we support)
+
+def load_game_files(path):
+    extension = path.lower()[-4:]
+
+    if extension in DISK_EXTENSIONS:
+        if extension == ".g64":
+            image = g64.load_g64(path)
+        else:
+            image = d64.load_d64(path)
+        return image.read_all_files()
+
+    with open(path, "rb") as f:
+        return {elite_patcher.PLUS4_FILE: f.read()}
@@ -0,0 +1,375 @@
+#!/usr/bin/env python
+#
+# ******************************************************************************
+#
+# ELITE FLICKER-FREE PATCH SIGNATURES
+#
+# Written by Mark Moxon
+#
+# This file contains a signature for each of the routines that the flicker-free
+# patch modifies, so the patch sites can be found in other releases of Elite
+# by scanning a decrypted game binary (see signature_scan.py). Each signature
+# is a dictionary with the following keys:
+#
+#   * name      The name of the patch in elite_patches.py
+#
+#   * file      The file that contains the routine in the Commodore 64 release
+#
+#   * pattern   The bytes of the original instructions at the patch site, as
+#               hex, with ?? as a wildcard that matches any byte
+#
+#   * offset    The offset of the patch site from the start of the pattern, if
+#               the pattern starts before the patch site (defaults to 0)
+#
+# The patterns are the "From:" instructions from the patch manifests, extended
+# with the instructions that follow until they only match once. The operands
+# of absolute addresses (such as JSR and JMP targets, and the tables in the
+# game code) are wildcarded, as these move between releases, while zero page
+# addresses, immediate values and branch offsets are kept, as they are the
+# same across the releases we know about. The instructions are shown in the
+# comments, with ???? for the wildcarded addresses.
+#
+# Each signature matches exactly once in the Commodore 64 PAL and NTSC game
+# files, and at the addresses in the Plus/4 manifest in the Plus/4 version.
+#
+# ******************************************************************************
+
+SIGNATURES = [
+
+    # SHPPT
+    #
+    # From: JSR ????
+    #       JSR ????
+    #       ORA &36
+    #       BNE +&21
+    #       LDA &43
+
+    {
+        "name": "SHPPT",
+        "file": "gma6",
+        "pattern": "20 ?? ?? 20 ?? ?? 05 36 D0 21 A5 43",
+    },
+
+    # LL9 (Part 1)
+    #
+    # From: LDA #&1F
+    #       STA &AD
+    #       LDA &2D
+    #       BMI +&46
+    #       LDA #&20
+    #       BIT &28
+
+    {
+        "name": "LL9 (Part 1)",
+        "file": "gma6",
+        "pattern": "A9 1F 85 AD A5 2D 30 46 A9 20 24 28",
+    },
+
+    # LL9 (Part 9) at EE31
+    #
+    # From: LDA #&08
+    #       BIT &28
+    #       BEQ +&05
+    #       JSR ????
+    #       LDA #&08
+    #       ORA &28
+
+    {
+        "name": "LL9 (Part 9) at EE31",
+        "file": "gma6",
+        "pattern": "A9 08 24 28 F0 05 20 ?? ?? A9 08 05 28",
+    },
+
+    # LL9 (Part 9) at LL74
+    #
+    # From: LDY #&09
+    #       LDA (&57),Y
+    #       STA &AE
+    #       LDY #&00
+    #       STY &99
+    #       STY &9F
+
+    {
+        "name": "LL9 (Part 9) at LL74",
+        "file": "gma6",
+        "pattern": "A0 09 B1 57 85 AE A0 00 84 99 84 9F",
+    },
+
+    # LL9 (Part 9) at end
+    #
+    # From: LDY &99
+    #       LDA &6B
+    #       STA (&2A),Y
+    #       INY
+    #       LDA &6C
+    #       STA (&2A),Y
+    #       INY
+    #       LDA &6D
+    #       STA (&2A),Y
+    #       INY
+    #       LDA &6E
+    #       STA (&2A),Y
+    #       INY
+    #       STY &99
+    #       LDY #&03
+
+    {
+        "name": "LL9 (Part 9) at end",
+        "file": "gma6",
+        "pattern": "A4 99 A5 6B 91 2A C8 A5 6C 91 2A C8 A5 6D 91 2A "
+                   "C8 A5 6E 91 2A C8 84 99 A0 03",
+    },
+
+    # LL9 (Part 10) at LL75
+    #
+    # From: STA &06
+    #       LDY &9F
+    #       LDA (&5B),Y
+    #       CMP &AD
+    #       BCC +&18
+    #       INY
+    #       LDA (&5B),Y
+
+    {
+        "name": "LL9 (Part 10) at LL75",
+        "file": "gma6",
+        "pattern": "85 06 A4 9F B1 5B C5 AD 90 18 C8 B1 5B",
+    },
+
+    # LL9 (Part 10) after LL75
+    #
+    # From: INY
+    #       STA &2E
+    #       AND #&0F
+    #       TAX
+    #       LDA &35,X
+    #       BNE +&0E
+    #       LDA &2E
+
+    {
+        "name": "LL9 (Part 10) after LL75",
+        "file": "gma6",
+        "pattern": "C8 85 2E 29 0F AA B5 35 D0 0E A5 2E",
+    },
+
+    # LL9 (Part 10) at LL79
+    #
+    # From: LDA (&5B),Y
+    #       TAX
+    #       INY
+    #       LDA (&5B),Y
+    #       STA &9A
+    #       LDA ????,X
+    #       STA &6C
+
+    {
+        "name": "LL9 (Part 10) at LL79",
+        "file": "gma6",
+        "pattern": "B1 5B AA C8 B1 5B 85 9A BD ?? ?? 85 6C",
+    },
+
+    # LL9 (Part 10) at LDX Q
+    #
+    # From: LDA ????,X
+    #       STA &6E
+    #       LDX &9A
+    #       LDA ????,X
+    #       STA &6F
+
+    {
+        "name": "LL9 (Part 10) at LDX Q",
+        "file": "gma6",
+        "pattern": "BD ?? ?? 85 6E A6 9A BD ?? ?? 85 6F",
+        "offset": 1,
+    },
+
+    # LL9 (Part 10) at end
+    #
+    # From: JMP ????
+    #       LDA #&00
+    #       STA ????
+    #       LDA &70
+    #       BIT &B7
+
+    {
+        "name": "LL9 (Part 10) at end",
+        "file": "gma6",
+        "pattern": "4C ?? ?? A9 00 8D ?? ?? A5 70 24 B7",
+    },
+
+    # LL9 (Part 11) at LL80
+    #
+    # From: LDY &99
+    #       LDA &6B
+    #       STA (&2A),Y
+    #       INY
+    #       LDA &6C
+    #       STA (&2A),Y
+    #       INY
+    #       LDA &6D
+    #       STA (&2A),Y
+    #       INY
+    #       LDA &6E
+    #       STA (&2A),Y
+    #       INY
+    #       STY &99
+    #       CPY &06
+
+    {
+        "name": "LL9 (Part 11) at LL80",
+        "file": "gma6",
+        "pattern": "A4 99 A5 6B 91 2A C8 A5 6C 91 2A C8 A5 6D 91 2A "
+                   "C8 A5 6E 91 2A C8 84 99 C4 06",
+    },
+
+    # LL9 (Part 11) LL78
+    #
+    # From: INC &9F
+    #       LDY &9F
+    #       CPY &AE
+    #       BCS +&0F
+    #       LDY #&00
+    #       LDA &5B
+
+    {
+        "name": "LL9 (Part 11) LL78",
+        "file": "gma6",
+        "pattern": "E6 9F A4 9F C4 AE B0 0F A0 00 A5 5B",
+    },
+
+    # LL9 (Part 12) LL155
+    #
+    # From: LDY #&00
+    #       LDA (&2A),Y
+    #       STA &AE
+    #       CMP #&04
+    #       BCC +&1C
+    #       INY
+    #       LDA (&2A),Y
+
+    {
+        "name": "LL9 (Part 12) LL155",
+        "file": "gma6",
+        "pattern": "A0 00 B1 2A 85 AE C9 04 90 1C C8 B1 2A",
+    },
+
+    # PL9 (Part 1 of 3)
+    #
+    # From: JSR ????
+    #       JSR ????
+    #       BCS +&04
+    #       LDA &78
+    #       BEQ +&01
+
+    {
+        "name": "PL9 (Part 1 of 3)",
+        "file": "gma6",
+        "pattern": "20 ?? ?? 20 ?? ?? B0 04 A5 78 F0 01",
+    },
+
+    # PL9 (Part 2 of 3)
+    #
+    # From: BCC -&12
+    #       LDA &17
+    #       EOR #&80
+    #       STA &2E
+    #       LDA &1D
+    #       JSR ????
+
+    {
+        "name": "PL9 (Part 2 of 3)",
+        "file": "gma6",
+        "pattern": "90 EE A5 17 49 80 85 2E A5 1D 20 ?? ??",
+    },
+
+    # PL9 (Part 3 of 3)
+    #
+    # From: BMI -&4C
+    #       LDX #&0F
+    #       JSR ????
+    #       CLC
+    #       ADC &35
+    #       STA &35
+
+    {
+        "name": "PL9 (Part 3 of 3)",
+        "file": "gma6",
+        "pattern": "30 B4 A2 0F 20 ?? ?? 18 65 35 85 35",
+    },
+
+    # WPLS2
+    #
+    # From: LDY ????
+    #       BNE +&35
+    #       CPY &7E
+    #       BCS +&31
+    #       LDA ????,Y
+
+    {
+        "name": "WPLS2",
+        "file": "gma6",
+        "pattern": "AC ?? ?? D0 35 C4 7E B0 31 B9 ?? ??",
+    },
+
+    # PLS22 branch to PL40
+    #
+    # From: BCS +&0C
+    #       LDA &AB
+    #       CLC
+    #       ADC &AC
+    #       AND #&3F
+    #       STA &AB
+    #       JMP ????
+
+    {
+        "name": "PLS22 branch to PL40",
+        "file": "gma6",
+        "pattern": "B0 0C A5 AB 18 65 AC 29 3F 85 AB 4C ?? ??",
+    },
+
+    # PLS22 at PL40
+    #
+    # From: STA &AB
+    #       JMP ????
+    #       RTS
+    #       JMP ????
+    #       TXA
+    #       EOR #&FF
+
+    {
+        "name": "PLS22 at PL40",
+        "file": "gma6",
+        "pattern": "85 AB 4C ?? ?? 60 4C ?? ?? 8A 49 FF",
+    },
+
+    # CIRCLE2
+    #
+    # From: LDX #&FF
+    #       STX &A9
+    #       INX
+    #       STX &AA
+    #       LDA &AA
+    #       JSR ????
+
+    {
+        "name": "CIRCLE2",
+        "file": "gma6",
+        "pattern": "A2 FF 86 A9 E8 86 AA A5 AA 20 ?? ??",
+    },
+
+    # BLINE
+    #
+    # From: TXA
+    #       ADC &43
+    #       STA &8B
+    #       LDA &44
+    #       ADC &BB
+    #       STA &8C
+    #       LDA &A9
+
+    {
+        "name": "BLINE",
+        "file": "gma5",
+        "pattern": "8A 65 43 85 8B A5 44 65 BB 85 8C A5 A9",
+    },
+]
@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+#
+# ******************************************************************************
+#
+# G64 DISK IMAGE READER
+#
+# Written by Mark Moxon
+#
+# This script reads files from a G64 disk image, which is a dump of the raw GCR
+# bit stream on each track of a Commodore 1541 disk, as used by the original
+# disk images from the Commodore 64 Preservation Project.
+#
+# A G64 image starts with the signature "GCR-1541", a version byte, the number
+# of half-tracks and the maximum track size, followed by a table of offsets to
+# the data for each half-track. The data for each track is a two-byte length
+# followed by the raw bytes on the track.
+#
+# Each track contains a sequence of blocks, each of which is preceded by a sync
+# mark of ten or more 1 bits. A header block contains the following, once it
+# has been GCR-decoded:
+#
+#   0x08, checksum, sector, track, ID2, ID1, 0x0F, 0x0F
+#
+# and the data block that follows it contains:
+#
+#   0x07, 256 bytes of data, checksum, 0x00, 0x00
+#
+# GCR encoding stores each 4-bit nibble as a 5-bit code, so every 5 bytes on
+# the disk decode to 4 bytes of data. Rather than decoding bit by bit, we split
+# each GCR block into four streams of bytes (one for each decoded byte in a
+# 5-byte group), look up each decoded byte from a 10-bit index in a
+# precomputed table, and interleave the four streams again. All of this is
+# done with slices, map and table lookups, so it runs at C speed over whole
+# blocks at once.
+#
+# Sync marks are found with a bulk regular expression search for runs of 0xFF
+# bytes, and blocks that don't start on a byte boundary are realigned by
+# shifting the block as a single integer.
+#
+# The decoded sectors are fed into the directory and file-chain walkers from
+# d64.py, so files can be read in exactly the same way as from a D64 image.
+#
+# Run this script with "python g64.py <image> [<folder>]" to list the files in
+# a G64 image, or to extract them all into a folder.
+#
+# ******************************************************************************
+
+from __future__ import print_function
+from functools import reduce
+from operator import add, xor
+import os
+import re
+import struct
+import sys
+import d64
+
+
+# The exception raised when a G64 image cannot be read
+
+class G64Error(Exception):
+    pass
+
+
+# The signature at the start of a G64 image
+
+SIGNATURE = b"GCR-1541"
+
+# The GCR code for each 4-bit nibble
+
+GCR_CODES = [
+    0x0A, 0x0B, 0x12, 0x13, 0x0E, 0x0F, 0x16, 0x17,
+    0x09, 0x19, 0x1A, 0x1B, 0x0D, 0x1D, 0x1E, 0x15,
+]
+
+# The nibble for each 5-bit GCR code, or None for invalid codes
+
+GCR_NIBBLES = [None] * 32
+
+for nibble, code in enumerate(GCR_CODES):
+    GCR_NIBBLES[code] = nibble
+
+# The decoded byte for each 10-bit pair of GCR codes, or -1 for invalid pairs
+
+GCR_DECODE = []
+
+for index in range(1024):
+    high = GCR_NIBBLES[index >> 5]
+    low = GCR_NIBBLES[index & 0x1F]
+    GCR_DECODE.append(-1 if high is None or low is None else high << 4 | low)
+
+# Lookup tables that split each byte of a 5-byte GCR group into the parts of
+# the 10-bit indexes for the four decoded bytes, so decoded byte n is
+# GCR_DECODE[SPLIT[n][0][byte n] + SPLIT[n][1][byte n + 1]]
+
+SPLIT = [
+    ([b << 2 for b in range(256)], [b >> 6 for b in range(256)]),
+    ([(b & 0x3F) << 4 for b in range(256)], [b >> 4 for b in range(256)]),
+    ([(b & 0x0F) << 6 for b in range(256)], [b >> 2 for b in range(256)]),
+    ([(b & 0x03) << 8 for b in range(256)], list(range(256))),
+]
+
+# The number of GCR bytes in a header block and a data block
+
+HEADER_GCR_SIZE = 10
+DATA_GCR_SIZE = 325
+
+# A sync mark is a run of 0xFF bytes (the bits either side are checked below)
+
+SYNC = re.compile(b"\xFF+")
+
+
+# Decode a block of GCR bytes (whose length is a multiple of 5) into data,
+# returning the first count bytes of the result, or None if any of those bytes
+# contain invalid GCR codes (we only check the bytes we need, as the two spare
+# bytes at the end of a data block are not always valid GCR)
+
+def gcr_decode(block, count):
+    decoded = [0] * (len(block) // 5 * 4)
+
+    for n in range(4):
+        high, low = SPLIT[n]
+        decoded[n::4] = map(GCR_DECODE.__getitem__, map(
+            add,
+            map(high.__getitem__, block[n::5]),
+            map(low.__getitem__, block[n + 1::5])
+        ))
+
+    del decoded[count:]
+
+    if -1 in decoded:
+        return None
+
+    return bytes(decoded)
+
+
+# Return the number of leading 1 bits in a byte
+
+def leading_ones(byte):
+    count = 0
+
+    while count < 8 and byte & (0x80 >> count):
+        count += 1
+
+    return count
+
+
+# Return the number of trailing 1 bits in a byte
+
+def trailing_ones(byte):
+    count = 0
+
+    while count < 8 and byte & (1 << count):
+        count += 1
+
+    return count
+
+
+# Return a list of the blocks on a track, each of which is a bytes object
+# containing the GCR data after a sync mark, realigned to a byte boundary and
+# long enough to hold a data block
+
+def find_blocks(track_data):
+    size = len(track_data)
+
+    # Tracks are circular, so add the start of the track to the end, so blocks
+    # that wrap around can be read in one go
+
+    wrapped = track_data + track_data[:DATA_GCR_SIZE + 2]
+    blocks = []
+
+    for match in SYNC.finditer(wrapped, 0, size + 1):
+        start, end = match.span()
+
+        if end >= len(wrapped):
+            continue
+
+        # Count the 1 bits in the sync mark, including the ends of the bytes
+        # either side of the run of 0xFF bytes
+
+        shift = leading_ones(wrapped[end])
+        ones = 8 * (end - start) + shift
+
+        if start > 0:
+            ones += trailing_ones(wrapped[start - 1])
+
+        if ones < 10:
+            continue
+
+        # Extract the block, shifting it to line it up with a byte boundary if
+        # it doesn't start on one
+
+        block = wrapped[end:end + DATA_GCR_SIZE + 1]
+
+        if shift:
+            value = int.from_bytes(block, "big") << shift
+            block = (value & ((1 << (8 * len(block))) - 1)).to_bytes(
+                len(block), "big"
+            )
+
+        blocks.append(block[:DATA_GCR_SIZE])
+
+    return blocks
+
+
+# Decode all of the sectors on a track (skipping any that have bad checksums or
+# can't be decoded), returning a dictionary of sector data, keyed by (track,
+# sector) as given in each sector header
+
+def decode_track(track_data):
+    sectors = {}
+    header = None
+
+    for block in find_blocks(track_data):
+        decoded = gcr_decode(block[:HEADER_GCR_SIZE], 6)
+
+        if decoded is not None and decoded[0] == 0x08:
+            if reduce(xor, decoded[1:6]) == 0:
+                header = decoded
+            else:
+                header = None
+            continue
+
+        if header is None:
+            continue
+
+        key = (header[3], header[2])
+        header = None
+
+        if key in sectors or len(block) < DATA_GCR_SIZE:
+            continue
+
+        decoded = gcr_decode(block[:DATA_GCR_SIZE], 258)
+
+        if decoded is None or decoded[0] != 0x07:
+            continue
+
+        if reduce(xor, decoded[1:258]) != 0:
+            continue
+
+        sectors[key] = decoded[1:257]
+
+    return sectors
+
+
+# A G64 disk image held in memory, which is decoded one track at a time when
+# the track is first read
+
+class G64Image(object):
+
+    def __init__(self, data):
+        data = bytes(data)
+
+        if data[:8] != SIGNATURE:
+            raise G64Error("Not a G64 image")
+
+        self.data = data
+        self.half_tracks = data[9]
+        self.offsets = struct.unpack_from("<{}I".format(self.half_tracks),
+                                          data, 12)
+        self.sectors = {}
+        self.decoded = set()
+
+    # Return the raw GCR data for a track
+
+    def track_data(self, track):
+        half_track = (track - 1) * 2
+
+        if half_track >= self.half_tracks or not self.offsets[half_track]:
+            return b""
+
+        offset = self.offsets[half_track]
+        size = struct.unpack_from("<H", self.data, offset)[0]
+        return self.data[offset + 2:offset + 2 + size]
+
+    # Decode a track, if we haven't already done so
+
+    def decode(self, track):
+        if track not in self.decoded:
+            self.decoded.add(track)
+            self.sectors.update(decode_track(self.track_data(track)))
+
+    # Return the contents of a sector
+
+    def sector(self, track, sector):
+        self.decode(track)
+
+        if (track, sector) not in self.sectors:
+            raise G64Error("Cannot read track and sector {}/{}".format(
+                track, sector
+            ))
+
+        return self.sectors[(track, sector)]
+
+    def directory(self):
+        return d64.read_directory(self.sector)
+
+    def disk_name(self):
+        return d64.read_disk_name(self.sector)
+
+    # Return the contents of the named file
+
+    def read_file(self, name):
+        for entry in self.directory():
+            if entry["name"] == name and entry["type"] != "del":
+                return d64.read_chain(self.sector, entry["track"],
+                                      entry["sector"])
+
+        raise G64Error("File not found: {}".format(name))
+
+    def read_all_files(self):
+        return d64.read_all_files(self.sector)
+
+
+# Load a G64 image from a file
+
+def load_g64(filename):
+    with open(filename, "rb") as f:
+        return G64Image(f.read())
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: g64.py <image> [<folder>]")
+        sys.exit(1)
+
+    image = load_g64(sys.argv[1])
+
+    if len(sys.argv) == 2:
+        print('0 "{}"'.format(image.disk_name()))
+        for entry in image.directory():
+            print('{:<5d}"{}" {}'.format(entry["blocks"], entry["name"],
+                                         entry["type"]))
+        return
+
+    folder = sys.argv[2]
+    files = image.read_all_files()
+
+    for name in sorted(files):
+        with open(os.path.join(folder, name), "wb") as f:
+            f.write(files[name])
+
+        print("[ Extract ] {}".format(name))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+#
+# ******************************************************************************
+#
+# COMMODORE 64 ELITE GMA ENCRYPTION CODEC
+#
+# Written by Mark Moxon
+#
+# The gma4, gma5 and gma6 files in Commodore 64 Elite are scrambled with a
+# simple chained cipher. Working backwards from the end of the scrambled range,
+# each decrypted byte is the encrypted byte minus the decrypted byte after it
+# (with the seed standing in for the byte after the end of the range), so:
+#
+#   encrypted[n] = decrypted[n] + decrypted[n + 1]
+#
+# where all arithmetic is done modulo 256.
+#
+# Instead of walking through the range one byte at a time, this module works
+# on the whole range in bulk:
+#
+#   * Encryption is the scrambled range added to itself shifted by one byte
+#
+#   * Decryption is an alternating-sign suffix sum of the scrambled range, so
+#     we negate every other byte, run a cumulative sum from the end of the
+#     range, and then negate every other byte of the result
+#
+# All of the per-byte work is done by bytes.translate, map and accumulate, so
+# it runs at C speed rather than in the Python interpreter.
+#
+# As each encrypted byte only depends on two decrypted bytes, we can also
+# re-encrypt a patched file by only recalculating the bytes around each patch,
+# starting from the original encrypted file (see encrypt_ranges).
+#
+# The same suffix sum also gives us random access into an encrypted file. The
+# DecryptionIndex class makes one pass over the scrambled range to record the
+# running sum at regular checkpoints, after which we can decrypt any window of
+# the file by starting from the nearest checkpoint, without having to decrypt
+# everything after it first.
+#
+# Run this script with "python gma_codec.py <file> <from> <to>" to print a
+# decrypted window of one of the gma files, such as:
+#
+#   python gma_codec.py gma6 0x9932 0x9970
+#
+# ******************************************************************************
+
+from __future__ import print_function
+import binascii
+from itertools import accumulate, chain, islice, repeat
+from operator import add, sub
+import sys
+
+
+# Lookup table that negates a byte modulo 256, for use with bytes.translate
+
+NEGATE = bytes((-n) % 256 for n in range(256))
+
+# Function that reduces an integer modulo 256 (it's quicker to pass the bound
+# method to map than a lambda)
+
+MOD_256 = (0xFF).__and__
+
+
+# Negate every other byte in a block, starting with the byte at offset first
+# (so by default this negates the second, fourth, sixth bytes and so on),
+# returning the result as a new bytearray
+
+def alternate_signs(block, first=1):
+    signed = bytearray(block)
+    signed[first::2] = bytes(signed[first::2]).translate(NEGATE)
+    return signed
+
+
+# Decrypt the scrambled range in data_block in-place, where scramble_from and
+# scramble_to are the offsets of the first and last scrambled bytes within the
+# block (so this is the range that the original game decrypts, backwards from
+# scramble_to to scramble_from)
+
+def decrypt(data_block, seed, scramble_from, scramble_to):
+    signed = alternate_signs(data_block[scramble_from:scramble_to + 1])
+
+    # The seed is the virtual byte just past the end of the range, so it takes
+    # the sign for that position
+
+    start = seed if len(signed) % 2 == 0 else (-seed) % 256
+
+    # Sum from the end of the range, dropping the seed from the front of the
+    # result, and then reverse it back into the correct order
+
+    suffix = bytearray(map(MOD_256, islice(
+        accumulate(chain((start,), reversed(signed))), 1, None
+    )))
+    suffix.reverse()
+
+    data_block[scramble_from:scramble_to + 1] = alternate_signs(suffix)
+
+
+# Encrypt the range in data_block in-place, using the same offsets as decrypt
+
+def encrypt(data_block, seed, scramble_from, scramble_to):
+    block = bytes(data_block[scramble_from:scramble_to + 1])
+    following = block[1:] + bytes((seed,))
+    data_block[scramble_from:scramble_to + 1] = bytes(
+        map(MOD_256, map(add, block, following))
+    )
+
+
+# Merge a list of (start, end) ranges into a sorted list of non-overlapping
+# ranges, where each range runs from start up to (but not including) end
+
+def merge_ranges(ranges):
+    merged = []
+
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+
+    return [(start, end) for start, end in merged]
+
+
+# Re-encrypt a modified block in-place, given the original encrypted version
+# of the block and a list of (start, end) ranges of offsets that have been
+# modified since it was decrypted
+#
+# Each encrypted byte depends only on the decrypted bytes at the same offset
+# and the offset after it, so a modified byte at offset n only changes the
+# encrypted bytes at n - 1 and n. We therefore start with the original
+# encrypted bytes and only recalculate the bytes in the modified ranges (plus
+# one byte before each range), which gives exactly the same result as
+# encrypting the whole block
+
+def encrypt_ranges(data_block, original, seed, scramble_from, scramble_to,
+                   ranges):
+    updates = []
+
+    for start, end in merge_ranges((start - 1, end) for start, end in ranges):
+        start = max(start, scramble_from)
+        end = min(end, scramble_to + 1)
+
+        if start >= end:
+            continue
+
+        if end <= scramble_to:
+            block = bytes(data_block[start:end + 1])
+        else:
+            block = bytes(data_block[start:end]) + bytes((seed,))
+
+        updates.append((start, end, bytes(
+            map(MOD_256, map(add, block[:-1], block[1:]))
+        )))
+
+    data_block[scramble_from:scramble_to + 1] = \
+        original[scramble_from:scramble_to + 1]
+
+    for start, end, encrypted in updates:
+        data_block[start:end] = encrypted
+
+
+# Configuration variables for each of the encrypted files, giving the load
+# address, the encryption seed and the range of addresses that is scrambled
+
+GMA_FILES = {
+    "gma6": {
+        "load_address": 0x6A00 - 2,
+        "seed": 0x49,
+        "scramble_from": 0x6A00,
+        "scramble_to": 0x6A00 + 0x62D6,
+    },
+    "gma5": {
+        "load_address": 0x1D00 - 2,
+        "seed": 0x36,
+        "scramble_from": 0x1D00,
+        "scramble_to": 0x1D00 + 0x21D1,
+    },
+    "gma4": {
+        "load_address": 0x4000 - 2,
+        "seed": 0x8E,
+        "scramble_from": 0x75E4,
+        "scramble_to": 0x4000 + 0x465A,
+    },
+}
+
+
+# Return the encryption seed and the offsets of the first and last scrambled
+# bytes within one of the files in GMA_FILES, as a tuple that can be passed
+# to decrypt, encrypt and encrypt_ranges after the data block
+
+def scramble_range(name):
+    config = GMA_FILES[name]
+    load_address = config["load_address"]
+    return (config["seed"],
+            config["scramble_from"] - load_address,
+            config["scramble_to"] - load_address)
+
+
+# Return a decrypted copy of one of the files in GMA_FILES, as a bytearray
+
+def decrypt_file(name, data_block):
+    data_block = bytearray(data_block)
+    decrypt(data_block, *scramble_range(name))
+    return data_block
+
+
+# An index into an encrypted block that supports decrypting any window of the
+# block in time proportional to the size of the window
+#
+# If we negate every other byte of the scrambled range to get signed[], then
+# the decrypted byte at position k is +/- (total - prefix[k]), where prefix[k]
+# is the sum of signed[] before position k, and total is the sum of the whole
+# of signed[] plus the signed seed. We store prefix[] at every stride bytes,
+# so a lookup only ever has to sum up to stride bytes before the window starts.
+
+class DecryptionIndex(object):
+
+    def __init__(self, data_block, seed, scramble_from, scramble_to,
+                 stride=256):
+        self.data_block = bytes(data_block)
+        self.scramble_from = scramble_from
+        self.scramble_to = scramble_to
+        self.stride = stride
+
+        signed = alternate_signs(
+            self.data_block[scramble_from:scramble_to + 1]
+        )
+        start = seed if len(signed) % 2 == 0 else (-seed) % 256
+
+        prefix = list(map(MOD_256, accumulate(chain((0,), signed))))
+        self.total = (prefix[-1] + start) % 256
+        self.checkpoints = prefix[::stride]
+
+    # Return the decrypted bytes from offset start up to (but not including)
+    # offset end, where the offsets are within the original data block
+
+    def window(self, start, end):
+        result = bytearray(self.data_block[start:end])
+
+        # Only the part of the window that overlaps the scrambled range needs
+        # decrypting, so work out where that is relative to the scrambled range
+
+        first = max(start, self.scramble_from) - self.scramble_from
+        last = min(end, self.scramble_to + 1) - self.scramble_from
+
+        if first >= last:
+            return result
+
+        # Fetch the prefix sum from the nearest checkpoint and add the signed
+        # bytes between there and the start of the window
+
+        checkpoint = first // self.stride * self.stride
+        scrambled = self.data_block[self.scramble_from + checkpoint:
+                                    self.scramble_from + last]
+        signed = alternate_signs(scrambled, 1 - checkpoint % 2)
+
+        prefix = accumulate(chain(
+            (self.checkpoints[checkpoint // self.stride],),
+            signed[:-1]
+        ))
+        prefix = islice(prefix, first - checkpoint, None)
+
+        # Convert the prefix sums into decrypted bytes, which alternate in
+        # sign in the same way as the encrypted bytes
+
+        decrypted = bytearray(map(MOD_256, map(
+            sub, repeat(self.total, last - first), prefix
+        )))
+        offset = self.scramble_from + first - start
+        result[offset:offset + len(decrypted)] = alternate_signs(
+            decrypted, 1 - first % 2
+        )
+
+        return result
+
+
+# Build a DecryptionIndex for one of the files in GMA_FILES, so we can decrypt
+# windows of the file using C64 addresses rather than offsets
+
+def index_gma_file(name, data_block, stride=256):
+    return DecryptionIndex(data_block, *scramble_range(name), stride=stride)
+
+
+# Return the decrypted bytes from address addr_from up to (but not including)
+# address addr_to, using an index built by index_gma_file
+
+def read_gma_window(name, index, addr_from, addr_to):
+    load_address = GMA_FILES[name]["load_address"]
+    return index.window(addr_from - load_address, addr_to - load_address)
+
+
+def main():
+    if len(sys.argv) != 4:
+        print("Usage: gma_codec.py <file> <from> <to>")
+        sys.exit(1)
+
+    filename = sys.argv[1]
+    addr_from = int(sys.argv[2], 0)
+    addr_to = int(sys.argv[3], 0)
+
+    name = filename.split("/")[-1].split(".")[0]
+
+    if name not in GMA_FILES:
+        print("Unknown file: {} (expected one of {})".format(
+            filename, ", ".join(sorted(GMA_FILES))
+        ))
+        sys.exit(1)
+
+    with open(filename, "rb") as f:
+        data_block = f.read()
+
+    index = index_gma_file(name, data_block)
+    window = read_gma_window(name, index, addr_from, addr_to)
+
+    for n in range(0, len(window), 16):
+        print("{:04X}  {}".format(
+            addr_from + n,
+            binascii.hexlify(window[n:n + 16], " ").decode().upper()
+        ))
+
+
+if __name__ == "__main__":
+    main()
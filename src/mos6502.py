@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+#
+# ******************************************************************************
+#
+# 6502 INSTRUCTION TABLES
+#
+# Written by Mark Moxon
+#
+# This file contains the documented 6502 instruction set as data, with the
+# mnemonic and addressing mode for each opcode, so other scripts can work out
+# how long each instruction is, which bytes are operands, and how many cycles
+# each instruction takes. It also contains a table-driven disassembler that
+# decodes blocks of code using these tables.
+#
+# The addressing modes are as follows (the size includes the opcode):
+#
+#   imp   Implied                   1 byte      e.g. INY
+#   acc   Accumulator               1 byte      e.g. ASL A
+#   imm   Immediate                 2 bytes     e.g. LDA #31
+#   zp    Zero page                 2 bytes     e.g. STA XX4
+#   zpx   Zero page,X               2 bytes     e.g. LDA K3,X
+#   zpy   Zero page,Y               2 bytes     e.g. LDX P,Y
+#   rel   Relative (branches)       2 bytes     e.g. BEQ LL74
+#   indx  Indexed indirect          2 bytes     e.g. LDA (V,X)
+#   indy  Indirect indexed          2 bytes     e.g. LDA (V),Y
+#   abs   Absolute                  3 bytes     e.g. JSR LL155
+#   absx  Absolute,X                3 bytes     e.g. LDA &0100,X
+#   absy  Absolute,Y                3 bytes     e.g. LDA LSX2,Y
+#   ind   Indirect (JMP only)       3 bytes     e.g. JMP (&FFFC)
+#
+# ******************************************************************************
+
+# The size of an instruction in each addressing mode, in bytes
+
+MODE_SIZES = {
+    "imp": 1, "acc": 1,
+    "imm": 2, "zp": 2, "zpx": 2, "zpy": 2, "rel": 2, "indx": 2, "indy": 2,
+    "abs": 3, "absx": 3, "absy": 3, "ind": 3,
+}
+
+# The addressing modes whose operands are full 16-bit addresses
+
+ABSOLUTE_MODES = ("abs", "absx", "absy", "ind")
+
+# The opcodes for each mnemonic, keyed by addressing mode
+
+INSTRUCTIONS = {
+    "ADC": {"imm": 0x69, "zp": 0x65, "zpx": 0x75, "abs": 0x6D, "absx": 0x7D,
+            "absy": 0x79, "indx": 0x61, "indy": 0x71},
+    "AND": {"imm": 0x29, "zp": 0x25, "zpx": 0x35, "abs": 0x2D, "absx": 0x3D,
+            "absy": 0x39, "indx": 0x21, "indy": 0x31},
+    "ASL": {"acc": 0x0A, "zp": 0x06, "zpx": 0x16, "abs": 0x0E, "absx": 0x1E},
+    "BCC": {"rel": 0x90},
+    "BCS": {"rel": 0xB0},
+    "BEQ": {"rel": 0xF0},
+    "BIT": {"zp": 0x24, "abs": 0x2C},
+    "BMI": {"rel": 0x30},
+    "BNE": {"rel": 0xD0},
+    "BPL": {"rel": 0x10},
+    "BRK": {"imp": 0x00},
+    "BVC": {"rel": 0x50},
+    "BVS": {"rel": 0x70},
+    "CLC": {"imp": 0x18},
+    "CLD": {"imp": 0xD8},
+    "CLI": {"imp": 0x58},
+    "CLV": {"imp": 0xB8},
+    "CMP": {"imm": 0xC9, "zp": 0xC5, "zpx": 0xD5, "abs": 0xCD, "absx": 0xDD,
+            "absy": 0xD9, "indx": 0xC1, "indy": 0xD1},
+    "CPX": {"imm": 0xE0, "zp": 0xE4, "abs": 0xEC},
+    "CPY": {"imm": 0xC0, "zp": 0xC4, "abs": 0xCC},
+    "DEC": {"zp": 0xC6, "zpx": 0xD6, "abs": 0xCE, "absx": 0xDE},
+    "DEX": {"imp": 0xCA},
+    "DEY": {"imp": 0x88},
+    "EOR": {"imm": 0x49, "zp": 0x45, "zpx": 0x55, "abs": 0x4D, "absx": 0x5D,
+            "absy": 0x59, "indx": 0x41, "indy": 0x51},
+    "INC": {"zp": 0xE6, "zpx": 0xF6, "abs": 0xEE, "absx": 0xFE},
+    "INX": {"imp": 0xE8},
+    "INY": {"imp": 0xC8},
+    "JMP": {"abs": 0x4C, "ind": 0x6C},
+    "JSR": {"abs": 0x20},
+    "LDA": {"imm": 0xA9, "zp": 0xA5, "zpx": 0xB5, "abs": 0xAD, "absx": 0xBD,
+            "absy": 0xB9, "indx": 0xA1, "indy": 0xB1},
+    "LDX": {"imm": 0xA2, "zp": 0xA6, "zpy": 0xB6, "abs": 0xAE, "absy": 0xBE},
+    "LDY": {"imm": 0xA0, "zp": 0xA4, "zpx": 0xB4, "abs": 0xAC, "absx": 0xBC},
+    "LSR": {"acc": 0x4A, "zp": 0x46, "zpx": 0x56, "abs": 0x4E, "absx": 0x5E},
+    "NOP": {"imp": 0xEA},
+    "ORA": {"imm": 0x09, "zp": 0x05, "zpx": 0x15, "abs": 0x0D, "absx": 0x1D,
+            "absy": 0x19, "indx": 0x01, "indy": 0x11},
+    "PHA": {"imp": 0x48},
+    "PHP": {"imp": 0x08},
+    "PLA": {"imp": 0x68},
+    "PLP": {"imp": 0x28},
+    "ROL": {"acc": 0x2A, "zp": 0x26, "zpx": 0x36, "abs": 0x2E, "absx": 0x3E},
+    "ROR": {"acc": 0x6A, "zp": 0x66, "zpx": 0x76, "abs": 0x6E, "absx": 0x7E},
+    "RTI": {"imp": 0x40},
+    "RTS": {"imp": 0x60},
+    "SBC": {"imm": 0xE9, "zp": 0xE5, "zpx": 0xF5, "abs": 0xED, "absx": 0xFD,
+            "absy": 0xF9, "indx": 0xE1, "indy": 0xF1},
+    "SEC": {"imp": 0x38},
+    "SED": {"imp": 0xF8},
+    "SEI": {"imp": 0x78},
+    "STA": {"zp": 0x85, "zpx": 0x95, "abs": 0x8D, "absx": 0x9D, "absy": 0x99,
+            "indx": 0x81, "indy": 0x91},
+    "STX": {"zp": 0x86, "zpy": 0x96, "abs": 0x8E},
+    "STY": {"zp": 0x84, "zpx": 0x94, "abs": 0x8C},
+    "TAX": {"imp": 0xAA},
+    "TAY": {"imp": 0xA8},
+    "TSX": {"imp": 0xBA},
+    "TXA": {"imp": 0x8A},
+    "TXS": {"imp": 0x9A},
+    "TYA": {"imp": 0x98},
+}
+
+# The mnemonic and addressing mode for each opcode, indexed by opcode, with
+# None for undocumented opcodes
+
+OPCODES = [None] * 256
+
+for mnemonic, modes in INSTRUCTIONS.items():
+    for mode, opcode in modes.items():
+        OPCODES[opcode] = (mnemonic, mode)
+
+# The number of cycles that each group of instructions takes in each
+# addressing mode, not including the extra cycles for taken branches or for
+# crossing a page boundary, where the groups are:
+#
+#   read      Instructions that read memory (a page crossing in absx, absy or
+#             indy adds a cycle)
+#
+#   write     Instructions that write memory (these always take the extra
+#             cycle, so page crossings make no difference)
+#
+#   modify    Read-modify-write instructions
+#
+# Instructions that aren't in any group take the number of cycles given in
+# OTHER_CYCLES, whatever their addressing mode
+
+GROUP_CYCLES = {
+    "read": {"imm": 2, "zp": 3, "zpx": 4, "zpy": 4, "abs": 4, "absx": 4,
+             "absy": 4, "indx": 6, "indy": 5},
+    "write": {"zp": 3, "zpx": 4, "zpy": 4, "abs": 4, "absx": 5, "absy": 5,
+              "indx": 6, "indy": 6},
+    "modify": {"acc": 2, "zp": 5, "zpx": 6, "abs": 6, "absx": 7},
+}
+
+GROUPS = {
+    "read": ("ADC", "AND", "BIT", "CMP", "CPX", "CPY", "EOR", "LDA", "LDX",
+             "LDY", "ORA", "SBC"),
+    "write": ("STA", "STX", "STY"),
+    "modify": ("ASL", "DEC", "INC", "LSR", "ROL", "ROR"),
+}
+
+OTHER_CYCLES = {
+    "BRK": 7, "JSR": 6, "RTI": 6, "RTS": 6,
+    "PHA": 3, "PHP": 3, "PLA": 4, "PLP": 4,
+}
+
+# The addressing modes in which reading instructions take an extra cycle if
+# the effective address is on a different page to the base address
+
+PAGE_CROSSING_MODES = ("absx", "absy", "indy")
+
+# The number of cycles for each opcode, and whether it takes an extra cycle
+# when crossing a page boundary, indexed by opcode, with None for undocumented
+# opcodes (branches take 2 cycles, plus 1 if the branch is taken, plus 1 more
+# if the branch target is on a different page to the next instruction, and
+# JMP takes 3 cycles, or 5 for JMP (ind))
+
+CYCLES = [None] * 256
+PAGE_CROSSING = [False] * 256
+
+for mnemonic, modes in INSTRUCTIONS.items():
+    group = [name for name in GROUPS if mnemonic in GROUPS[name]]
+
+    for mode, opcode in modes.items():
+        if group:
+            CYCLES[opcode] = GROUP_CYCLES[group[0]][mode]
+            PAGE_CROSSING[opcode] = (group[0] == "read"
+                                     and mode in PAGE_CROSSING_MODES)
+        elif mnemonic == "JMP":
+            CYCLES[opcode] = 5 if mode == "ind" else 3
+        else:
+            CYCLES[opcode] = OTHER_CYCLES.get(mnemonic, 2)
+
+
+# Return the size of the instruction with the given opcode, or None if the
+# opcode is undocumented
+
+def instruction_size(opcode):
+    if OPCODES[opcode] is None:
+        return None
+
+    return MODE_SIZES[OPCODES[opcode][1]]
+
+
+# The format of the operand in each addressing mode, in BeebAsm syntax, where
+# the operand is the value of the operand (or the branch target for relative
+# addressing)
+
+OPERAND_FORMATS = {
+    "imp": "", "acc": "A",
+    "imm": "#&{:02X}", "zp": "&{:02X}", "zpx": "&{:02X},X",
+    "zpy": "&{:02X},Y", "indx": "(&{:02X},X)", "indy": "(&{:02X}),Y",
+    "rel": "&{:04X}",
+    "abs": "&{:04X}", "absx": "&{:04X},X", "absy": "&{:04X},Y",
+    "ind": "(&{:04X})",
+}
+
+
+# Decode the instruction at the given offset in a block of data, where address
+# is the runtime address of that offset, returning a tuple of (mnemonic, mode,
+# operand, size), where operand is the value of the operand (the branch target
+# for relative addressing, or None for instructions without an operand)
+#
+# Undocumented opcodes, and instructions that run off the end of the data,
+# are returned as a one-byte EQUB with the byte as the operand
+
+def decode(data_block, offset, address):
+    opcode = data_block[offset]
+    entry = OPCODES[opcode]
+
+    if entry is None or offset + MODE_SIZES[entry[1]] > len(data_block):
+        return ("EQUB", "data", opcode, 1)
+
+    mnemonic, mode = entry
+    size = MODE_SIZES[mode]
+
+    if size == 1:
+        operand = None
+    elif size == 3:
+        operand = data_block[offset + 1] + 256 * data_block[offset + 2]
+    elif mode == "rel":
+        offset_byte = data_block[offset + 1]
+        operand = (address + 2 + offset_byte
+                   - (256 if offset_byte >= 0x80 else 0)) & 0xFFFF
+    else:
+        operand = data_block[offset + 1]
+
+    return (mnemonic, mode, operand, size)
+
+
+# Disassemble the bytes from start up to (but not including) end in a block of
+# data, where address is the runtime address of the start of the data,
+# returning a list of (address, mnemonic, mode, operand, size) tuples
+
+def disassemble(data_block, address, start=0, end=None):
+    if end is None or end > len(data_block):
+        end = len(data_block)
+
+    view = data_block[:end]
+    instructions = []
+    offset = start
+
+    while offset < end:
+        mnemonic, mode, operand, size = decode(view, offset, address + offset)
+        instructions.append((address + offset, mnemonic, mode, operand, size))
+        offset += size
+
+    return instructions
+
+
+# Return an instruction as a string in BeebAsm syntax, such as "LDA #&1F"
+
+def format_instruction(mnemonic, mode, operand):
+    if mode == "data":
+        return "EQUB &{:02X}".format(operand)
+
+    if mode == "imp":
+        return mnemonic
+
+    return "{} {}".format(mnemonic, OPERAND_FORMATS[mode].format(operand))
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+#
+# ******************************************************************************
+#
+# COPY-ON-WRITE OVERLAY IMAGES
+#
+# Written by Mark Moxon
+#
+# An overlay image is a game file that is made up of an immutable base (such as
+# the decrypted gma6 file) with a sparse set of modified ranges on top. Several
+# overlays can share the same base, so when we build the NTSC, PAL and other
+# variants from the same decrypted files, each variant only holds its own
+# patches rather than a full copy of every file.
+#
+# Forking an overlay is O(1), as the fork shares the list of modified ranges
+# with its parent until one of them is written to, at which point the list is
+# copied (the base is never copied).
+#
+# The modified ranges are stored as a sorted list of start offsets, alongside a
+# list of the bytes in each range. Ranges never overlap or touch, as writes
+# that overlap or touch existing ranges are merged into a single range.
+#
+# ******************************************************************************
+
+from __future__ import print_function
+from bisect import bisect_left, bisect_right
+
+
+class OverlayImage(object):
+
+    def __init__(self, base):
+        self.base = bytes(base)
+        self.length = len(self.base)
+        self.starts = []
+        self.chunks = []
+        self.shared = False
+
+    # Return a new overlay with the same base and the same modifications, which
+    # can then be modified independently of this one
+
+    def fork(self):
+        child = OverlayImage.__new__(OverlayImage)
+        child.base = self.base
+        child.length = self.length
+        child.starts = self.starts
+        child.chunks = self.chunks
+        child.shared = True
+        self.shared = True
+        return child
+
+    def __len__(self):
+        return self.length
+
+    # Support reading single bytes and slices, like a bytearray
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, end, step = key.indices(self.length)
+            if step != 1:
+                return self.read(0, self.length)[key]
+            return self.read(start, max(start, end))
+
+        if key < 0:
+            key += self.length
+
+        if not 0 <= key < self.length:
+            raise IndexError("overlay index out of range")
+
+        return self.read(key, key + 1)[0]
+
+    # Return the bytes from offset start up to (but not including) offset end
+
+    def read(self, start, end):
+        result = bytearray(self.base[start:end])
+
+        if len(result) < end - start:
+            result.extend(bytes(end - start - len(result)))
+
+        n = max(0, bisect_right(self.starts, start) - 1)
+
+        while n < len(self.starts) and self.starts[n] < end:
+            chunk_start = self.starts[n]
+            chunk = self.chunks[n]
+            lo = max(start, chunk_start)
+            hi = min(end, chunk_start + len(chunk))
+
+            if lo < hi:
+                result[lo - start:hi - start] = \
+                    chunk[lo - chunk_start:hi - chunk_start]
+
+            n += 1
+
+        return bytes(result)
+
+    # Write a block of bytes at offset start, extending the image if the block
+    # runs past the end
+
+    def write(self, start, data):
+        end = start + len(data)
+
+        if start == end:
+            return
+
+        if self.shared:
+            self.starts = list(self.starts)
+            self.chunks = list(self.chunks)
+            self.shared = False
+
+        # Find the existing ranges that overlap or touch the new block, which
+        # are the ones from lo up to (but not including) hi
+
+        lo = bisect_left(self.starts, start)
+
+        if lo > 0 and self.starts[lo - 1] + len(self.chunks[lo - 1]) >= start:
+            lo -= 1
+
+        hi = bisect_right(self.starts, end)
+
+        # Merge them all into a single range
+
+        merged_start = start
+        merged_end = end
+
+        if lo < hi:
+            merged_start = min(start, self.starts[lo])
+            merged_end = max(end,
+                             self.starts[hi - 1] + len(self.chunks[hi - 1]))
+
+        merged = bytearray(self.read(merged_start, merged_end))
+        merged[start - merged_start:end - merged_start] = data
+
+        self.starts[lo:hi] = [merged_start]
+        self.chunks[lo:hi] = [bytes(merged)]
+        self.length = max(self.length, end)
+
+    # Return a list of (start, end) ranges that have been modified
+
+    def ranges(self):
+        return [(start, start + len(chunk))
+                for start, chunk in zip(self.starts, self.chunks)]
+
+    # Return the number of bytes held in the modified ranges
+
+    def overlay_size(self):
+        return sum(len(chunk) for chunk in self.chunks)
+
+    # Return a flat bytearray containing the base with all the modifications
+    # applied
+
+    def materialize(self):
+        data_block = bytearray(self.base)
+
+        if self.length > len(data_block):
+            data_block.extend(bytes(self.length - len(data_block)))
+
+        for start, chunk in zip(self.starts, self.chunks):
+            data_block[start:start + len(chunk)] = chunk
+
+        return data_block
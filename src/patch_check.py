@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+#
+# ******************************************************************************
+#
+# ELITE FLICKER-FREE PATCH PRECONDITIONS
+#
+# Written by Mark Moxon
+#
+# This module checks that each patch site contains the original instructions
+# that the patch expects to replace, before any patches are applied. Each
+# patch in the manifests (see elite_patches.py) can have a "from" key that
+# contains the original instructions at that address, in the same assembly
+# language as the "From:" comments, such as:
+#
+#   "from": "LDA #31 : STA XX4"
+#
+# We disassemble the code at each patch site (using the disassembler in
+# mos6502.py) and check that the decoded instructions match, with the same
+# mnemonic, a compatible addressing mode and the same operand. Operands can
+# refer to the variables in elite_patches.VARIABLES, which are at the same
+# addresses in every release, and to P% (the address of the instruction).
+#
+# Any other symbols, such as the labels of routines, are bound to whatever
+# value they have the first time they are used at a site, and every other
+# use at that site must agree. Simple expressions like XX15+1 are solved to
+# bind XX15, so later uses of XX15 or XX15+2 are checked against it. This lets
+# us check sites in other releases where the code has moved, but the
+# instructions are the same.
+#
+# A patch can also have a "known" key that contains the instructions that the
+# patch should insert, if the patch has a known defect that we keep so the
+# output matches the reference binaries. The site is still checked against
+# its "from" instructions as usual, and check_defects assembles both the
+# patch and the "known" instructions, reporting a known patch defect if they
+# differ, or a problem if they are the same (as the defect has been fixed, so
+# the "known" key is out of date).
+#
+# The addresses in elite_patches.VARIABLES are also checked against the
+# symbols in the flicker-free source (see check_variables), so a variable
+# can't be given a different address from the one the source uses.
+#
+# All of the sites are checked in one pass, and every site that doesn't match
+# is reported, rather than stopping at the first one. The checks are run by
+# patch_plan.py whenever a manifest is compiled, and the elite-check.py script
+# runs them on a disk image or PRG file and prints a report.
+#
+# ******************************************************************************
+
+import os
+import re
+import asm6502
+import elite_patches
+import mos6502
+
+
+# The flicker-free source file for each platform
+
+SOURCES = {
+    "c64": "elite-flicker-free.asm",
+    "plus4": "elite-flicker-free-plus4.asm",
+}
+
+# The addressing modes that match each form of operand in the "from"
+# instructions, where a bare operand can be zero page, absolute or a branch
+# target
+
+OPERAND_FORMS = [
+    (r"#(.+)$", ("imm",)),
+    (r"\((.+),\s*[Xx]\s*\)$", ("indx",)),
+    (r"\((.+)\)\s*,\s*[Yy]$", ("indy",)),
+    (r"\((.+)\)$", ("ind",)),
+    (r"(.+),\s*[Xx]$", ("zpx", "absx")),
+    (r"(.+),\s*[Yy]$", ("zpy", "absy")),
+    (r"(.+)$", ("zp", "abs", "rel")),
+]
+
+
+# Parse a string of instructions separated by colons, returning a list of
+# (text, mnemonic, modes, expression) tuples, where modes is a tuple of the
+# addressing modes that match the operand and expression is the operand
+# expression (or None if there is no operand)
+
+def parse_instructions(text):
+    instructions = []
+
+    for statement in asm6502.split_outside(text, ":"):
+        statement = statement.strip()
+        mnemonic, _, operand = statement.partition(" ")
+        mnemonic = mnemonic.upper()
+        operand = operand.strip()
+
+        if mnemonic not in mos6502.INSTRUCTIONS:
+            raise asm6502.AsmError("Unknown instruction: {}".format(
+                statement
+            ))
+
+        if operand == "":
+            instructions.append((statement, mnemonic, ("imp", "acc"), None))
+            continue
+
+        if operand.upper() == "A":
+            instructions.append((statement, mnemonic, ("acc",), None))
+            continue
+
+        for pattern, modes in OPERAND_FORMS:
+            match = re.match(pattern, operand)
+            if match:
+                instructions.append((statement, mnemonic, modes,
+                                     match.group(1).strip()))
+                break
+
+    return instructions
+
+
+# Evaluate an operand expression at the given address, returning a tuple of
+# the value and None, or None and the name of the first symbol that isn't in
+# known
+
+def evaluate(expression, address, known):
+    missing = []
+
+    def lookup(name):
+        if name == "P%":
+            return address
+
+        if name in known:
+            return known[name]
+
+        missing.append(name)
+        raise asm6502.UndefinedSymbol("Symbol not defined: {}".format(name))
+
+    try:
+        return (asm6502.Expression(asm6502.tokenize(expression), lookup,
+                                   None).evaluate(), None)
+    except asm6502.UndefinedSymbol:
+        return (None, missing[0])
+
+
+# Check an operand expression against the decoded value, binding the unknown
+# symbol in the expression if there is one, and returning True if they match
+
+def match_operand(expression, value, address, known, bindings):
+    if expression in bindings:
+        return bindings[expression] == value
+
+    expected, name = evaluate(expression, address, known)
+
+    if name is None:
+        return expected == value
+
+    # Try the unknown symbol as 0 and 1, and if the expression goes up by one,
+    # then it is of the form name + constant, so we can solve it for name
+
+    at_zero, other = evaluate(expression, address, dict(known, **{name: 0}))
+    at_one, _ = evaluate(expression, address, dict(known, **{name: 1}))
+
+    if other is None and at_one - at_zero == 1:
+        known[name] = bindings[name] = value - at_zero
+    else:
+        known[expression] = bindings[expression] = value
+
+    return True
+
+
+# Check a single patch site against the "from" instructions in the patch,
+# where data_block is the unmodified file and load_address is the address of
+# the start of the file, returning a tuple of (patch, problem, decoded,
+# bindings), where problem is None if the site matches, decoded is a list of
+# the decoded instructions (as returned by mos6502.disassemble), and bindings
+# is a dictionary of the symbols that were bound
+
+def check_site(patch, data_block, load_address, variables):
+    expected = parse_instructions(patch["from"])
+    start = patch["addr"] - load_address
+    window = bytes(data_block[max(0, start):start + 3 * len(expected)])
+    decoded = mos6502.disassemble(window, patch["addr"])[:len(expected)]
+
+    known = dict(variables)
+    bindings = {}
+    problem = None
+
+    if start < 0 or len(decoded) < len(expected):
+        problem = "{} at 0x{:04X} is outside {}".format(
+            patch["from"], patch["addr"], patch["file"]
+        )
+        return (patch, problem, decoded, bindings)
+
+    for (text, mnemonic, modes, expression), found in zip(expected, decoded):
+        address, found_mnemonic, found_mode, value, _ = found
+
+        if (found_mnemonic == mnemonic and found_mode in modes
+                and (expression is None
+                     or match_operand(expression, value, address, known,
+                                      bindings))):
+            continue
+
+        expected_value, _ = evaluate(expression, address, known) \
+            if expression is not None else (None, None)
+
+        problem = "expected {}{} at 0x{:04X} but found {}".format(
+            text,
+            " (&{:02X})".format(expected_value)
+            if expected_value is not None else "",
+            address,
+            mos6502.format_instruction(found_mnemonic, found_mode, value)
+        )
+        break
+
+    return (patch, problem, decoded, bindings)
+
+
+# Check every patch site in a manifest that has a "from" key, for the given
+# platform, where images is a dictionary of the unmodified files, keyed by
+# filename, and return a list of the results from check_site
+
+def check_manifest(manifest, images, load_addresses, platform=None,
+                   variables=None):
+    if variables is None:
+        variables = elite_patches.VARIABLES
+
+    results = []
+
+    for patch in manifest:
+        if "from" not in patch or patch.get("platform", platform) != platform:
+            continue
+
+        filename = patch["file"]
+
+        try:
+            results.append(check_site(patch, images[filename],
+                                      load_addresses[filename], variables))
+        except asm6502.AsmError as error:
+            results.append((patch, str(error), [], {}))
+
+    return results
+
+
+# Return the results that have problems
+
+def failures(results):
+    return [result for result in results if result[1] is not None]
+
+
+# Return a string of bytes in hexadecimal, such as "85 AA"
+
+def format_bytes(data_block):
+    return " ".join("{:02X}".format(value) for value in data_block)
+
+
+# Check the patches in a manifest that have a known defect, for the given
+# platform, by assembling the patch and the instructions it should insert
+# with the symbols dictionary, and return a list of (patch, defect, problem)
+# tuples, where defect describes the difference if the defect is still there,
+# and problem is set instead if it has gone
+
+def check_defects(manifest, symbols, platform=None):
+    results = []
+
+    for patch in manifest:
+        if "known" not in patch or patch.get("platform",
+                                             platform) != platform:
+            continue
+
+        try:
+            actual = asm6502.assemble(patch["asm"], patch["addr"], symbols)
+            intended = asm6502.assemble(patch["known"], patch["addr"],
+                                        symbols)
+        except asm6502.AsmError as error:
+            results.append((patch, None, str(error)))
+            continue
+
+        if actual == intended:
+            results.append((patch, None, "known defect is no longer there, "
+                            "as {} assembles to the same bytes as {}".format(
+                                patch["asm"], patch["known"])))
+        else:
+            results.append((patch, "inserts {} ({}), not {} "
+                            "({})".format(patch["asm"], format_bytes(actual),
+                                          patch["known"],
+                                          format_bytes(intended)), None))
+
+    return results
+
+
+# Assemble the flicker-free source for a platform ("c64" or "plus4")
+# in-process, returning the assembler
+
+def assemble_source(platform):
+    folder = os.path.dirname(os.path.abspath(__file__))
+    path = os.path.join(folder, SOURCES[platform])
+
+    with open(path) as f:
+        source = f.read()
+
+    assembler = asm6502.Assembler(folder=folder)
+    assembler.assemble(asm6502.source_lines(source, SOURCES[platform]))
+    return assembler
+
+
+# Check the variables that the patches use against the symbols from the
+# flicker-free source for a platform, returning a list of problems for any
+# variable that the source puts at a different address
+
+def check_variables(platform, variables=None):
+    if variables is None:
+        variables = elite_patches.VARIABLES
+
+    symbols = assemble_source(platform).symbols
+
+    return ["{} is &{:02X} in the patches but &{:02X} in {}".format(
+        name, variables[name], symbols[name], SOURCES[platform]
+    ) for name in sorted(variables)
+        if name in symbols and symbols[name] != variables[name]]
+
+
+# Return a report of a list of results as a list of strings, including the
+# decoded instructions for any site with a problem, or for every site if
+# verbose is set
+
+def report(results, verbose=False):
+    lines = []
+
+    for patch, problem, decoded, bindings in results:
+        status = problem or "matches"
+
+        lines.append("{}: patch {} at 0x{:04X} {}".format(
+            patch["file"], patch["name"], patch["addr"], status
+        ))
+
+        if problem is None and not verbose:
+            continue
+
+        for address, mnemonic, mode, value, _ in decoded:
+            lines.append("    0x{:04X}  {}".format(
+                address, mos6502.format_instruction(mnemonic, mode, value)
+            ))
+
+        for name in sorted(bindings):
+            lines.append("    {} = &{:04X}".format(name, bindings[name]))
+
+    return lines
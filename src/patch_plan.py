@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+#
+# ******************************************************************************
+#
+# ELITE FLICKER-FREE PATCH PLANS
+#
+# Written by Mark Moxon
+#
+# This script compiles a patch manifest (see elite_patches.py) into a patch
+# plan, and applies the plan to the game files.
+#
+# Compiling a manifest does the following for each file:
+#
+#   * Disassemble each patch site and check it against the original
+#     instructions in the patch's "from" key (see patch_check.py), reporting
+#     every site that doesn't match
+#
+#   * Convert each patch address into an offset within the file
+#
+#   * Build the bytes for each patch, loading any binary files from BeebAsm,
+#     assembling any inline assembly language (see asm6502.py) and copying any
+#     blocks from the unmodified file
+#
+#   * Check that each patch is being applied on top of the bytes we expect
+#
+#   * Sort the patches by offset and check that none of them overlap
+#
+# The resulting plan can then be applied to each file in a single pass, and it
+# can also tell us which patch is responsible for any given byte.
+#
+# ******************************************************************************
+
+from __future__ import print_function
+from bisect import bisect_right
+import os
+import asm6502
+import patch_check
+
+
+# The exception raised when a manifest cannot be compiled or applied
+
+class PatchError(Exception):
+    pass
+
+
+# A compiled patch plan, which contains a sorted list of patches for each file,
+# with each patch stored as a tuple of (start, end, payload, name), where the
+# patch covers the offsets from start up to (but not including) end
+
+class PatchPlan(object):
+
+    def __init__(self):
+        self.entries = {}
+        self.starts = {}
+
+    # Add the sorted list of patches for one file, checking for overlaps
+
+    def add_file(self, filename, entries):
+        entries = sorted(entries, key=lambda entry: entry[0])
+
+        for previous, entry in zip(entries, entries[1:]):
+            if entry[0] < previous[1]:
+                raise PatchError(
+                    "{}: patch {} at offset 0x{:04X} overlaps {}".format(
+                        filename, entry[3], entry[0], previous[3]
+                    )
+                )
+
+        self.entries[filename] = entries
+        self.starts[filename] = [entry[0] for entry in entries]
+
+    # Return the names of all the files in the plan
+
+    def files(self):
+        return sorted(self.entries)
+
+    # Return a list of (start, end) ranges covered by the patches for a file
+
+    def ranges(self, filename):
+        return [(start, end) for start, end, _, _ in self.entries[filename]]
+
+    # Return the name of the patch that covers the given offset in a file, or
+    # None if the offset is not patched
+
+    def owner(self, filename, offset):
+        entries = self.entries.get(filename, [])
+        n = bisect_right(self.starts.get(filename, []), offset) - 1
+
+        if n >= 0 and offset < entries[n][1]:
+            return entries[n][3]
+
+        return None
+
+    # Return the names of all the patches that cover any of the offsets from
+    # start up to (but not including) end in a file, in order
+
+    def owners(self, filename, start, end):
+        entries = self.entries.get(filename, [])
+        n = max(0, bisect_right(self.starts.get(filename, []), start) - 1)
+        names = []
+
+        while n < len(entries) and entries[n][0] < end:
+            if entries[n][1] > start:
+                names.append(entries[n][3])
+            n += 1
+
+        return names
+
+    # Apply the patches for one file to a bytearray in a single pass, growing
+    # the bytearray first if any patches are appended to the end of the file
+
+    def apply(self, filename, data_block):
+        entries = self.entries.get(filename, [])
+
+        if entries and entries[-1][1] > len(data_block):
+            data_block.extend(bytes(entries[-1][1] - len(data_block)))
+
+        view = memoryview(data_block)
+
+        for start, end, payload, _ in entries:
+            view[start:end] = payload
+
+        view.release()
+
+    # Apply the patches for one file to an OverlayImage, so the patches are
+    # stored in the overlay rather than in a copy of the whole file
+
+    def apply_overlay(self, filename, overlay):
+        for start, _, payload, _ in self.entries.get(filename, []):
+            overlay.write(start, payload)
+
+    # Return a one-line summary of the patches for a file
+
+    def summary(self, filename):
+        entries = self.entries.get(filename, [])
+        size = sum(end - start for start, end, _, _ in entries)
+        return "{} patch{}, {} byte{}".format(
+            len(entries), "" if len(entries) == 1 else "es",
+            size, "" if size == 1 else "s"
+        )
+
+
+# Build the bytes for a single patch, where data_block is the unmodified file
+# and load_address is the address of the start of the file. Binary files are
+# taken from the bins dictionary if they are in there, or are loaded from
+# bin_folder if they aren't. Inline assembly language is assembled at the
+# patch address, using the symbols dictionary for any labels it refers to.
+
+def build_payload(patch, data_block, load_address, bin_folder, bins,
+                  symbols=None):
+    if "bin" in patch:
+        if bins is not None and patch["bin"] in bins:
+            return bytes(bins[patch["bin"]])
+
+        with open(os.path.join(bin_folder, patch["bin"]), "rb") as f:
+            return f.read()
+
+    if "copy_from" in patch:
+        copy_from = patch["copy_from"] - load_address
+        return bytes(data_block[copy_from:copy_from + patch["length"]])
+
+    if "asm" in patch:
+        try:
+            code = asm6502.assemble(patch["asm"], patch["addr"], symbols)
+        except asm6502.AsmError as error:
+            raise PatchError("Patch {}: {}".format(patch["name"], error))
+    else:
+        code = bytes(patch.get("bytes", []))
+
+    return code + b"\xEA" * patch.get("nops", 0)
+
+
+# Compile a manifest into a patch plan for the given platform, where images is
+# a dictionary of the unmodified files, keyed by filename, and load_addresses
+# gives the load address for each file. Binary files from BeebAsm are taken
+# from the bins dictionary (keyed by filename), or loaded from bin_folder, and
+# symbols is a dictionary of the labels that any inline assembly refers to.
+
+def compile_plan(manifest, images, load_addresses, platform=None,
+                 bin_folder=".", bins=None, symbols=None):
+    failures = patch_check.failures(
+        patch_check.check_manifest(manifest, images, load_addresses, platform)
+    )
+
+    if failures:
+        raise PatchError("\n".join(patch_check.report(failures)))
+
+    entries = {}
+
+    for patch in manifest:
+        if patch.get("platform", platform) != platform:
+            continue
+
+        filename = patch["file"]
+        data_block = images[filename]
+        load_address = load_addresses[filename]
+        start = patch["addr"] - load_address
+
+        payload = build_payload(patch, data_block, load_address, bin_folder,
+                                bins, symbols)
+
+        expect = bytes(patch.get("expect", []))
+        found = bytes(data_block[start:start + len(expect)])
+
+        if found != expect:
+            raise PatchError(
+                "{}: patch {} at 0x{:04X} expected {} but found {}".format(
+                    filename,
+                    patch["name"],
+                    patch["addr"],
+                    " ".join("{:02X}".format(b) for b in expect),
+                    " ".join("{:02X}".format(b) for b in found)
+                )
+            )
+
+        entries.setdefault(filename, []).append(
+            (start, start + len(payload), payload, patch["name"])
+        )
+
+    plan = PatchPlan()
+
+    for filename in entries:
+        plan.add_file(filename, entries[filename])
+
+    return plan
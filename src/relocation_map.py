@@ -0,0 +1,552 @@
+#!/usr/bin/env python
+#
+# ******************************************************************************
+#
+# COMMODORE 64 TO PLUS/4 RELOCATION MAP
+#
+# Written by Mark Moxon
+#
+# The Plus/4 version of Elite was converted from the Commodore 64 version, so
+# most of its code is the same as the C64 code, just at a different address.
+# Most of the ship code is $0900 higher in memory than on the C64, and most of
+# the planet code is $08F0 higher, but there are plenty of exceptions, such as
+# BLINE, which is three bytes lower.
+#
+# This script works out these relocations automatically, by aligning the
+# decrypted C64 gma5 and gma6 files against the unpacked Plus/4 binary, and
+# produces a piecewise relocation table that maps each range of C64 addresses
+# to the corresponding Plus/4 addresses. It works like this:
+#
+#   * Seed: build an index of every k-byte sequence (k-mer) in the Plus/4
+#     binary, and look up every k-mer in the C64 file; each k-mer that only
+#     appears once in each file is a seed that pairs a C64 address with a
+#     Plus/4 address, and the difference between them is the seed's diagonal
+#
+#   * Chain: join runs of seeds on the same diagonal into segments, and drop
+#     any segments that are too short to be trusted
+#
+#   * Extend: extend each segment along its diagonal, allowing for mismatched
+#     bytes (as the operands of instructions that refer to relocated code will
+#     be different), and stopping when the mismatches outweigh the matches
+#
+#   * Align: fill the gaps between neighbouring segments with a banded
+#     alignment, which finds the best way of getting from one diagonal to the
+#     other (so it finds where bytes were inserted or removed)
+#
+# The aligned bytes are then gathered into ranges with the same relocation,
+# which form the relocation table.
+#
+# The gma4 file isn't included, as it is moved in memory after it is loaded,
+# so its load addresses aren't the addresses that the code runs at.
+#
+# The relocation table can be used to derive a Plus/4 patch manifest from the
+# C64 manifest (see relocate_manifest), though any patches that are appended
+# to the C64 files, or that contain the addresses of new routines, still need
+# to be placed by hand.
+#
+# Run this script with:
+#
+#   python relocation_map.py <C64 disk image or folder> <Plus/4 file>
+#                            [--json] [--check]
+#
+# where the C64 files are either a .g64 or .d64 disk image or a folder
+# containing the extracted gma5 and gma6 files. Use --check to compare the
+# relocated C64 patch addresses with the Plus/4 patch manifest.
+#
+# ******************************************************************************
+
+from __future__ import print_function
+import argparse
+from bisect import bisect_right
+import json
+import os
+import sys
+import elite_patcher
+import elite_patches
+import elite_releases
+import gma_codec
+
+
+# The C64 files that we align against the Plus/4 binary
+
+SOURCE_FILES = ["gma6", "gma5"]
+
+# The length of the k-mers used for seeds
+
+KMER_LENGTH = 8
+
+# The shortest segment of seeds on a single diagonal that we trust, in bytes
+
+MIN_SEGMENT = 24
+
+# The largest gap between seeds on the same diagonal that we join into one
+# segment, in bytes
+
+MAX_SEED_GAP = 64
+
+# The scores used for extending and aligning (a mismatch only costs a little,
+# as relocated operands don't match), along with the score drop at which we
+# stop extending a segment
+
+MATCH = 2
+MISMATCH = -1
+GAP = -4
+X_DROP = 12
+
+# The largest gap between segments that we fill with a banded alignment, the
+# largest difference between their diagonals, and the extra width of the band
+
+MAX_ALIGN_GAP = 4096
+MAX_ALIGN_SHIFT = 64
+BAND = 4
+
+# The smallest proportion of matching bytes in a range of the relocation table
+
+MIN_IDENTITY = 0.5
+
+
+# Return a dictionary that maps each k-mer in a block of data to a list of the
+# offsets where it appears
+
+def kmer_index(data, k=KMER_LENGTH):
+    index = {}
+
+    for offset in range(len(data) - k + 1):
+        index.setdefault(data[offset:offset + k], []).append(offset)
+
+    return index
+
+
+# Return a sorted list of (source offset, target offset) seeds for the k-mers
+# that appear exactly once in both the source and the target
+
+def find_seeds(source, target, target_index, k=KMER_LENGTH):
+    source_index = kmer_index(source, k)
+    seeds = []
+
+    for kmer, offsets in source_index.items():
+        found = target_index.get(kmer)
+
+        if len(offsets) == 1 and found and len(found) == 1:
+            seeds.append((offsets[0], found[0]))
+
+    return sorted(seeds)
+
+
+# Join runs of seeds on the same diagonal into segments, returning a list of
+# [start, end, diagonal] lists (in source offsets, where the diagonal is the
+# target offset minus the source offset), sorted by start
+
+def chain_seeds(seeds, k=KMER_LENGTH):
+    runs = {}
+
+    for source, target in seeds:
+        diagonal = target - source
+        segment = runs.get(diagonal)
+
+        if segment and source - segment[-1][1] <= MAX_SEED_GAP:
+            segment[-1][1] = source + k
+        else:
+            runs.setdefault(diagonal, []).append([source, source + k,
+                                                  diagonal])
+
+    segments = [segment for found in runs.values() for segment in found
+                if segment[1] - segment[0] >= MIN_SEGMENT]
+
+    # Where segments overlap in the source, keep the longer one and trim the
+    # other, so each source byte is only claimed once
+
+    segments.sort(key=lambda segment: segment[0] - segment[1])
+    claimed = []
+    kept = []
+
+    for start, end, diagonal in segments:
+        for claimed_start, claimed_end in claimed:
+            if start < claimed_end and end > claimed_start:
+                if start >= claimed_start:
+                    start = claimed_end
+                else:
+                    end = min(end, claimed_start)
+
+        if end - start >= MIN_SEGMENT:
+            claimed.append((start, end))
+            kept.append([start, end, diagonal])
+
+    return sorted(kept)
+
+
+# Return the number of bytes that a segment can be extended along its
+# diagonal, going forwards (step = 1) from offset end or backwards (step = -1)
+# from offset start - 1, stopping at limit (a source offset) or when the score
+# drops more than X_DROP below the best score so far
+
+def extend(source, target, position, diagonal, step, limit):
+    score = 0
+    best = 0
+    best_length = 0
+    length = 0
+
+    while position != limit:
+        other = position + diagonal
+
+        if not 0 <= other < len(target):
+            break
+
+        score += MATCH if source[position] == target[other] else MISMATCH
+        length += 1
+
+        if score > best:
+            best = score
+            best_length = length
+        elif best - score > X_DROP:
+            break
+
+        position += step
+
+    return best_length
+
+
+# Align source[start:end] against target[start + first:end + last], where
+# first and last are the diagonals of the segments on either side, using a
+# banded global alignment, and return a list of (source offset, target offset)
+# pairs for the aligned bytes
+
+def banded_align(source, target, start, end, first, last):
+    rows = end - start
+    columns = (end + last) - (start + first)
+    low = min(0, columns - rows) - BAND
+    high = max(0, columns - rows) + BAND
+
+    # Each row of the score table is a dictionary keyed by column, holding the
+    # best score for that cell and the move that got there
+
+    table = []
+
+    for i in range(rows + 1):
+        row = {0: (0, None)} if i == 0 else {}
+        table.append(row)
+
+        for j in range(max(0, i + low), min(columns, i + high) + 1):
+            if i == 0 and j == 0:
+                continue
+
+            options = []
+
+            if i > 0 and (j - 1) in table[i - 1]:
+                same = (source[start + i - 1]
+                        == target[start + first + j - 1])
+                options.append((table[i - 1][j - 1][0]
+                                + (MATCH if same else MISMATCH), "diagonal"))
+
+            if i > 0 and j in table[i - 1]:
+                options.append((table[i - 1][j][0] + GAP, "up"))
+
+            if (j - 1) in row:
+                options.append((row[j - 1][0] + GAP, "left"))
+
+            if options:
+                row[j] = max(options)
+
+    if columns not in table[rows]:
+        return []
+
+    # Trace back through the table to find the aligned bytes
+
+    pairs = []
+    i, j = rows, columns
+
+    while i > 0 or j > 0:
+        move = table[i][j][1]
+
+        if move == "diagonal":
+            i -= 1
+            j -= 1
+            pairs.append((start + i, start + first + j))
+        elif move == "up":
+            i -= 1
+        else:
+            j -= 1
+
+    pairs.reverse()
+    return pairs
+
+
+# Return True if the gap between two neighbouring segments can be filled with
+# a banded alignment
+
+def can_align(previous, following):
+    gap = following[0] - previous[1]
+    shift = following[2] - previous[2]
+
+    return gap <= MAX_ALIGN_GAP and abs(shift) <= MAX_ALIGN_SHIFT \
+        and gap + shift >= 0
+
+
+# Align a source file against a target file, returning a sorted list of
+# (source offset, target offset) pairs for every aligned byte
+
+def align(source, target, target_index=None):
+    if target_index is None:
+        target_index = kmer_index(target)
+
+    segments = chain_seeds(find_seeds(source, target, target_index))
+
+    # Each source byte is only aligned once, so we start with the segments
+    # and then fill in the gaps on either side of them
+
+    mapping = {}
+
+    for start, end, diagonal in segments:
+        for offset in range(start, end):
+            mapping[offset] = offset + diagonal
+
+    for n in range(len(segments) + 1):
+        previous = segments[n - 1] if n > 0 else None
+        following = segments[n] if n < len(segments) else None
+        gap_start = previous[1] if previous else 0
+        gap_end = following[0] if following else len(source)
+
+        # Fill the gap with a banded alignment if the segments on either side
+        # are close enough, or extend them into the gap otherwise
+
+        if previous and following and can_align(previous, following):
+            pairs = banded_align(source, target, gap_start, gap_end,
+                                 previous[2], following[2])
+        else:
+            pairs = []
+
+            if previous:
+                length = extend(source, target, gap_start, previous[2], 1,
+                                gap_end)
+                pairs.extend((offset, offset + previous[2]) for offset
+                             in range(gap_start, gap_start + length))
+
+            if following:
+                length = extend(source, target, gap_end - 1, following[2], -1,
+                                gap_start - 1)
+                pairs.extend((offset, offset + following[2]) for offset
+                             in range(gap_end - length, gap_end))
+
+        for source_offset, target_offset in pairs:
+            mapping.setdefault(source_offset, target_offset)
+
+    return sorted(mapping.items())
+
+
+# A piecewise relocation table, stored as a sorted list of (source file,
+# start, end, delta, matches) tuples, where the addresses from start up to
+# (but not including) end in the source file are found at address + delta in
+# the target, and matches is the number of bytes in the range that are the
+# same in both files
+
+class RelocationTable(object):
+
+    def __init__(self, entries=()):
+        self.entries = sorted(entries)
+        self.index = {}
+
+        for entry in self.entries:
+            self.index.setdefault(entry[0], []).append(entry)
+
+        self.starts = dict((filename, [entry[1] for entry in found])
+                           for filename, found in self.index.items())
+
+    # Return the table entries for the aligned pairs from a source file, by
+    # gathering the pairs into ranges of addresses with the same delta
+
+    @classmethod
+    def from_pairs(cls, filename, pairs, source, target, source_load,
+                   target_load):
+        entries = []
+        current = None
+
+        for source_offset, target_offset in pairs:
+            address = source_load + source_offset
+            delta = (target_load + target_offset) - address
+            same = int(source[source_offset] == target[target_offset])
+
+            if (current and current[2] == address
+                    and current[3] == delta):
+                current[2] += 1
+                current[4] += same
+            else:
+                current = [filename, address, address + 1, delta, same]
+                entries.append(current)
+
+        # Drop any ranges where most of the bytes are different, as these are
+        # unlikely to be the same code
+
+        return [tuple(entry) for entry in entries
+                if entry[4] >= MIN_IDENTITY * (entry[2] - entry[1])]
+
+    # Return the target address for an address in a source file, or None if
+    # the address isn't in the table
+
+    def relocate(self, filename, address):
+        entries = self.index.get(filename, [])
+        n = bisect_right(self.starts.get(filename, []), address) - 1
+
+        if n >= 0 and address < entries[n][2]:
+            return address + entries[n][3]
+
+        return None
+
+    # Return the entries as a list of dictionaries, for saving as JSON
+
+    def to_json(self):
+        return [{
+            "file": filename,
+            "start": "0x{:04X}".format(start),
+            "end": "0x{:04X}".format(end),
+            "delta": delta,
+            "matches": matches,
+        } for filename, start, end, delta, matches in self.entries]
+
+
+# Return the decrypted C64 source files from a disk image or a folder of
+# extracted files
+
+def load_source_files(path):
+    if os.path.isdir(path):
+        files = elite_patcher.load_files(path, SOURCE_FILES)
+    else:
+        files = elite_releases.load_game_files(path)
+
+    return dict((filename, bytes(gma_codec.decrypt_file(filename,
+                                                        files[filename])))
+                for filename in SOURCE_FILES)
+
+
+# Build the relocation table from a dictionary of decrypted C64 files to the
+# Plus/4 binary
+
+def build_table(sources, target,
+                target_file=elite_patcher.PLUS4_FILE,
+                load_addresses=elite_patches.LOAD_ADDRESSES):
+    target_index = kmer_index(target)
+    entries = []
+
+    for filename in SOURCE_FILES:
+        source = sources[filename]
+        pairs = align(source, target, target_index)
+        entries.extend(RelocationTable.from_pairs(
+            filename, pairs, source, target, load_addresses[filename],
+            load_addresses[target_file]
+        ))
+
+    return RelocationTable(entries)
+
+
+# Derive a Plus/4 patch manifest from a C64 manifest by relocating the
+# addresses in each patch, returning a tuple of the relocated patches and the
+# names of the patches that couldn't be relocated (such as patches that are
+# appended to the end of a file). Binary files have bin_suffix inserted before
+# their extension (so shppt.bin becomes shppt-plus4.bin).
+
+def relocate_manifest(manifest, table, target_file=elite_patcher.PLUS4_FILE,
+                      bin_suffix="-plus4"):
+    relocated = []
+    missing = []
+
+    for patch in manifest:
+        if patch["file"] not in SOURCE_FILES:
+            missing.append(patch["name"])
+            continue
+
+        addr = table.relocate(patch["file"], patch["addr"])
+        copy_from = None
+
+        if "copy_from" in patch:
+            copy_from = table.relocate(patch["file"], patch["copy_from"])
+
+        if addr is None or ("copy_from" in patch and copy_from is None):
+            missing.append(patch["name"])
+            continue
+
+        patch = dict(patch, file=target_file, addr=addr)
+
+        if copy_from is not None:
+            patch["copy_from"] = copy_from
+
+        if "bin" in patch:
+            base, extension = os.path.splitext(patch["bin"])
+            patch["bin"] = base + bin_suffix + extension
+
+        relocated.append(patch)
+
+    return relocated, missing
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Map Commodore 64 Elite addresses to Plus/4 addresses"
+    )
+    parser.add_argument("source",
+                        help="C64 disk image or folder of extracted files")
+    parser.add_argument("target", help="unpacked Plus/4 binary")
+    parser.add_argument("--json", action="store_true",
+                        help="print the relocation table as JSON")
+    parser.add_argument("--check", action="store_true",
+                        help="compare the relocated C64 patches with the "
+                        "Plus/4 patch manifest")
+    args = parser.parse_args()
+
+    sources = load_source_files(args.source)
+
+    with open(args.target, "rb") as f:
+        target = f.read()
+
+    table = build_table(sources, target)
+
+    if args.json:
+        print(json.dumps(table.to_json(), indent=2))
+    elif not args.check:
+        for filename, start, end, delta, matches in table.entries:
+            print("{:<5} 0x{:04X}-0x{:04X} -> 0x{:04X}-0x{:04X} "
+                  "{:+05X} ({:.0%} same)".format(
+                      filename, start, end - 1, start + delta,
+                      end - 1 + delta, delta, matches / float(end - start)
+                  ))
+
+    if not args.check:
+        return
+
+    # Compare the relocated C64 patches with the hand-made Plus/4 patches
+    # that have the same names, and flag any patches where the bytes we expect
+    # to patch are different in the Plus/4 binary (such as operands that refer
+    # to relocated code), as these need checking by hand
+
+    relocated, missing = relocate_manifest(elite_patches.C64_PATCHES, table)
+    plus4 = dict((patch["name"], patch)
+                 for patch in elite_patches.PLUS4_PATCHES)
+    errors = 0
+
+    for patch in relocated:
+        expected = plus4.get(patch["name"])
+
+        offset = patch["addr"] - elite_patches.LOAD_ADDRESSES[patch["file"]]
+        expect = bytes(patch.get("expect", []))
+
+        if expected is None:
+            status = "no Plus/4 patch"
+        elif expected["addr"] == patch["addr"]:
+            status = "ok"
+        else:
+            status = "expected 0x{:04X}".format(expected["addr"])
+            errors += 1
+
+        if target[offset:offset + len(expect)] != expect:
+            status += " (patched bytes differ)"
+
+        print("{:<32} 0x{:04X} {}".format(patch["name"], patch["addr"],
+                                          status))
+
+    for name in missing:
+        print("{:<32} {}".format(name, "not relocated"))
+
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
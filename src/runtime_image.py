@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+#
+# ******************************************************************************
+#
+# COMMODORE 64 ELITE RUNTIME MEMORY IMAGE
+#
+# Written by Mark Moxon
+#
+# The Commodore 64 game is spread across the gma4, gma5 and gma6 files, each
+# of which loads at its own address, and the loader moves some of the data
+# around before the game runs. This module builds a 64K image of memory as it
+# is when the game is running, along with a region table that says which file
+# (and which address in that file) each byte came from, so tools that want to
+# look at the game as it sits in memory don't have to rebuild it by hand.
+#
+# The image is built by following the steps in LOADER_STEPS, which load each
+# file at its load address and model the loader's moves (the loader code is at
+# $75E4 in gma4). The moves are copies of memory, so the region table follows
+# each byte to its new home.
+#
+# Before it moves anything, the loader decrypts gma4 in two passes. The first
+# pass covers $75E4 to $865A, which is the range that gma_codec.py decrypts
+# (so the patches in that part of gma4 can be applied), and the second pass
+# uses the same cipher to decrypt $4000 to $758F with a seed of $6C, which we
+# model as a decrypt step. The moves we model are:
+#
+#   * The data from $4000 to $55FF in gma4, which is moved down to $0700 to
+#     $1CFF
+#
+#   * The data from $5600 to $7EFF in gma4, which is moved to $D000 to $F8FF
+#     in the RAM beneath the I/O area, and which contains the ship blueprints
+#     (so the ship blueprint lookup table XX21 is at $D000)
+#
+#   * The data from $7D7A to $8679 in gma4, which is moved to $EF90 to $F88F,
+#     over the top of the end of the previous move
+#
+#   * The sprites, which are loaded as part of gma4 from $7A7A to $7C79, and
+#     are moved to the sprite area at $6800 to $69FF before gma6 is loaded
+#     over the top of the rest of gma4; this is why the extra2.bin routines
+#     are inserted into gma4 at $7C3A, but run at $69C0
+#
+# The loader also clears the screen memory from $4000 to $67FF, so we model
+# that as a fill, and the filled bytes don't belong to any file. Any other data
+# that is loaded as part of gma4 above $6A00 is overwritten by gma6.
+#
+# Images can be built from the decrypted files, or from the patched files (in
+# which case the image is the flicker-free game as it sits in memory).
+#
+# Images are cached in the build cache (see build_cache.py), keyed by a hash
+# of the files they are built from. Each cache entry contains the 64K image as
+# a raw binary file called ram.bin, which is memory-mapped when it is loaded,
+# and the region table in regions.json.
+#
+# Run this script with:
+#
+#   python runtime_image.py <disk image or folder> [--suffix <suffix>]
+#                           [--save <file>]
+#
+# where the folder contains the gma4, gma5 and gma6 files with the given
+# suffix (such as ".decrypted" or ".modified"), or the encrypted files if
+# there is no suffix (in which case they are decrypted first). This prints
+# the region table, and saves the image if --save is given.
+#
+# ******************************************************************************
+
+from __future__ import print_function
+import argparse
+from array import array
+from bisect import bisect_right
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import tempfile
+import build_cache
+import elite_patcher
+import elite_patches
+import elite_releases
+import gma_codec
+
+
+# The steps that the loader takes to put the game into memory, in order, where
+# each step either loads a file at its load address, moves a block of memory
+# (from start up to, but not including, end) to a new address, fills a block
+# of memory with a value, or decrypts a block of memory with the gma cipher
+# and the given seed
+
+LOADER_STEPS = [
+    ("load", "gma4"),
+    ("decrypt", 0x4000, 0x7590, 0x6C),
+    ("move", 0x4000, 0x5600, 0x0700),
+    ("move", 0x5600, 0x7F00, 0xD000),
+    ("fill", 0x4000, 0x6000, 0x00),
+    ("fill", 0x6000, 0x6800, 0x10),
+    ("move", 0x7D7A, 0x867A, 0xEF90),
+    ("move", 0x7A7A, 0x7C7A, 0x6800),
+    ("load", "gma5"),
+    ("load", "gma6"),
+]
+
+# The files that make up the game, in the order they are loaded
+
+GAME_FILES = [step[1] for step in LOADER_STEPS if step[0] == "load"]
+
+# The size of the image
+
+RAM_SIZE = 0x10000
+
+# The names of the files in each cache entry
+
+IMAGE_FILE = "ram.bin"
+REGIONS_FILE = "regions.json"
+
+
+# A runtime memory image, where ram is the 64K image (a bytearray or a
+# memory-mapped file) and regions is a sorted list of (start, end, filename,
+# file address) tuples, where the bytes from start up to (but not including)
+# end came from the given file, starting at the given address in that file
+
+class RuntimeImage(object):
+
+    def __init__(self, ram, regions):
+        self.ram = ram
+        self.regions = regions
+        self.starts = [region[0] for region in regions]
+
+    # Return a (filename, file address) tuple for the byte at an address in
+    # memory, or None if that byte didn't come from any of the files
+
+    def locate(self, address):
+        n = bisect_right(self.starts, address) - 1
+
+        if n >= 0 and address < self.regions[n][1]:
+            start, _, filename, file_address = self.regions[n]
+            return (filename, file_address + address - start)
+
+        return None
+
+    # Return the bytes from start up to (but not including) end
+
+    def read(self, start, end):
+        return bytes(self.ram[start:end])
+
+    # Save the image as a 64K binary file
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.ram)
+
+
+# Build the runtime image from a dictionary of game files (decrypted or
+# patched, including their two-byte PRG headers), keyed by filename
+
+def build_image(files, load_addresses=elite_patches.LOAD_ADDRESSES):
+    ram = bytearray(RAM_SIZE)
+
+    # For each byte of memory we keep track of the file it came from (as an
+    # index into GAME_FILES, plus one, with zero for no file) and its address
+    # in that file
+
+    owners = bytearray(RAM_SIZE)
+    addresses = array("H", bytes(2 * RAM_SIZE))
+
+    for step in LOADER_STEPS:
+        if step[0] == "load":
+            filename = step[1]
+            data_block = files[filename]
+            start = load_addresses[filename] + 2
+            end = min(start + len(data_block) - 2, RAM_SIZE)
+
+            ram[start:end] = data_block[2:2 + end - start]
+            owners[start:end] = bytes([GAME_FILES.index(filename) + 1]
+                                      * (end - start))
+            addresses[start:end] = array("H", range(start, end))
+        elif step[0] == "decrypt":
+            _, start, end, seed = step
+            gma_codec.decrypt(ram, seed, start, end - 1)
+        elif step[0] == "fill":
+            _, start, end, value = step
+
+            ram[start:end] = bytes([value] * (end - start))
+            owners[start:end] = bytes(end - start)
+        else:
+            _, start, end, destination = step
+            length = end - start
+
+            ram[destination:destination + length] = ram[start:end]
+            owners[destination:destination + length] = owners[start:end]
+            addresses[destination:destination + length] = \
+                addresses[start:end]
+
+    # Gather the bytes into regions that came from consecutive addresses in
+    # the same file
+
+    regions = []
+    current = None
+
+    for address in range(RAM_SIZE):
+        owner = owners[address]
+
+        if not owner:
+            current = None
+            continue
+
+        if (current and current[2] == GAME_FILES[owner - 1]
+                and current[3] + (address - current[0]) == addresses[address]):
+            current[1] = address + 1
+        else:
+            current = [address, address + 1, GAME_FILES[owner - 1],
+                       addresses[address]]
+            regions.append(current)
+
+    return RuntimeImage(ram, [tuple(region) for region in regions])
+
+
+# Return the cache key for a set of game files, which covers the contents of
+# the files and the loader steps
+
+def image_key(files):
+    digest = hashlib.sha256()
+    digest.update(repr(LOADER_STEPS).encode("utf-8"))
+
+    for filename in GAME_FILES:
+        digest.update(hashlib.sha256(files[filename]).digest())
+
+    return digest.hexdigest()
+
+
+# Return the runtime image for a set of game files, loading it from the cache
+# if it's there (in which case the image is memory-mapped), or building it
+# and storing it in the cache otherwise
+
+def cached_image(files, cache):
+    key = image_key(files)
+    entry = cache.entry(key)
+    image_path = os.path.join(entry, IMAGE_FILE)
+    regions_path = os.path.join(entry, REGIONS_FILE)
+
+    if not (os.path.isfile(image_path) and os.path.isfile(regions_path)):
+        image = build_image(files)
+        folder = tempfile.mkdtemp()
+
+        try:
+            image.save(os.path.join(folder, IMAGE_FILE))
+
+            with open(os.path.join(folder, REGIONS_FILE), "w") as f:
+                json.dump(image.regions, f)
+
+            cache.store(key, [os.path.join(folder, IMAGE_FILE),
+                              os.path.join(folder, REGIONS_FILE)])
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+
+        # If the cache is too small to keep the image, use the image we built
+
+        if not os.path.isfile(image_path):
+            return image
+    else:
+        os.utime(entry, None)
+
+    with open(regions_path) as f:
+        regions = [tuple(region) for region in json.load(f)]
+
+    with open(image_path, "rb") as f:
+        ram = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    return RuntimeImage(ram, regions)
+
+
+# Load the game files from a disk image, or from a folder containing the
+# files with the given suffix, decrypting any encrypted files
+
+def load_game_files(path, suffix=""):
+    if os.path.isdir(path):
+        files = elite_patcher.load_files(
+            path, [filename + suffix for filename in GAME_FILES]
+        )
+        files = dict((filename, files[filename + suffix])
+                     for filename in GAME_FILES)
+    else:
+        files = elite_releases.load_game_files(path)
+
+    if suffix:
+        return files
+
+    return dict((filename, bytes(gma_codec.decrypt_file(filename,
+                                                        files[filename])))
+                for filename in GAME_FILES)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build the runtime memory image for Commodore 64 Elite"
+    )
+    parser.add_argument("source",
+                        help="disk image or folder of game files")
+    parser.add_argument("--suffix", default="",
+                        help="suffix of the game files in the folder, such "
+                        "as .decrypted or .modified")
+    parser.add_argument("--save", help="save the image as a 64K binary file")
+    parser.add_argument("--cache", default=None,
+                        help="build cache folder (default: .build-cache)")
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    cache = build_cache.BuildCache(args.cache
+                                   or os.path.join(root, ".build-cache"))
+
+    image = cached_image(load_game_files(args.source, args.suffix), cache)
+
+    for start, end, filename, file_address in image.regions:
+        print("0x{:04X}-0x{:04X} {:<5} 0x{:04X}-0x{:04X}{}".format(
+            start, end - 1, filename, file_address,
+            file_address + end - start - 1,
+            " (moved)" if file_address != start else ""
+        ))
+
+    if args.save:
+        image.save(args.save)
+        print("[ Save    ] {}".format(args.save))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+#
+# ******************************************************************************
+#
+# ELITE SIGNATURE SCANNER
+#
+# Written by Mark Moxon
+#
+# This script scans a decrypted game binary for the signatures in
+# elite_signatures.py, and produces a map of the address of each patch site,
+# so the flicker-free patch can be ported to other releases of Elite without
+# having to search memory dumps by hand.
+#
+# All of the signatures are found in a single pass over the binary using the
+# Aho-Corasick algorithm. Signatures can contain wildcards, so for each one we
+# pick its longest run of literal bytes as an anchor, and build an Aho-Corasick
+# automaton from the anchors. Each time the automaton finds an anchor, we check
+# the rest of that signature's literal bytes at the matching position.
+#
+# Run this script with:
+#
+#   python signature_scan.py <file> <load address> [--json]
+#
+# where the file is a decrypted game binary and the load address is the
+# address of the first byte in the file (in hex, including the two-byte PRG
+# header if the file has one). Alternatively, run it with:
+#
+#   python signature_scan.py <file> --gma <gma4|gma5|gma6> [--json]
+#
+# to decrypt an encrypted gma file from the Commodore 64 release first, using
+# the load address and encryption settings for that file in gma_codec.py.
+#
+# ******************************************************************************
+
+from __future__ import print_function
+import argparse
+import json
+import sys
+import elite_signatures
+import gma_codec
+
+
+# Convert a pattern string like "20 ?? ?? A9 08" into a list of bytes, with
+# None for each wildcard
+
+def parse_pattern(text):
+    return [None if token == "??" else int(token, 16)
+            for token in text.split()]
+
+
+# Return a list of (offset, bytes) runs of literal bytes in a parsed pattern
+
+def literal_runs(pattern):
+    runs = []
+    start = None
+
+    for n, value in enumerate(pattern + [None]):
+        if value is not None and start is None:
+            start = n
+        elif value is None and start is not None:
+            runs.append((start, bytes(pattern[start:n])))
+            start = None
+
+    return runs
+
+
+# An Aho-Corasick automaton for a set of signatures
+
+class SignatureScanner(object):
+
+    def __init__(self, signatures=None):
+        if signatures is None:
+            signatures = elite_signatures.SIGNATURES
+
+        self.signatures = []
+
+        # The automaton is stored as a list of states, each of which has a
+        # dictionary of transitions, a failure link and a list of the
+        # signatures whose anchors end at that state
+
+        self.goto = [{}]
+        self.fail = [0]
+        self.found = [[]]
+
+        for signature in signatures:
+            pattern = parse_pattern(signature["pattern"])
+            runs = literal_runs(pattern)
+
+            if not runs:
+                raise ValueError("Signature {} has no literal bytes".format(
+                    signature["name"]
+                ))
+
+            anchor_offset, anchor = max(runs, key=lambda run: len(run[1]))
+
+            index = len(self.signatures)
+            self.signatures.append((signature, len(pattern), anchor_offset,
+                                    len(anchor), runs))
+            self.add_anchor(anchor, index)
+
+        self.build_links()
+
+    # Add an anchor to the trie of anchors
+
+    def add_anchor(self, anchor, index):
+        state = 0
+
+        for value in anchor:
+            if value not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.found.append([])
+                self.goto[state][value] = len(self.goto) - 1
+            state = self.goto[state][value]
+
+        self.found[state].append(index)
+
+    # Build the failure links with a breadth-first walk of the trie, so each
+    # state links to the state for the longest suffix of its anchor prefix
+    # that is also in the trie
+
+    def build_links(self):
+        queue = list(self.goto[0].values())
+
+        while queue:
+            state = queue.pop(0)
+
+            for value, target in self.goto[state].items():
+                queue.append(target)
+
+                link = self.fail[state]
+                while link and value not in self.goto[link]:
+                    link = self.fail[link]
+
+                self.fail[target] = self.goto[link].get(value, 0)
+                self.found[target] = (self.found[target]
+                                      + self.found[self.fail[target]])
+
+    # Scan a block of data, returning a list of (name, offset) tuples for each
+    # patch site found, where offset is the offset of the patch site within
+    # the data
+
+    def scan(self, data):
+        data = bytes(data)
+        goto = self.goto
+        fail = self.fail
+        found = self.found
+        results = []
+        state = 0
+
+        for position, value in enumerate(data):
+            while state and value not in goto[state]:
+                state = fail[state]
+
+            state = goto[state].get(value, 0)
+
+            for index in found[state]:
+                signature, length, anchor_offset, anchor_length, runs = \
+                    self.signatures[index]
+
+                start = position + 1 - anchor_length - anchor_offset
+
+                if start < 0 or start + length > len(data):
+                    continue
+
+                if all(data[start + offset:start + offset + len(run)] == run
+                       for offset, run in runs):
+                    results.append((signature["name"],
+                                    start + signature.get("offset", 0)))
+
+        return results
+
+
+# Return a dictionary that maps each signature name to a sorted list of the
+# addresses where it was found (which is empty if it wasn't found)
+
+def address_map(data, load_address, scanner=None):
+    if scanner is None:
+        scanner = SignatureScanner()
+
+    addresses = dict((signature["name"], [])
+                     for signature, _, _, _, _ in scanner.signatures)
+
+    for name, offset in scanner.scan(data):
+        addresses[name].append(load_address + offset)
+
+    for name in addresses:
+        addresses[name].sort()
+
+    return addresses
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Find the flicker-free patch sites in an Elite binary"
+    )
+    parser.add_argument("file")
+    parser.add_argument("load_address", nargs="?",
+                        help="load address of the file, in hex")
+    parser.add_argument("--gma", choices=sorted(gma_codec.GMA_FILES),
+                        help="decrypt the file as this gma file first")
+    parser.add_argument("--json", action="store_true",
+                        help="print the address map as JSON")
+    args = parser.parse_args()
+
+    with open(args.file, "rb") as f:
+        data = bytearray(f.read())
+
+    if args.gma:
+        load_address = gma_codec.GMA_FILES[args.gma]["load_address"]
+        data = gma_codec.decrypt_file(args.gma, data)
+    elif args.load_address:
+        load_address = int(args.load_address, 16)
+    else:
+        parser.error("give a load address or use --gma")
+
+    addresses = address_map(data, load_address)
+
+    if args.json:
+        print(json.dumps(dict(
+            (name, ["0x{:04X}".format(address) for address in found])
+            for name, found in addresses.items()
+        ), indent=2))
+        return
+
+    for signature in elite_signatures.SIGNATURES:
+        found = addresses[signature["name"]]
+        print("{:<28} {}".format(
+            signature["name"],
+            ", ".join("0x{:04X}".format(address) for address in found)
+            or "not found"
+        ))
+
+    if not any(addresses.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
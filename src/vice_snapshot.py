@@ -0,0 +1,462 @@
+#!/usr/bin/env python
+#
+# ******************************************************************************
+#
+# VICE SNAPSHOT READER AND MEMORY SEARCH
+#
+# Written by Mark Moxon
+#
+# The patch addresses in elite_patches.py were worked out by analysing memory
+# dumps of the running game. This module reads the snapshot files that the
+# VICE emulator saves (.vsf files), so we can search the memory of the running
+# game directly, and match it up with the game files on disk.
+#
+# A VICE snapshot starts with a header that contains the machine name, which
+# is followed by a list of modules, one for each part of the emulated machine.
+# Each module starts with a 22-byte header:
+#
+#   * Bytes 0-15    The module name, padded with zeroes (such as "C64MEM")
+#
+#   * Byte 16       The major version of the module
+#
+#   * Byte 17       The minor version of the module
+#
+#   * Bytes 18-21   The size of the module, including the header
+#
+# We read the 64K of RAM from the memory module, the registers from the CPU
+# module and the video chip registers from the VIC-II or TED module, using the
+# module layouts in MACHINES. The snapshot file is memory-mapped, so we only
+# read the parts of the file that we need.
+#
+# To search the RAM quickly, we build a q-gram index of each snapshot, which
+# records where every sequence of QGRAM_LENGTH bytes appears. To find a
+# pattern, we look up the rarest q-gram in the pattern, and then we only need
+# to check the handful of places where that q-gram appears, so each search
+# takes microseconds rather than a scan of the whole of memory. Patterns use
+# the same format as elite_signatures.py, so "20 ?? ?? A9 08" matches a JSR to
+# anywhere, followed by LDA #8.
+#
+# We can also cross-reference a snapshot with the decrypted game files, by
+# looking up each block of each file in the index. This tells us where each
+# part of each file ends up in memory, even if it has been moved after
+# loading (as happens to parts of gma4), so we can convert an address in the
+# running game into an address in the file that we need to patch.
+#
+# Run this script with:
+#
+#   python vice_snapshot.py <snapshot>... [--find <pattern>]...
+#                           [--gma <disk image or folder>]
+#
+# to print the registers from each snapshot, search them for each pattern, and
+# cross-reference them with the game files from a Commodore 64 disk image or
+# a folder of extracted files.
+#
+# ******************************************************************************
+
+from __future__ import print_function
+import argparse
+import mmap
+import os
+import re
+import struct
+import sys
+import time
+import elite_patcher
+import elite_patches
+import elite_releases
+import gma_codec
+import signature_scan
+
+
+# The magic strings at the start of a snapshot file, and at the start of the
+# optional version block that follows the header in newer snapshots
+
+SNAPSHOT_MAGIC = b"VICE Snapshot File\x1a"
+VERSION_MAGIC = b"VICE Version\x1a"
+
+# The size of a module header
+
+MODULE_HEADER_SIZE = 22
+
+# The size of the RAM in each machine
+
+RAM_SIZE = 0x10000
+
+# The layout of each machine's snapshot, giving the module and offset for the
+# RAM, and the module, offset and size of the video chip registers
+#
+# In the C64MEM module, the RAM follows the CPU port data and direction bytes
+# and the EXROM and GAME lines. In the VIC-II module, the registers follow the
+# chip's internal state (bad line and border flags, the 40-byte colour buffer,
+# the 1K of colour RAM, light pen state, the 40-byte matrix buffer, the sprite
+# DMA mask, the RAM base, and the raster cycle and line), so they start at
+# offset 1119.
+#
+# The Plus/4 modules follow the same pattern, but the TED has no colour RAM
+# and only 32 registers, and the PLUS4MEM module only has the CPU port bytes
+# before the RAM.
+
+MACHINES = {
+    "C64": {
+        "memory": ("C64MEM", 4),
+        "video": ("VIC-II", 1119, 64),
+    },
+    "C64SC": {
+        "memory": ("C64MEM", 4),
+        "video": ("VIC-II", 1119, 64),
+    },
+    "PLUS4": {
+        "memory": ("PLUS4MEM", 2),
+        "video": ("TED", 94, 32),
+    },
+}
+
+# The layout of the MAINCPU module for each (major, minor) module version
+# that we can read: the clock, followed by the A, X, Y and SP registers, the
+# program counter and the status register
+#
+# These versions store the clock as a 32-bit value, but the clock is wider in
+# other versions, which moves the registers, so we reject any version that
+# isn't listed here rather than misreading the registers
+
+CPU_MODULE = "MAINCPU"
+CPU_FORMATS = {
+    (1, 0): "<IBBBBHB",
+    (1, 1): "<IBBBBHB",
+}
+
+# The length of the q-grams in the search index
+
+QGRAM_LENGTH = 4
+
+# The size of the blocks that we look up when cross-referencing game files
+# with a snapshot
+
+BLOCK_SIZE = 32
+
+# The largest number of places that a block can appear in memory before we
+# ignore it when cross-referencing
+
+MAX_COPIES = 4
+
+# The smallest copy of part of a file in memory that we report, in bytes
+
+MIN_COPY_SIZE = 2 * BLOCK_SIZE
+
+
+# The exception raised when a snapshot file can't be read
+
+class SnapshotError(Exception):
+    pass
+
+
+# A VICE snapshot file, which is memory-mapped when it is opened
+
+class Snapshot(object):
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.data[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise SnapshotError("{} is not a VICE snapshot".format(path))
+
+        position = len(SNAPSHOT_MAGIC)
+        self.version = (self.data[position], self.data[position + 1])
+        self.machine = self.read_name(position + 2)
+        position += 18
+
+        if self.data[position:position + len(VERSION_MAGIC)] == VERSION_MAGIC:
+            position += len(VERSION_MAGIC) + 8
+
+        # Build a dictionary of modules, keyed by name, where each module is
+        # a tuple of (major version, minor version, offset of the module data,
+        # size of the module data)
+
+        self.modules = {}
+
+        while position + MODULE_HEADER_SIZE <= len(self.data):
+            name = self.read_name(position)
+            major, minor, size = struct.unpack_from("<BBI", self.data,
+                                                    position + 16)
+
+            if size < MODULE_HEADER_SIZE:
+                raise SnapshotError("{}: bad module size at offset {}".format(
+                    path, position
+                ))
+
+            self.modules[name] = (major, minor,
+                                  position + MODULE_HEADER_SIZE,
+                                  size - MODULE_HEADER_SIZE)
+            position += size
+
+        if self.machine not in MACHINES:
+            raise SnapshotError("{}: unsupported machine {}".format(
+                path, self.machine
+            ))
+
+        self.layout = MACHINES[self.machine]
+
+    def close(self):
+        self.data.close()
+
+    # Read a zero-padded 16-byte name from the file
+
+    def read_name(self, position):
+        name = self.data[position:position + 16].split(b"\x00")[0]
+        return name.decode("ascii", "replace")
+
+    # Return the bytes from offset to offset + length in a module's data
+
+    def module_data(self, name, offset, length):
+        if name not in self.modules:
+            raise SnapshotError("{}: no {} module".format(self.path, name))
+
+        _, _, start, size = self.modules[name]
+
+        if offset + length > size:
+            raise SnapshotError("{}: {} module is too short".format(
+                self.path, name
+            ))
+
+        return self.data[start + offset:start + offset + length]
+
+    # Return the 64K of RAM
+
+    def ram(self):
+        name, offset = self.layout["memory"]
+        return self.module_data(name, offset, RAM_SIZE)
+
+    # Return a dictionary of the CPU registers, using the layout for the
+    # version of the CPU module
+
+    def cpu(self):
+        if CPU_MODULE not in self.modules:
+            raise SnapshotError("{}: no {} module".format(self.path,
+                                                           CPU_MODULE))
+
+        version = self.modules[CPU_MODULE][:2]
+
+        if version not in CPU_FORMATS:
+            raise SnapshotError("{}: unsupported {} module version "
+                                "{}.{}".format(self.path, CPU_MODULE,
+                                               *version))
+
+        cpu_format = CPU_FORMATS[version]
+        values = struct.unpack(cpu_format, self.module_data(
+            CPU_MODULE, 0, struct.calcsize(cpu_format)
+        ))
+
+        return dict(zip(("clock", "a", "x", "y", "sp", "pc", "status"),
+                        values))
+
+    # Return the video chip registers (VIC-II on the C64, TED on the Plus/4)
+
+    def video_registers(self):
+        name, offset, length = self.layout["video"]
+        return self.module_data(name, offset, length)
+
+
+# A q-gram index of a block of memory, which maps each sequence of
+# QGRAM_LENGTH bytes to a list of the addresses where it appears
+
+class QGramIndex(object):
+
+    def __init__(self, data, q=QGRAM_LENGTH):
+        self.data = bytes(data)
+        self.q = q
+        self.positions = {}
+
+        for address in range(len(self.data) - q + 1):
+            self.positions.setdefault(self.data[address:address + q],
+                                      []).append(address)
+
+    # Return a sorted list of the addresses where a pattern appears, where the
+    # pattern is a string like "20 ?? ?? A9 08" or a bytes object
+
+    def find(self, pattern):
+        if isinstance(pattern, (bytes, bytearray)):
+            pattern = list(pattern)
+        else:
+            pattern = signature_scan.parse_pattern(pattern)
+
+        runs = signature_scan.literal_runs(pattern)
+        q = self.q
+
+        # Pick the q-gram in the pattern with the fewest positions, or fall
+        # back to a regular expression if there are no q-grams in the pattern
+
+        best = None
+
+        for offset, run in runs:
+            for n in range(len(run) - q + 1):
+                found = self.positions.get(run[n:n + q], [])
+
+                if best is None or len(found) < len(best[1]):
+                    best = (offset + n, found)
+
+        if best is None:
+            expression = re.compile(b"".join(
+                b"." if value is None else re.escape(bytes([value]))
+                for value in pattern
+            ), re.DOTALL)
+            return [match.start() for match
+                    in re.finditer(b"(?=" + expression.pattern + b")",
+                                   self.data, re.DOTALL)]
+
+        start_offset, candidates = best
+        length = len(pattern)
+        results = []
+
+        for position in candidates:
+            start = position - start_offset
+
+            if start < 0 or start + length > len(self.data):
+                continue
+
+            if all(self.data[start + offset:start + offset + len(run)] == run
+                   for offset, run in runs):
+                results.append(start)
+
+        return results
+
+
+# Return a list of (filename, start, end, running address) tuples that
+# describe where each part of each game file is found in memory, where files
+# is a dictionary of decrypted files and load_addresses gives the load address
+# of each file (including the two-byte PRG header), and the addresses from
+# start up to (but not including) end in each file are found in memory at the
+# running address (a part of a file can appear more than once, if it has been
+# copied)
+
+def cross_reference(index, files, load_addresses, block_size=BLOCK_SIZE):
+    ranges = []
+
+    for filename in sorted(files):
+        data_block = files[filename]
+        load_address = load_addresses[filename]
+
+        # The ranges that the previous block extended, keyed by the
+        # difference between the running address and the file address
+
+        current = {}
+
+        for offset in range(2, len(data_block), block_size):
+            block = bytes(data_block[offset:offset + block_size])
+            address = load_address + offset
+            extended = {}
+
+            # Skip blocks that are mostly the same byte (such as empty space),
+            # and blocks that appear too many times, as they could be anywhere
+
+            found = index.find(block) if len(set(block)) >= 4 else []
+
+            if len(found) > MAX_COPIES:
+                found = []
+
+            for running in found:
+                delta = running - address
+
+                if delta in current:
+                    entry = current[delta]
+                    entry[2] = address + len(block)
+                else:
+                    entry = [filename, address, address + len(block), running]
+                    ranges.append(entry)
+
+                extended[delta] = entry
+
+            current = extended
+
+    # Drop any short copies, as these are likely to be repeated data rather
+    # than code that has been moved
+
+    return sorted(tuple(entry) for entry in ranges
+                  if entry[1] == entry[3]
+                  or entry[2] - entry[1] >= MIN_COPY_SIZE)
+
+
+# Return the decrypted game files from a disk image, a PRG file or a folder
+# of extracted files
+
+def load_game_files(path):
+    if os.path.isdir(path):
+        names = [filename for filename in ("gma1", "gma4", "gma5", "gma6",
+                                           elite_patcher.PLUS4_FILE)
+                 if os.path.isfile(os.path.join(path, filename))]
+        files = elite_patcher.load_files(path, names)
+    else:
+        files = elite_releases.load_game_files(path)
+
+    return dict((filename, gma_codec.decrypt_file(filename, data_block)
+                 if filename in elite_patcher.ENCRYPTED_FILES else data_block)
+                for filename, data_block in files.items()
+                if filename in elite_patches.LOAD_ADDRESSES)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Read and search VICE snapshots of Elite"
+    )
+    parser.add_argument("snapshots", nargs="+")
+    parser.add_argument("--find", action="append", default=[],
+                        help="byte pattern to search for, such as "
+                        "\"20 ?? ?? A9 08\"")
+    parser.add_argument("--gma",
+                        help="disk image, PRG file or folder of game files "
+                        "to cross-reference with the snapshots")
+    args = parser.parse_args()
+
+    files = load_game_files(args.gma) if args.gma else None
+
+    for path in args.snapshots:
+        try:
+            snapshot = Snapshot(path)
+            cpu = snapshot.cpu()
+            registers = snapshot.video_registers()
+            ram = snapshot.ram()
+        except SnapshotError as error:
+            print("[ Error   ] {}".format(error))
+            sys.exit(1)
+
+        print("[ Read    ] {} ({} snapshot {}.{})".format(
+            path, snapshot.machine, *snapshot.version
+        ))
+        print("            PC={pc:04X} A={a:02X} X={x:02X} Y={y:02X} "
+              "SP={sp:02X} P={status:02X} clock={clock}".format(**cpu))
+        print("            {} registers: {}".format(
+            snapshot.layout["video"][0],
+            " ".join("{:02X}".format(value) for value in registers)
+        ))
+
+        start = time.time()
+        index = QGramIndex(ram)
+        print("[ Index   ] {:.3f}s".format(time.time() - start))
+
+        for pattern in args.find:
+            start = time.time()
+            found = index.find(pattern)
+            print("[ Find    ] {}: {} ({:.2f}ms)".format(
+                pattern,
+                ", ".join("0x{:04X}".format(address) for address in found)
+                or "not found",
+                (time.time() - start) * 1000
+            ))
+
+        if files:
+            for filename, start, end, address in cross_reference(
+                    index, files, elite_patches.LOAD_ADDRESSES):
+                print("[ Map     ] {:<5} 0x{:04X}-0x{:04X} at "
+                      "0x{:04X}-0x{:04X}{}".format(
+                          filename, start, end - 1,
+                          address, address + end - start - 1,
+                          " (moved)" if address != start else ""
+                      ))
+
+        snapshot.close()
+
+
+if __name__ == "__main__":
+    main()
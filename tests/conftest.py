@@ -0,0 +1,20 @@
+# ******************************************************************************
+#
+# ELITE FLICKER-FREE TESTS
+#
+# Written by Mark Moxon
+#
+# The modules in src/ are imported by name, in the same way as the scripts
+# import each other, so we add src/ to the path before the tests are run. Run
+# the tests from the repository root with:
+#
+#   python -m pytest -q
+#
+# ******************************************************************************
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, os.path.join(ROOT, "src"))
@@ -0,0 +1,26 @@
+# ******************************************************************************
+#
+# ELITE FLICKER-FREE TEST HELPERS
+#
+# Written by Mark Moxon
+#
+# Paths to the reference binaries and original disks that the tests compare
+# against.
+#
+# ******************************************************************************
+
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+REFERENCE = os.path.join(ROOT, "reference-binaries")
+
+PAL_DISK = os.path.join(ROOT, "original-disks",
+                        "elite[firebird_1986](pal)(v040486).g64")
+
+
+# Return the contents of a file in one of the reference folders
+
+def reference(folder, filename):
+    with open(os.path.join(REFERENCE, folder, filename), "rb") as f:
+        return f.read()
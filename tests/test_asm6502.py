@@ -0,0 +1,48 @@
+# ******************************************************************************
+#
+# TESTS FOR THE 6502 ASSEMBLER
+#
+# Written by Mark Moxon
+#
+# These tests assemble the flicker-free source with asm6502.py and compare
+# the output with the binaries from BeebAsm in the reference folders.
+#
+# ******************************************************************************
+
+import os
+import pytest
+import asm6502
+import patch_check
+from helpers import REFERENCE, reference
+
+
+# Every file saved by the flicker-free source that has a reference binary is
+# identical to it
+
+@pytest.mark.parametrize("platform, folder", [("c64", "pal"),
+                                              ("plus4", "plus4")])
+def test_reference_binaries(platform, folder):
+    outputs = patch_check.assemble_source(platform).outputs()
+    checked = [filename for filename in sorted(outputs)
+               if os.path.isfile(os.path.join(REFERENCE, folder, filename))]
+
+    assert checked
+
+    for filename in checked:
+        assert bytes(outputs[filename]) == reference(folder, filename), \
+            filename
+
+
+# Inline patches assemble branches and labels relative to their address
+
+def test_inline_assembly():
+    symbols = {"CNT": 0xAA, "PATCH1": 0xCD1E}
+
+    assert asm6502.assemble("STA CNT : LDY #0", 0x9FB4, symbols) == \
+        b"\x85\xAA\xA0\x00"
+    assert asm6502.assemble("JSR PATCH1", 0x9000, symbols) == \
+        b"\x20\x1E\xCD"
+    assert asm6502.assemble("BCC P%+4", 0x9000) == b"\x90\x02"
+
+    with pytest.raises(asm6502.AsmError):
+        asm6502.assemble("LDA UNKNOWN", 0x9000)
@@ -0,0 +1,113 @@
+# ******************************************************************************
+#
+# TESTS FOR THE D64 READER AND WRITER
+#
+# Written by Mark Moxon
+#
+# These tests write disk images with d64.py, read them back, and check the
+# directory and the BAM.
+#
+# ******************************************************************************
+
+import random
+import pytest
+import d64
+
+FILES = [
+    ("firebird", bytes(range(256)) * 3, "prg"),
+    ("gma1", b"\x34\x03" + bytes(100), "prg"),
+    ("empty", b"", "prg"),
+    ("exactly 1 block", bytes(d64.SECTOR_SIZE - 2), "seq"),
+    ("gma6", bytes(random.Random("gma6").randrange(256)
+                   for _ in range(25000)), "prg"),
+]
+
+
+# Return the (track, sector) blocks that are marked as used in the BAM of an
+# image, checking that each track's free count matches its bitmap
+
+def used_blocks(image):
+    bam = image.sector(d64.DIRECTORY_TRACK, 0)
+    used = set()
+
+    for track in range(1, d64.TRACK_COUNT + 1):
+        offset = track * 4
+        bitmap = int.from_bytes(bytes(bam[offset + 1:offset + 4]), "little")
+        assert bam[offset] == bin(bitmap).count("1")
+
+        for sector in range(d64.SECTORS_PER_TRACK[track]):
+            if not bitmap & (1 << sector):
+                used.add((track, sector))
+
+    return used
+
+
+# Files written to a disk can be read back, with the right names, types and
+# sizes in the directory, for both layouts
+
+@pytest.mark.parametrize("layout", d64.LAYOUTS)
+def test_round_trip(layout):
+    writer = d64.D64Writer("elite", "fb", layout=layout)
+    writer.add_files(FILES, first=["gma6"])
+    image = d64.D64Image(writer.image())
+
+    assert image.disk_name() == "elite"
+    assert [(entry["name"], entry["type"], entry["blocks"])
+            for entry in image.directory()] == \
+        [(name, file_type, d64.block_count(data))
+         for name, data, file_type in FILES]
+    assert image.read_all_files() == dict((name, data)
+                                          for name, data, _ in FILES)
+    assert image.read_file("gma1") == FILES[1][1]
+
+    with pytest.raises(d64.D64Error):
+        image.read_file("gma2")
+
+
+# The BAM marks exactly the blocks used by the files, the BAM sector and the
+# directory as used, and the free counts match the bitmaps
+
+def test_bam():
+    writer = d64.D64Writer("elite", "fb")
+
+    for name, data, file_type in FILES:
+        writer.add_file(name, data, file_type)
+
+    image = d64.D64Image(writer.image())
+    blocks = set(block for name, _, _ in FILES
+                 for block in writer.layout[name])
+
+    assert sum(len(writer.layout[name]) for name, _, _ in FILES) == \
+        len(blocks)
+    assert used_blocks(image) == blocks | {(d64.DIRECTORY_TRACK, 0),
+                                           (d64.DIRECTORY_TRACK, 1)}
+
+
+# Building the image doesn't change the writer, so it can be built again
+# after adding more files
+
+def test_image_is_repeatable():
+    writer = d64.D64Writer("elite", "fb")
+    writer.add_file("gma1", FILES[1][1])
+    first = writer.image()
+
+    assert writer.image() == first
+
+    writer.add_file("gma6", FILES[4][1])
+    image = d64.D64Image(writer.image())
+
+    assert [entry["name"] for entry in image.directory()] == ["gma1", "gma6"]
+
+
+# The track count is worked out from the image size, with or without error
+# bytes, and other sizes are rejected
+
+def test_track_count():
+    sectors = d64.TRACK_OFFSETS[36] // d64.SECTOR_SIZE
+
+    assert d64.get_track_count(sectors * d64.SECTOR_SIZE) == 35
+    assert d64.get_track_count(sectors * (d64.SECTOR_SIZE + 1)) == 35
+    assert d64.get_track_count(d64.TRACK_OFFSETS[41]) == 40
+
+    with pytest.raises(d64.D64Error):
+        d64.get_track_count(1000)
@@ -0,0 +1,31 @@
+# ******************************************************************************
+#
+# TESTS FOR THE G64 READER
+#
+# Written by Mark Moxon
+#
+# These tests extract the game files from the original PAL disk image and
+# compare them with the reference binaries.
+#
+# ******************************************************************************
+
+import g64
+import elite_releases
+from helpers import PAL_DISK, reference
+
+
+# The files extracted from the original G64 image match the reference files
+
+def test_extract_game_files():
+    files = g64.load_g64(PAL_DISK).read_all_files()
+
+    for name in ("firebird", "byebyejulie", "gma1", "gma3", "gma4", "gma5",
+                 "gma6"):
+        assert files[name] == reference("pal", name)
+
+
+# The extracted files are identified as the PAL release
+
+def test_identify_release():
+    files = elite_releases.load_game_files(PAL_DISK)
+    assert elite_releases.identify(files)["platform"] == "pal"
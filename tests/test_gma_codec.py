@@ -0,0 +1,100 @@
+# ******************************************************************************
+#
+# TESTS FOR THE GMA ENCRYPTION
+#
+# Written by Mark Moxon
+#
+# These tests check gma_codec.py against the encrypted and decrypted gma
+# files in the reference binaries.
+#
+# ******************************************************************************
+
+import random
+import pytest
+import gma_codec
+from helpers import reference
+
+GMA_NAMES = ["gma4", "gma5", "gma6"]
+
+
+# Decrypting each original file gives the decrypted reference file
+
+@pytest.mark.parametrize("name", GMA_NAMES)
+def test_decrypt(name):
+    decrypted = gma_codec.decrypt_file(name, reference("pal", name))
+    assert decrypted == reference("pal", name + ".decrypted")
+
+
+# Encrypting each decrypted file gives the original file, and encrypting each
+# modified file gives the encrypted reference file
+
+@pytest.mark.parametrize("name", GMA_NAMES)
+def test_encrypt(name):
+    for source, target in ((name + ".decrypted", name),
+                           (name + ".modified", name + ".encrypted")):
+        data_block = bytearray(reference("pal", source))
+        gma_codec.encrypt(data_block, *gma_codec.scramble_range(name))
+        assert data_block == reference("pal", target)
+
+
+# Re-encrypting only the modified ranges gives the same result as encrypting
+# the whole file, including ranges at either end of the scrambled range
+
+@pytest.mark.parametrize("name", GMA_NAMES)
+def test_encrypt_ranges(name):
+    seed, scramble_from, scramble_to = gma_codec.scramble_range(name)
+    original = reference("pal", name)
+    rng = random.Random(name)
+
+    ranges = [(scramble_from, scramble_from + 3),
+              (scramble_to - 2, scramble_to + 1)]
+    for _ in range(20):
+        start = rng.randrange(scramble_from, scramble_to)
+        ranges.append((start, start + rng.randint(1, 40)))
+
+    modified = gma_codec.decrypt_file(name, original)
+    for start, end in ranges:
+        modified[start:end] = bytes(rng.randrange(256)
+                                    for _ in range(end - start))
+
+    expected = bytearray(modified)
+    gma_codec.encrypt(expected, seed, scramble_from, scramble_to)
+
+    gma_codec.encrypt_ranges(modified, original, seed, scramble_from,
+                             scramble_to, ranges)
+    assert modified == expected
+
+
+# Decrypting windows through an index gives the same bytes as decrypting the
+# whole file, for windows that start and end inside and outside the scrambled
+# range
+
+@pytest.mark.parametrize("name", GMA_NAMES)
+@pytest.mark.parametrize("stride", [1, 7, 256])
+def test_decryption_index(name, stride):
+    original = reference("pal", name)
+    decrypted = gma_codec.decrypt_file(name, original)
+    index = gma_codec.index_gma_file(name, original, stride)
+    rng = random.Random("{}:{}".format(name, stride))
+
+    windows = [(0, len(original)), (0, 1), (len(original) - 1,
+                                            len(original))]
+    for _ in range(50):
+        start = rng.randrange(len(original))
+        windows.append((start, min(len(original),
+                                   start + rng.randint(0, 600))))
+
+    for start, end in windows:
+        assert index.window(start, end) == decrypted[start:end]
+
+
+# Reading a window by address gives the same bytes as reading it by offset
+
+def test_read_gma_window():
+    original = reference("pal", "gma6")
+    index = gma_codec.index_gma_file("gma6", original)
+    load_address = gma_codec.GMA_FILES["gma6"]["load_address"]
+    decrypted = reference("pal", "gma6.decrypted")
+
+    assert gma_codec.read_gma_window("gma6", index, 0x9FB4, 0x9FB8) == \
+        decrypted[0x9FB4 - load_address:0x9FB8 - load_address]
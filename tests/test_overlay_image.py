@@ -0,0 +1,70 @@
+# ******************************************************************************
+#
+# TESTS FOR THE COPY-ON-WRITE OVERLAY IMAGES
+#
+# Written by Mark Moxon
+#
+# These tests check overlay_image.py against a plain bytearray that has the
+# same writes applied to it.
+#
+# ******************************************************************************
+
+import random
+from overlay_image import OverlayImage
+
+BASE = bytes(range(256)) * 4
+
+
+# Random writes, including ones that overlap, touch and extend the image, give
+# the same result as the same writes to a bytearray, and leave the modified
+# ranges sorted and apart
+
+def test_writes_match_bytearray():
+    rng = random.Random("overlay")
+    overlay = OverlayImage(BASE)
+    expected = bytearray(BASE)
+
+    for _ in range(200):
+        start = rng.randrange(len(BASE) + 16)
+        data = bytes(rng.randrange(256) for _ in range(rng.randint(0, 24)))
+        overlay.write(start, data)
+
+        if start > len(expected):
+            expected.extend(bytes(start - len(expected)))
+        expected[start:start + len(data)] = data
+
+    assert overlay.materialize() == expected
+    assert len(overlay) == len(expected)
+    assert overlay[:] == bytes(expected)
+    assert overlay[10:20] == bytes(expected[10:20])
+    assert overlay[-1] == expected[-1]
+
+    ranges = overlay.ranges()
+    assert all(end < start for (_, end), (start, _) in zip(ranges,
+                                                           ranges[1:]))
+
+
+# Writing to a fork doesn't change its parent, writing to the parent doesn't
+# change the fork, and neither changes the base
+
+def test_fork_isolation():
+    parent = OverlayImage(BASE)
+    parent.write(10, b"\x01\x02\x03")
+    child = parent.fork()
+
+    child.write(11, b"\xFF")
+    parent.write(100, b"\xEE\xEE")
+
+    assert parent[10:13] == b"\x01\x02\x03"
+    assert child[10:13] == b"\x01\xFF\x03"
+    assert child[100:102] == BASE[100:102]
+    assert parent[100:102] == b"\xEE\xEE"
+    assert parent.ranges() == [(10, 13), (100, 102)]
+    assert child.ranges() == [(10, 13)]
+
+    grandchild = child.fork()
+    grandchild.write(0, b"\x00" * 4)
+
+    assert child.ranges() == [(10, 13)]
+    assert grandchild.ranges() == [(0, 4), (10, 13)]
+    assert parent.base is child.base is grandchild.base == BASE